@@ -1,5 +1,48 @@
-from src.app import Scriptorium
+import argparse, json, sys
+from dataclasses import asdict
+
+from src.app import CompanyStore, Scriptorium
+
+COMMANDS = {
+    "scrape": "собрать ID компаний со страниц поиска и user cookie (Chromium)",
+    "download": "скачать xlsx по очереди заданий (Chromium только без живого cookie)",
+    "parse": "прочитать и нормализовать новые или изменённые xlsx",
+    "export": "нормализовать и выгрузить данные в EXPORT_DIR",
+    "store": "добавить новые и обновить изменившиеся компании в STORE_FILE",
+    "run-all": "все этапы подряд (по умолчанию)",
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Сбор данных о российских IT компаниях с list-org.com")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    for command, help in COMMANDS.items():
+        commands.add_parser(command, help=help)
+    query = commands.add_parser("query", help="найти компании в STORE_FILE по ИНН или фильтрам")
+    query.add_argument("--inn")
+    query.add_argument("--region", help="например \"Г. МОСКВА\" или \"ЯРОСЛАВСКАЯ ОБЛАСТЬ\"")
+    query.add_argument("--employees-min", type=int)
+    query.add_argument("--employees-max", type=int)
+    query.add_argument("--limit", type=int, default=50)
+    return parser.parse_args()
+
+
+def query(args: argparse.Namespace) -> int:
+    with CompanyStore() as store:
+        if args.inn:
+            companies = [company for company in [store.get(args.inn)] if company]
+        else:
+            companies = store.find(args.region, args.employees_min, args.employees_max, args.limit)
+        for company in companies:
+            print(json.dumps(asdict(company), ensure_ascii=False))
+    if not companies:
+        print("Компании не найдены", file=sys.stderr)
+        return 1
+    return 0
 
 
 if __name__ == "__main__":
-    Scriptorium().exec()
+    args = parse_args()
+    if args.command == "query":
+        sys.exit(query(args))
+    Scriptorium().exec(args.command or "run-all")
@@ -1,57 +1,325 @@
-import re
-from dataclasses import dataclass, asdict
+from __future__ import annotations  # Аннотации не должны импортировать pandas и playwright
+
+import gzip, hashlib, multiprocessing, pickle, queue, re, shutil, sqlite3, threading, time
+from array import array
+from collections import Counter, deque
+from contextlib import AbstractContextManager, ExitStack, contextmanager, nullcontext, suppress
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import batched, compress
+from dataclasses import dataclass
+from io import BytesIO
 from pathlib import Path
-from typing import override
-
-import requests
-import pandas
-from playwright.sync_api import sync_playwright, Page, Playwright, Cookie
-
-from src.config import CACHE_FILE, DOWNLOAD_DIR, EXPORT_DIR, ITERATIONS
-from src.utils import Base, ReaderJSON
-
-type NormalizedData = list[dict[str, str | int]]
+from typing import TYPE_CHECKING, TextIO, override
+
+from src.config import (
+    BATCH_SIZE_MAX,
+    BATCH_SIZE_MIN,
+    BATCH_SIZE_START,
+    BATCH_SIZE_STEP,
+    BATCH_STATE_FILE,
+    CACHE_BACKEND,
+    CACHE_DB_FILE,
+    CACHE_FILE,
+    CACHE_FLUSH_EVERY,
+    COOKIE_FILE,
+    COOKIE_SESSION_TTL,
+    DOWNLOAD_ARCHIVE,
+    DOWNLOAD_BACKOFF,
+    DOWNLOAD_DIR,
+    DOWNLOAD_PARSE_OVERLAP,
+    DOWNLOAD_RETRIES,
+    DOWNLOAD_TIMEOUT,
+    DOWNLOAD_WORKERS,
+    DOWNLOAD_XLSX,
+    EXPORT_DELTA,
+    EXPORT_DIR,
+    EXPORT_FORMAT,
+    EXPORT_SNAPSHOT,
+    JOBS_FILE,
+    NORMALIZER_MODE,
+    QUERIES,
+    READER_CHUNK_SIZE,
+    READER_WORKERS,
+    RECORDING_DIR,
+    RESPONSE_CACHE,
+    SCRAPER_CAPTCHA_TIMEOUT,
+    SCRAPER_MODE,
+    SCRAPER_POOL_SIZE,
+    SCRAPER_TIMEOUT,
+    SEARCH_PAGES_DIR,
+    STORE_FILE,
+    TRANSPORT,
+    VALIDATION_REJECT_FILE,
+)
+from src.governor import RequestBudgetExceeded, RequestGovernor
+from src.metrics import metrics
+from src.regions import RegionResolver
+from src.response_cache import CachedResponse, ResponseCache
+from src.utils import Base, LazyModule, ReaderJSON
+
+if TYPE_CHECKING:
+    from bs4 import Tag
+    from playwright.sync_api import Cookie, Page, Playwright, Route
+    from src.transport import Recording
+
+bs4 = LazyModule("bs4")
+numpy = LazyModule("numpy")
+openpyxl = LazyModule("openpyxl")
+pandas = LazyModule("pandas")
+playwright = LazyModule("playwright.sync_api")
+requests = LazyModule("requests")
+
+type NormalizedData = CompanyBatch
 
 
 class Scriptorium(Base):
+    """
+    Этапы можно запускать по отдельности (см. main.py): парсинг и экспорт
+    уже скачанных файлов не открывают браузер и не ходят в сеть
+    """
+    stages = {
+        "scrape": "run_scrape",
+        "download": "run_download",
+        "parse": "run_parse",
+        "export": "run_export",
+        "store": "run_store",
+        "run-all": "run",
+    }
+
     def __init__(self) -> None:
-        self.scraper = Scraper()
-        self.link_constructor = LinkConstructor()
+        self.recording = None
+        self.state_dir = None
+        if TRANSPORT != "live":
+            from src.transport import Recording  # Тянет requests, нужен только для записи и воспроизведения
+            self.recording = Recording(TRANSPORT, RECORDING_DIR)
+            self.state_dir = self.recording.state_dir
+            self.download_dir.mkdir(parents=True, exist_ok=True)
+        self.cache = Cache.create(dir=self.state_dir)
+        self.cookie_store = self.recording.cookie_store if self.recording else CookieStore()
+        self.batch_sizer = BatchSizer(self.state_path(BATCH_STATE_FILE))
+        self.job_queue = JobQueue(self.state_path(JOBS_FILE))
+        self.search_pages = SearchPages(self.state_path(SEARCH_PAGES_DIR))
+        self.response_cache = ResponseCache() if RESPONSE_CACHE and not self.recording else None
+        self.governor = None if TRANSPORT == "replay" else RequestGovernor()
+        self.scraper = Scraper.create(
+            self.cache,
+            self.cookie_store,
+            self.job_queue,
+            self.response_cache,
+            self.governor,
+            self.recording,
+            search_pages=self.search_pages,
+        )
+        self.link_constructor = LinkConstructor(self.cache, self.batch_sizer)
+        self.stored_cookie_used = False
 
-    def exec(self) -> None:
-        user_cookie, download_links = self.find_download_links_and_set_cookie()
-        CompanyDataDownloader(user_cookie, download_links).exec()
+    def state_path(self, path: Path) -> Path:
+        """
+        Запуски с записью и воспроизведением держат очередь, кэш, xlsx и
+        выгрузку в папке записи: иначе запись отмечала бы рабочие задания
+        скачанными, а воспроизведению было бы нечего воспроизводить
+        """
+        return self.state_dir.joinpath(path.name) if self.state_dir else path
+
+    def exec(self, stage: str = "run-all") -> None:
+        metrics.start()
+        try:
+            getattr(self, self.stages[stage])()
+        finally:
+            if self.response_cache:
+                self.response_cache.log_stats()
+            self.log(f"Run metrics saved to {metrics.dump()}")
+
+    def run(self) -> None:
+        self.run_download()
+        self.run_store()
+        self.run_export()
+
+    def run_scrape(self) -> None:
+        try:
+            with metrics.span("scrape"):
+                self.scrape()
+        except RequestBudgetExceeded as error:
+            self.log(f"{error}, unfinished pages stay in the job queue", "WARNING")
+
+    def run_download(self) -> None:
+        """Без бюджета реквестов этап заканчивается, а store и export работают с уже скачанным"""
+        try:
+            self.download()
+        except RequestBudgetExceeded as error:
+            self.log(f"{error}, unfinished jobs stay in the job queue", "WARNING")
+
+    def download(self) -> None:
+        if not DOWNLOAD_XLSX:  # Компании берутся из страниц поиска, xlsx не качаются
+            with metrics.span("scrape"):
+                if self.scraper.pending_query_links():
+                    self.scrape()
+            return
+        with metrics.span("scrape"):
+            user_cookie, download_links = self.find_download_links_and_set_cookie()
+        with (
+                StreamingIngest(self.reader(), job_queue=self.job_queue)
+                if DOWNLOAD_PARSE_OVERLAP else nullcontext()
+        ) as ingest:
+            with metrics.span("download"):
+                downloader = CompanyDataDownloader(
+                    user_cookie,
+                    download_links,
+                    job_queue=self.job_queue,
+                    ingest=ingest,
+                    response_cache=self.response_cache,
+                    governor=self.governor,
+                    recording=self.recording,
+                    dir=self.download_dir,
+                )
+                downloader.exec()
+            if downloader.rejected and self.stored_cookie_used:
+                self.log("User cookie was rejected, getting a new one with the browser", "WARNING")
+                self.cookie_store.clear()
+                with metrics.span("scrape"):
+                    user_cookie = self.scrape()
+                with metrics.span("download"):
+                    downloader.retry_rejected(user_cookie)
+            with metrics.span("download"):
+                self.retry_with_smaller_batches(downloader)
+
+    def run_parse(self) -> None:
+        deque(self.ingest(), maxlen=0)  # Только заполняет кэш нормализованных файлов
+
+    def run_export(self) -> None:
+        with (
+                metrics.span("export"),  # Чтение, нормализация и проверка учитываются отдельно
+                Validator(self.state_path(VALIDATION_REJECT_FILE)) as validator,
+        ):
+            exporter = Exporter(validator.stream(self.ingest()), export_dir=self.state_dir)
+            exporter.exec()
+        metrics.add("export", rows=exporter.rows, **exporter.changes)
+
+    def run_store(self) -> None:
+        with (
+                CompanyStore(self.state_path(STORE_FILE)) as store,
+                Validator(self.state_path(VALIDATION_REJECT_FILE)) as validator,
+        ):
+            for batch in validator.stream(self.ingest()):
+                with metrics.span("store"):
+                    changed = store.upsert(batch)
+                metrics.add("store", rows=len(batch), changed=changed)
+            self.log(f"Company store {store.file_path} holds {len(store)} companies")
+
+    def ingest(self) -> Iterator[NormalizedData]:
+        """
+        Строки страниц поиска с ИНН, который уже есть в xlsx, пропускаются:
+        в них короткое название и нет контактов, и CompanyStore иначе
+        перезаписывал бы строку из xlsx при каждом запуске
+        """
+        self.log("Reading and normalizing new or changed .xlsx files")
+        xlsx_inns = set()
+        for batch in IncrementalIngest(self.reader(), job_queue=self.job_queue).exec():
+            xlsx_inns.update(str(inn).zfill(10) for inn in batch.inn)  # В xlsx ИНН бывает числом без ведущего нуля
+            yield batch
+        for batch in self.search_pages.exec():
+            yield batch.select(str(inn).zfill(10) not in xlsx_inns for inn in batch.inn)
 
-        company_data = ReaderExcel().exec()
-        self.log("Reading downloaded .xlsx files")
+    @property
+    def download_dir(self) -> Path | None:
+        """Без записи остаётся папка по умолчанию ReaderExcel и CompanyDataDownloader"""
+        return self.state_dir.joinpath(DOWNLOAD_DIR.name) if self.state_dir else None
 
-        normalized_data = Normalizer(company_data).exec()
-        self.log("Data normalized, load it to companies.csv")
+    def reader(self) -> ReaderExcel:
+        return ReaderExcel(dir=self.download_dir)
 
-        Exporter(normalized_data).exec()
-        self.log("File comapnies.csv created at data/companies.csv")
+    def retry_with_smaller_batches(self, downloader: "CompanyDataDownloader") -> None:
+        """
+        Капча вместо xlsx означает, что в ссылке слишком много ID: пачка
+        уменьшается, и отклонённые ID запрашиваются заново, пока не
+        скачаются или пока пачка не упрётся в минимум. Если всё скачалось с
+        первого раза, в следующий запуск пачка станет больше
+        """
+        if not downloader.rejected:
+            if downloader.download_links:
+                self.batch_sizer.grow()
+            return
+        while downloader.rejected and self.batch_sizer.shrink():
+            self.log(
+                f"{len(downloader.rejected)} links were rejected, retrying with "
+                f"{self.batch_sizer.size} IDs per link",
+                "WARNING"
+            )
+            rejected, downloader.rejected = downloader.rejected, {}
+            download_links = self.job_queue.split_files(rejected, self.link_constructor)
+            downloader.download_many(download_links)
+        if downloader.rejected:
+            self.log(f"{len(downloader.rejected)} links are still rejected", "ERROR")
+
+    def find_download_links_and_set_cookie(self) -> tuple[str, dict[int, str]]:
+        """
+        Если сохранённый user cookie ещё жив и все страницы поиска уже
+        посещены, Chromium не запускается: xlsx качаются сразу по HTTP.
+        Ссылки берутся из очереди заданий: только файлы, которые ещё не
+        скачаны
+        """
+        user_cookie = self.cookie_store.get()
+        if user_cookie and not self.scraper.pending_query_links():
+            self.log("Using stored user cookie, skipping the browser")
+            self.stored_cookie_used = True
+        else:
+            user_cookie = self.scrape()
+        download_links = self.job_queue.assign_files(self.link_constructor)
+        return (user_cookie, download_links)
 
-    def find_download_links_and_set_cookie(self) -> tuple[str, list[str]]:
+    def scrape(self) -> str:
         self.scraper.exec()
-        user_cookie = self.scraper.user_cookie
-        download_links = self.link_constructor.get_download_links()
-        return (user_cookie, download_links)
+        return self.scraper.user_cookie
 
 
 class Scraper(Base):
     base_url = "https://www.list-org.com"
-    pages_to_inspect = ITERATIONS  # Мы делаем 4 реквеста из 10 возможных для сбора данных
     download_button = "a.btn.btn-outline-secondary.m-1"
 
-    def __init__(self) -> None:
+    headless = False
+    timeout = SCRAPER_CAPTCHA_TIMEOUT  # Пользователь проходит капчу в окне браузера, но не бесконечно
+
+    def __init__(
+            self,
+            cache: "Cache | None" = None,
+            cookie_store: "CookieStore | None" = None,
+            job_queue: "JobQueue | None" = None,
+            response_cache: ResponseCache | None = None,
+            governor: RequestGovernor | None = None,
+            recording: "Recording | None" = None,
+            search_pages: "SearchPages | None" = None,
+    ) -> None:
         self.company_ids = []
-        self.link_constructor = LinkConstructor()
-        self.cache = Cache()
+        self.cache = cache or Cache.create()
+        self.cookie_store = cookie_store or CookieStore()
+        self.job_queue = job_queue or JobQueue()
+        self.search_pages = search_pages or SearchPages()
+        self.response_cache = response_cache
+        self.governor = governor
+        self.recording = recording
+        self.link_constructor = LinkConstructor(self.cache)
         self.user_cookie: str | None = None  # User cookie собирается через playwright для дальнейших HTTP реквестов
-
-    @property
-    def inspection_range(self) -> range:
-        return range(1, self.pages_to_inspect + 1)
+        self.user_cookie_expires: float = -1
+
+    @classmethod
+    def create(
+            cls,
+            cache: "Cache | None" = None,
+            cookie_store: "CookieStore | None" = None,
+            job_queue: "JobQueue | None" = None,
+            response_cache: ResponseCache | None = None,
+            governor: RequestGovernor | None = None,
+            recording: "Recording | None" = None,
+            mode: str = SCRAPER_MODE,
+            search_pages: "SearchPages | None" = None,
+    ) -> "Scraper":
+        arguments = (cache, cookie_store, job_queue, response_cache, governor, recording)
+        if mode == "fast":
+            return FastScraper(*arguments, search_pages=search_pages)
+        if mode == "http":
+            return HTTPScraper(*arguments, search_pages=search_pages)
+        return cls(*arguments, search_pages=search_pages)
 
     def exec(self) -> None:
         """
@@ -64,33 +332,109 @@ class Scraper(Base):
         self.log("Company IDS collected")
 
     def find_company_ids(self) -> None:
-        with sync_playwright() as pw:
+        with playwright.sync_playwright() as pw:
             page = self.setup_browser(pw)
-            for page_number in self.inspection_range:
-                try:
-                    self.inspect_page(page, page_number)
-                except ValueError:
-                    continue
-            self.set_user_cookie(page)
+            try:
+                for query_link in self.pending_query_links():
+                    self.inspect_page(page, query_link)
+                self.set_user_cookie(page)
+            finally:
+                self.close_browser(page)
+        self.cache.flush()
 
     def setup_browser(self, pw: Playwright) -> Page:
         self.log("Setting up playwright")
-        browser = pw.chromium.launch(headless=False)
+        browser = pw.chromium.launch(headless=self.headless)
         page = browser.new_page()
+        if self.response_cache:
+            page.route(self.search_page_pattern, self.serve_search_page)
+        if self.recording:
+            self.recording.attach(page.context, self.cookie_store.get())
         return page
 
-    def inspect_page(self, page: Page, page_number: int) -> None:
-        query_link = self.link_constructor.query_link(page_number)
-        self.cache.save_url(query_link)
+    def close_browser(self, page: Page) -> None:
+        browser = page.context.browser
+        page.context.close()
+        browser.close()
+
+    def inspect_page(self, page: Page, query_link: str) -> None:
         self.log(f"Inspecting {query_link}")
 
-        page.goto(query_link, timeout=0)
-        download_link = self.find_download_link(page)
+        try:
+            self.navigate(page, query_link)
+        except playwright.TimeoutError:
+            self.log(f"Timed out opening {query_link}, skipping", "WARNING")
+            self.job_queue.mark_failed(query_link, "navigation timeout")
+            return
+        try:
+            download_link = self.find_download_link(page)
+        except playwright.TimeoutError:
+            self.log(f"No download link on {query_link} in time, skipping", "WARNING")
+            self.job_queue.mark_failed(query_link, "download link timeout")
+            return
+
+        self.save_page(query_link, download_link, page.content())
+
+    def save_page(self, query_link: str, download_link: str, html: str | None = None) -> None:
+        if html is not None:
+            self.search_pages.save(query_link, html, self.job_queue.okved(query_link))
+        company_ids = self.link_constructor.get_company_ids(download_link)
+        with suppress(ValueError):  # Страница могла попасть в кэш до появления очереди заданий
+            self.cache.save_url(query_link)
+        self.job_queue.mark_scraped(query_link, company_ids.split(","))
+        self.company_ids.append(company_ids)
 
-        self.company_ids.append(self.link_constructor.get_company_ids(download_link))
+    @property
+    def search_page_pattern(self) -> re.Pattern:
+        return re.compile(re.escape(f"{self.link_constructor.base_url}/search?"))
+
+    def serve_search_page(self, route: Route) -> None:
+        """
+        Страница поиска из ResponseCache: свежая отдаётся браузеру без
+        запроса, устаревшая перепроверяется. В кэш попадают только страницы
+        со ссылкой на скачивание, капча не кэшируется. Реквест из бюджета
+        списывает navigate до goto: исключение из route callback'а до
+        run_scrape не доходит, а страница осталась бы без ответа. Если
+        страницу отдал кэш, реквест возвращается
+        """
+        request = route.request
+        if request.method != "GET" or request.resource_type != "document":
+            route.continue_()
+            return
+        cached = self.response_cache.get(request.url)
+        if cached and self.response_cache.is_fresh(cached):
+            self.response_cache.count("hits")
+            if self.governor:
+                self.governor.refund()
+            route.fulfill(status=200, content_type=cached.content_type, body=cached.body)
+            return
+        response = route.fetch(headers={**request.headers, **(cached.validators if cached else {})})
+        if self.governor:
+            self.governor.observe_status(response.status, response.headers.get("retry-after"))
+        if response.status == 304 and cached:
+            self.response_cache.refresh(request.url)
+            route.fulfill(status=200, content_type=cached.content_type, body=cached.body)
+            return
+        self.response_cache.count("misses")
+        body = response.body()
+        if response.ok and SearchPageParser(body.decode("utf-8", errors="replace")).download_href():
+            self.response_cache.put(request.url, body, response.headers)
+        route.fulfill(response=response, body=body)
 
     def find_download_link(self, page: Page) -> str:
-        link_elem = page.wait_for_selector(self.download_button, timeout=0)
+        if not self.headless and RequestGovernor.is_captcha(page.content()):
+            self.log(
+                f"Captcha on {page.url}, solve it in the browser window "
+                f"within {self.timeout / 1000:.0f}s", "WARNING"
+            )
+        try:
+            link_elem = page.wait_for_selector(self.download_button, timeout=self.timeout)
+        except playwright.TimeoutError:
+            if self.governor:
+                self.governor.observe_page(RequestGovernor.is_captcha(page.content()))
+            raise
+        if self.governor:
+            self.governor.observe_page(False)
         href = link_elem.get_attribute("href")
         download_link = f"{self.base_url}{href}"
         self.link_constructor.save_company_ids(download_link)
@@ -103,10 +447,27 @@ class Scraper(Base):
             self.update_cookies(page)
             user_cookie = self.get_user_cookie(page)
         self.user_cookie = user_cookie
+        if user_cookie:
+            self.cookie_store.save(user_cookie, self.user_cookie_expires)
 
     def update_cookies(self, page: Page) -> None:
         company_page = self.link_constructor.random_company_page_link
-        page.goto(company_page, timeout=0)
+        self.navigate(page, company_page)
+
+    def navigate(self, page: Page, url: str, **kwargs) -> None:
+        served_by_cache = self.response_cache and self.search_page_pattern.match(url)
+        if self.governor:
+            self.governor.acquire()
+        started = time.perf_counter()
+        try:
+            response = page.goto(url, timeout=self.timeout, **kwargs)
+        except playwright.TimeoutError:
+            metrics.record_request("playwright", time.perf_counter() - started, "timeout")
+            raise
+        status = response.status if response else None
+        metrics.record_request("playwright", time.perf_counter() - started, status)
+        if self.governor and status and not served_by_cache:  # Статус настоящего ответа видит serve_search_page
+            self.governor.observe_status(status, response.headers.get("retry-after"))
 
     def get_user_cookie(self, page: Page) -> str | None:
         cookies = page.context.cookies()
@@ -116,15 +477,276 @@ class Scraper(Base):
     def get_user_cookie_from_headers(self, cookies: list[Cookie]) -> str | None:
         cookie = next((c for c in cookies if c.get("name") == "user"), None)
         if cookie:
+            self.user_cookie_expires = cookie.get("expires", -1)
             return cookie.get("value")
 
+    def pending_query_links(self) -> list[str]:
+        self.job_queue.sync(self.link_constructor, self.cache)
+        return self.job_queue.pending_query_links()
+
+
+class FastScraper(Scraper):
+    """
+    Быстрый режим: headless Chromium, без картинок, шрифтов, стилей и
+    аналитики, несколько вкладок в одном контексте. Навигации запускаются
+    во всех вкладках пачки сразу, а ссылки на скачивание собираются после.
+    Страница, не загрузившаяся за timeout, пропускается и не помечается
+    посещённой, поэтому попадёт в следующий запуск
+    """
+    headless = True
+    timeout = SCRAPER_TIMEOUT
+    blocked_resource_types = {"image", "font", "stylesheet", "media"}
+    blocked_hosts = (
+        "google-analytics.com",
+        "googletagmanager.com",
+        "doubleclick.net",
+        "mc.yandex.ru",
+        "top-fwz1.mail.ru",
+    )
+
+    @override
+    def __init__(
+            self,
+            cache: "Cache | None" = None,
+            cookie_store: "CookieStore | None" = None,
+            job_queue: "JobQueue | None" = None,
+            response_cache: ResponseCache | None = None,
+            governor: RequestGovernor | None = None,
+            recording: "Recording | None" = None,
+            pool_size: int = SCRAPER_POOL_SIZE,
+            search_pages: "SearchPages | None" = None,
+    ) -> None:
+        super().__init__(cache, cookie_store, job_queue, response_cache, governor, recording, search_pages)
+        self.pool_size = pool_size
+
+    @override
+    def find_company_ids(self) -> None:
+        with playwright.sync_playwright() as pw:
+            self.log("Setting up headless playwright")
+            browser = pw.chromium.launch(headless=self.headless)
+            try:
+                context = browser.new_context()
+                context.route("**/*", self.block_resources)
+                if self.response_cache:  # Обработчик, добавленный позже, вызывается первым
+                    context.route(self.search_page_pattern, self.serve_search_page)
+                if self.recording:
+                    self.recording.attach(context, self.cookie_store.get())
+                pages = [context.new_page() for _ in range(self.pool_size)]
+                for query_links in batched(self.pending_query_links(), self.pool_size):
+                    self.inspect_pages(list(zip(pages, query_links)))
+                self.set_user_cookie(pages[0])
+                context.close()
+            finally:
+                browser.close()
+        self.cache.flush()
+
+    def inspect_pages(self, pages: list[tuple[Page, str]]) -> None:
+        loading = []
+        for page, query_link in pages:
+            self.log(f"Inspecting {query_link}")
+            try:
+                self.navigate(page, query_link, wait_until="commit")
+                loading.append((page, query_link))
+            except playwright.TimeoutError:
+                self.log(f"Timed out opening {query_link}, skipping", "WARNING")
+                self.job_queue.mark_failed(query_link, "navigation timeout")
+        for page, query_link in loading:
+            try:
+                download_link = self.find_download_link(page)
+            except playwright.TimeoutError:
+                self.log(f"No download link on {query_link} in time, skipping", "WARNING")
+                self.job_queue.mark_failed(query_link, "download link timeout")
+                continue
+            self.save_page(query_link, download_link, page.content())
+
+    @override
+    def set_user_cookie(self, page: Page) -> None:
+        try:
+            super().set_user_cookie(page)
+        except playwright.TimeoutError:
+            self.log("Timed out getting the user cookie", "WARNING")
+
+    def block_resources(self, route: Route) -> None:
+        request = route.request
+        if (
+                request.resource_type in self.blocked_resource_types
+                or any(host in request.url for host in self.blocked_hosts)
+        ):
+            route.abort()
+        else:
+            route.continue_()
+
+
+class HTTPScraper(Scraper):
+    """
+    Страницы поиска запрашиваются обычным HTTP с сохранённым user cookie, без
+    Chromium: ссылка на скачивание и строки компаний берутся из одного и того
+    же HTML. Без живого cookie или после капчи оставшиеся страницы проходит
+    Scraper с браузером
+    """
+    @override
+    def find_company_ids(self) -> None:
+        user_cookie = self.cookie_store.get()
+        if user_cookie:
+            with requests.Session() as session:
+                session.headers.update({"User-Agent": "Mozilla/5.0", "Cookie": f"user={user_cookie}"})
+                if self.recording:
+                    self.recording.mount(session)
+                for query_link in self.pending_query_links():
+                    if not self.fetch_page(session, query_link):
+                        break
+            self.cache.flush()
+            if not self.job_queue.pending_query_links():
+                self.user_cookie = user_cookie
+                return
+        super().find_company_ids()
+
+    def fetch_page(self, session: requests.Session, query_link: str) -> bool:
+        cached = self.response_cache.get(query_link) if self.response_cache else None
+        if cached and self.response_cache.is_fresh(cached):
+            self.log(f"Using cached {query_link}")
+            self.response_cache.count("hits")
+            return self.read_page(query_link, cached.body)
+        self.log(f"Fetching {query_link}")
+        if self.governor:
+            self.governor.acquire()
+        started = time.perf_counter()
+        try:
+            response = session.get(
+                query_link, headers=cached.validators if cached else {}, timeout=DOWNLOAD_TIMEOUT
+            )
+        except requests.RequestException as error:
+            metrics.record_request("http", time.perf_counter() - started, type(error).__name__)
+            self.log(f"Failed to fetch {query_link} ({error})", "WARNING")
+            return False
+        metrics.record_request("http", time.perf_counter() - started, response.status_code)
+        if self.governor:
+            self.governor.observe_status(response.status_code, response.headers.get("Retry-After"))
+        if response.status_code == 304 and cached:
+            self.response_cache.refresh(query_link)
+            return self.read_page(query_link, cached.body)
+        if self.response_cache:
+            self.response_cache.count("misses")
+        found = response.ok and self.read_page(query_link, response.content)
+        if self.governor and response.ok:
+            self.governor.observe_page(not found and RequestGovernor.is_captcha(response.content))
+        if not found:
+            self.log(f"No download link on {query_link}, probably a captcha", "WARNING")
+            return False
+        if self.response_cache:
+            self.response_cache.put(query_link, response.content, response.headers)
+        return True
+
+    def read_page(self, query_link: str, body: bytes) -> bool:
+        html = body.decode("utf-8", errors="replace")  # list-org отдаёт страницы в UTF-8
+        href = SearchPageParser(html).download_href()
+        if not href:
+            return False
+        download_link = f"{self.base_url}{href}"
+        self.link_constructor.save_company_ids(download_link)
+        self.save_page(query_link, download_link, html)
+        return True
+
+
+class SearchPages(Base):
+    """
+    HTML посещённых страниц поиска, по файлу {sha1}.{ОКВЭД}.html.gz на
+    страницу. Строки компаний из них достаются без отдельного реквеста за
+    xlsx. У страниц, сохранённых без ОКВЭД в имени, он из запроса по
+    умолчанию
+    """
+    def __init__(self, dir: Path = SEARCH_PAGES_DIR) -> None:
+        self.dir = dir
+
+    def save(self, query_link: str, html: str, okved: int | None = None) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        name = hashlib.sha1(query_link.encode()).hexdigest()
+        file = self.dir.joinpath(f"{name}.{okved or LinkConstructor.okved}.html.gz")
+        temp_file = file.with_suffix(".tmp")
+        temp_file.write_bytes(gzip.compress(html.encode()))
+        temp_file.replace(file)
+        self.dir.joinpath(f"{name}.html.gz").unlink(missing_ok=True)
+
+    def exec(self) -> Iterator[NormalizedData]:
+        files = sorted(self.dir.glob("*.html.gz")) if self.dir.exists() else []
+        rows = 0
+        for file in files:
+            parts = file.name.split(".")
+            okved = int(parts[1]) if len(parts) == 4 else LinkConstructor.okved
+            with metrics.span("normalize"):
+                html = gzip.decompress(file.read_bytes()).decode()
+                batch = SearchPageParser(html).exec().with_okved(okved)
+            rows += len(batch)
+            metrics.add("normalize", pages=1)
+            yield batch
+        self.log(f"Extracted {rows} companies from {len(files)} search pages")
+
+
+class SearchPageParser:
+    """
+    Строки компаний со страницы выдачи list-org.com: название из ссылки на
+    карточку, ИНН, сотрудники и юридический адрес из подписанных полей.
+    Телефонов и сайтов в выдаче нет, они остаются пустыми до xlsx
+    """
+    row_selector = "div.org_list p"
+    company_link = "a[href^='/company/']"
+    fields = {"инн": "inn", "юр.адрес": "address", "адрес": "address", "сотрудник": "employees"}
+
+    def __init__(self, html: str) -> None:
+        self.soup = bs4.BeautifulSoup(html, "html.parser")
+
+    def exec(self) -> NormalizedData:
+        return CompanyBatch.from_records(
+            record
+            for row in self.soup.select(self.row_selector)
+            if (record := self.parse_row(row))
+        )
+
+    def download_href(self) -> str | None:
+        link = self.soup.select_one(Scraper.download_button)
+        return link.get("href") if link else None
+
+    def parse_row(self, row: Tag) -> CompanyData | None:
+        link = row.select_one(self.company_link)
+        if not link:
+            return None
+        fields = self.parse_fields(row)
+        blank = Normalizer.blank
+        employees = re.sub(r"\D", "", fields.get("employees", ""))
+        return CompanyData(
+            inn=fields.get("inn", blank).split("/")[0].strip() or blank,
+            name=link.get_text(" ", strip=True) or blank,
+            employees=int(employees or 0),  # 0 — неизвестно, в CompanyStore не затирает число из xlsx
+            region=Normalizer.regions.resolve(fields.get("address", blank)),
+            contacts=blank,
+            site=blank,
+        )
+
+    def parse_fields(self, row: Tag) -> dict[str, str]:
+        fields = {}  # Из <span><i>инн/кпп</i>: 7701234567/770101001</span> и подобных
+        for span in row.find_all("span"):
+            label, separator, value = span.get_text(" ", strip=True).partition(":")
+            if not separator:
+                continue
+            label = label.strip().lower()
+            field = next(
+                (field for prefix, field in self.fields.items() if label.startswith(prefix)), None
+            )
+            if field and value.strip():
+                fields.setdefault(field, value.strip())
+        return fields
+
 
 class LinkConstructor:
     base_url = "https://www.list-org.com"
+    source = "www.list-org.com"  # Колонка source у компаний из list-org
     okved = 62  # Сюда включены все подкоды 'Разработка компьютерного программного обеспечения, консультационные услуги в данной области и другие сопутствующие услуги (62)'
 
-    def __init__(self) -> None:
-        self.cache = Cache()
+    def __init__(
+            self, cache: "Cache | None" = None, batch_sizer: "BatchSizer | None" = None
+    ) -> None:
+        self.cache = cache or Cache.create()
+        self.batch_sizer = batch_sizer or BatchSizer()
 
     @property
     def download_link_prefix(self) -> str:
@@ -138,19 +760,25 @@ class LinkConstructor:
         """
         return "".join([self.base_url, "/company/", self.cache.first_company_id])
 
-    def query_link(self, page: int) -> str:
+    def query_link(
+            self,
+            page: int,
+            okved: int | None = None,
+            staff_min: int = 100,
+            staff_max: int | None = None,
+    ) -> str:
+        staff_max_param = f"staff_max={staff_max}&" if staff_max else ""
         query_link = (
             f"{self.base_url}/"
-            f"search?type=all&work=on&staff_min=100&"
-            f"okved={self.okved}&"
+            f"search?type=all&work=on&staff_min={staff_min}&{staff_max_param}"
+            f"okved={okved or self.okved}&"
             f"sort=staff&page={page}"
         )
         return query_link
 
     def save_company_ids(self, download_link: str) -> None:
         company_ids = self.get_company_ids(download_link)
-        for id in company_ids.split(","):
-            self.cache.save_company_ids(id)
+        self.cache.extend_company_ids(company_ids.split(","))
 
     def get_company_ids(self, download_link: str) -> str:
         """
@@ -165,28 +793,35 @@ class LinkConstructor:
         company_ids = match.group(1)
         return company_ids
 
-    def get_download_links(self, amount: int = 100) -> list[str]:
+    def get_download_links(
+            self, amount: int | None = None, batch_size: int | None = None
+    ) -> list[str]:
         """
         List-org.com определяет запросы от ботов и не даёт запросить скачивание
         более 100 файлов и выдаёт капчу. Когда пробуешь вставлять эти же ссылки
         вручную, то капча не срабатывает. В какие-то дни у меня получалось
-        скачать 2 файла на 200 записей и 3 файла на 250 записей, но для
-        безопасности я решил оставить 100, потому что это работает всегда
-        """
-        company_ids = self.cache.load()["company_ids"]
-        download_links = []
-        iterations = amount // 100
-        for iteration in range(iterations):
-            self.populate_download_links(company_ids, iteration, download_links)
-        return download_links
+        скачать 2 файла на 200 записей и 3 файла на 250 записей, поэтому
+        размер пачки подбирается BatchSizer: растёт после удачных запусков и
+        уменьшается при капче. Ссылки покрывают все ID из кэша (или первые
+        amount), последняя пачка может быть неполной
+        """
+        company_ids = self.cache.load()["company_ids"][:amount]
+        return self.populate_download_links(company_ids, batch_size or self.batch_sizer.size)
+
+    def split_download_links(self, download_links: Iterable[str]) -> list[str]:
+        company_ids = [
+            id
+            for download_link in download_links
+            for id in self.get_company_ids(download_link).split(",")
+        ]
+        return self.populate_download_links(company_ids, self.batch_sizer.size)
 
-    def populate_download_links(
-            self, company_ids: list[str], iteration: int, download_links: list
-    ) -> None:
-        start = iteration * 100
-        end = (iteration + 1) * 100
-        link = self.construct_download_link(company_ids[start:end])
-        download_links.append(link)
+    def populate_download_links(self, company_ids: list[str], batch_size: int) -> list[str]:
+        return [
+            self.construct_download_link(list(batch))
+            for batch
+            in batched(company_ids, batch_size)
+        ]
 
     def construct_download_link(self, company_ids: list[str]) -> str:
         joined_ids = ",".join(company_ids)
@@ -194,35 +829,488 @@ class LinkConstructor:
 
 
 class Cache(Base, ReaderJSON):
+    """
+    Кэш посещённых страниц и ID компаний в cache.json. Файл читается один раз,
+    дубликаты отсекаются по множествам, а на диск содержимое пишется пачками
+    (раз в flush_every изменений или при явном вызове flush)
+    """
+    sections = ("referers", "company_ids")
+
     @override
-    def __init__(self, file_path: Path = CACHE_FILE) -> None:
+    def __init__(
+            self, file_path: Path = CACHE_FILE, flush_every: int = CACHE_FLUSH_EVERY
+    ) -> None:
         super().__init__(file_path)
+        self.flush_every = flush_every
+        self.content: dict[str, list[str]] | None = None
+        self.index: dict[str, set[str]] = {}
+        self.pending = 0
+
+    def __enter__(self) -> "Cache":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.flush()
+
+    @classmethod
+    def create(cls, backend: str = CACHE_BACKEND, dir: Path | None = None) -> "Cache":
+        """dir заменяет папку файла кэша, например у записи и воспроизведения"""
+        if backend == "sqlite":
+            return SQLiteCache(dir.joinpath(CACHE_DB_FILE.name)) if dir else SQLiteCache()
+        return cls(dir.joinpath(CACHE_FILE.name)) if dir else cls()
 
     @property
     def first_company_id(self) -> str:
         return self.load()["company_ids"][0]
 
+    @override
+    def load(self) -> dict:
+        content = self.get_content()
+        return {section: list(content[section]) for section in self.sections}
+
+    @override
+    def dump(self, data: dict) -> None:
+        self.set_content(data)
+        self.pending = 0
+        super().dump(self.content)
+
+    def flush(self) -> None:
+        if self.pending:
+            self.dump(self.content)
+
     def save_url(self, url: str) -> None:
-        content = self.load()
-        if url not in content["referers"]:
-            content["referers"].append(url)
-        else:
+        if not self.add("referers", url):
             raise ValueError("Url is visited")
-        self.dump(content)
+        self.flush()  # Посещённые страницы пишем сразу, на них держится resume
 
     def save_company_ids(self, id: str) -> None:
+        self.add("company_ids", id)
+        self.flush_if_needed()
+
+    def extend_company_ids(self, ids: Iterable[str]) -> None:
+        for id in ids:
+            self.add("company_ids", id)
+        self.flush_if_needed()
+
+    def add(self, section: str, value: str) -> bool:
+        self.get_content()
+        if value in self.index[section]:
+            return False
+        self.index[section].add(value)
+        self.content[section].append(value)
+        self.pending += 1
+        return True
+
+    def flush_if_needed(self) -> None:
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def get_content(self) -> dict[str, list[str]]:
+        if self.content is None:
+            self.set_content(super().load() if self.file_path.exists() else {})
+        return self.content
+
+    def set_content(self, data: dict) -> None:
+        self.content = {section: list(data.get(section, [])) for section in self.sections}
+        self.index = {section: set(values) for section, values in self.content.items()}
+
+
+class SQLiteCache(Cache):
+    """
+    Тот же интерфейс, что и у Cache, но данные лежат в SQLite. Порядок
+    сохраняется через автоинкрементный rowid, уникальность обеспечивает индекс.
+    При создании базы в неё переносится cache.json из той же папки, чтобы
+    смена CACHE_BACKEND не теряла собранные ID
+    """
+    @override
+    def __init__(
+            self, file_path: Path = CACHE_DB_FILE, flush_every: int = CACHE_FLUSH_EVERY
+    ) -> None:
+        created = not file_path.exists()
+        super().__init__(file_path, flush_every)
+        self.connection = sqlite3.connect(file_path)
+        for section in self.sections:
+            self.connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {section} "
+                "(position INTEGER PRIMARY KEY AUTOINCREMENT, value TEXT UNIQUE NOT NULL)"
+            )
+        self.connection.commit()
+        json_file = file_path.with_name(CACHE_FILE.name)
+        if created and json_file.exists():
+            self.dump(Cache(json_file).load())
+            self.log(f"Imported {json_file} into {file_path}")
+
+    @override
+    def load(self) -> dict:
+        return {section: self.select(section) for section in self.sections}
+
+    @override
+    def dump(self, data: dict) -> None:
+        with self.connection:
+            for section in self.sections:
+                self.connection.execute(f"DELETE FROM {section}")
+                self.insert(section, data.get(section, []))
+        self.pending = 0
+
+    @override
+    def flush(self) -> None:
+        self.connection.commit()
+        self.pending = 0
+
+    @override
+    def extend_company_ids(self, ids: Iterable[str]) -> None:
+        self.pending += self.insert("company_ids", ids)
+        self.flush_if_needed()
+
+    @override
+    def add(self, section: str, value: str) -> bool:
+        added = self.insert(section, [value])
+        self.pending += added
+        return bool(added)
+
+    def insert(self, section: str, values: Iterable[str]) -> int:
+        cursor = self.connection.executemany(
+            f"INSERT OR IGNORE INTO {section} (value) VALUES (?)",
+            ((value,) for value in values)
+        )
+        return cursor.rowcount
+
+    def select(self, section: str) -> list[str]:
+        rows = self.connection.execute(
+            f"SELECT value FROM {section} ORDER BY position"
+        )
+        return [value for value, in rows]
+
+
+class CookieStore(ReaderJSON):
+    """
+    user cookie list-org со сроком жизни, лежит рядом с кэшем. Для сессионных
+    cookie (expires == -1) срок считается как COOKIE_SESSION_TTL от момента
+    сохранения
+    """
+    @override
+    def __init__(
+            self, file_path: Path = COOKIE_FILE, session_ttl: float = COOKIE_SESSION_TTL
+    ) -> None:
+        super().__init__(file_path)
+        self.session_ttl = session_ttl
+
+    def get(self) -> str | None:
+        if not self.file_path.exists():
+            return None
         content = self.load()
-        if id not in content["company_ids"]:
-            content["company_ids"].append(id)
-        self.dump(content)
+        if content["expires"] <= time.time():
+            return None
+        return content["value"]
+
+    def save(self, value: str, expires: float = -1) -> None:
+        if expires == -1:
+            expires = time.time() + self.session_ttl
+        self.dump({"value": value, "expires": expires})
+
+    def clear(self) -> None:
+        self.file_path.unlink(missing_ok=True)
+
+
+class BatchSizer(ReaderJSON):
+    """
+    Количество ID в одной ссылке excel_list.php, которое list-org отдаёт без
+    капчи. Значение сохраняется между запусками
+    """
+    @override
+    def __init__(
+            self,
+            file_path: Path = BATCH_STATE_FILE,
+            start: int = BATCH_SIZE_START,
+            min_size: int = BATCH_SIZE_MIN,
+            max_size: int = BATCH_SIZE_MAX,
+            step: int = BATCH_SIZE_STEP,
+    ) -> None:
+        super().__init__(file_path)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.step = step
+        self.size = self.load()["size"] if self.file_path.exists() else start
+
+    def grow(self) -> bool:
+        return self.set_size(min(self.size + self.step, self.max_size))
+
+    def shrink(self) -> bool:
+        return self.set_size(max(self.size // 2, self.min_size))
+
+    def set_size(self, size: int) -> bool:
+        if size == self.size:
+            return False
+        self.size = size
+        self.dump({"size": size})
+        return True
+
+
+class JobQueue(Base, ReaderJSON):
+    """
+    Очередь поисковых запросов в jobs.json. Задание — одна страница выдачи
+    с заданными ОКВЭД и числом сотрудников. Задание проходит состояния
+    pending → scraped → downloaded и хранит найденные ID и ссылки на
+    скачивание со статусом каждого файла (файл бывает общим у нескольких
+    заданий), поэтому прерванный запуск продолжается с того же места и не
+    повторяет сделанное
+    """
+    @override
+    def __init__(self, file_path: Path = JOBS_FILE, queries: list[dict] = QUERIES) -> None:
+        super().__init__(file_path)
+        self.queries = queries
+        self.content: dict | None = None
+
+    @property
+    def jobs(self) -> dict[str, dict]:
+        return self.get_content()["jobs"]
+
+    def get_content(self) -> dict:
+        if self.content is None:
+            self.content = (
+                self.load() if self.file_path.exists() else {"next_file": 0, "jobs": {}}
+            )
+        return self.content
+
+    def save(self) -> None:
+        self.dump(self.get_content())
+
+    def sync(self, link_constructor: "LinkConstructor", cache: "Cache") -> None:
+        """
+        Добавляет задания для новых запросов из QUERIES. Страницы, посещённые
+        до появления очереди, сразу считаются обработанными, а ID из кэша
+        становятся отдельным заданием "cache", которое только скачивается
+        """
+        migrating = not self.file_path.exists()
+        cached = cache.load()
+        visited = set(cached["referers"])
+        added = 0
+        for query in self.queries:
+            for page in query["pages"]:
+                params = {
+                    "page": page,
+                    "okved": query["okved"],
+                    "staff_min": query["staff_min"],
+                    "staff_max": query.get("staff_max"),
+                }
+                query_link = link_constructor.query_link(**params)
+                if query_link in self.jobs:
+                    continue
+                self.jobs[query_link] = self.new_job(params)
+                if query_link in visited:
+                    self.jobs[query_link]["state"] = "scraped"
+                added += 1
+        if migrating and cached["company_ids"]:
+            self.jobs["cache"] = self.new_job(None)
+            self.jobs["cache"].update(state="scraped", company_ids=cached["company_ids"])
+            added += 1
+        if added:
+            self.log(f"Added {added} jobs to the queue")
+            self.save()
+
+    def new_job(self, query: dict | None) -> dict:
+        return {
+            "query": query,
+            "state": "pending",
+            "attempts": 0,
+            "error": None,
+            "company_ids": [],
+            "files": {},
+        }
+
+    def pending_query_links(self) -> list[str]:
+        return [
+            query_link
+            for query_link, job in self.jobs.items()
+            if job["state"] == "pending"
+        ]
+
+    def mark_scraped(self, query_link: str, company_ids: list[str]) -> None:
+        job = self.jobs[query_link]
+        job.update(state="scraped", company_ids=company_ids, error=None)
+        job["attempts"] += 1
+        self.save()
+
+    def mark_failed(self, query_link: str, error: str) -> None:
+        job = self.jobs[query_link]
+        job.update(error=error)
+        job["attempts"] += 1
+        self.save()
+
+    def assign_files(self, link_constructor: "LinkConstructor") -> dict[int, str]:
+        """
+        Собирает ID всех новых заданий с одним ОКВЭД в общие ссылки по
+        текущему размеру пачки и возвращает все ещё не скачанные файлы. Файл
+        записывается в каждое задание, чьи ID в нём есть. Номер файла сквозной
+        для всей очереди, поэтому data_{number}.xlsx разных запусков не
+        пересекаются
+        """
+        new_jobs: dict[int, list[dict]] = {}
+        for query_link, job in self.jobs.items():
+            if job["state"] == "scraped" and not job["files"]:
+                new_jobs.setdefault(self.okved(query_link), []).append(job)
+        for jobs in new_jobs.values():  # ОКВЭД строк берётся по файлу, поэтому в файле он один
+            company_ids = list(dict.fromkeys(id for job in jobs for id in job["company_ids"]))
+            download_links = link_constructor.populate_download_links(
+                company_ids, link_constructor.batch_sizer.size
+            )
+            self.add_files(jobs, download_links, link_constructor)
+            for job in jobs:
+                if not job["files"]:
+                    job["state"] = "downloaded"
+        self.save()
+        download_links = {
+            int(number): file["link"]
+            for job in self.jobs.values()
+            if job["state"] == "scraped"
+            for number, file in job["files"].items()
+            if file["state"] in ("pending", "rejected")
+        }
+        self.log(f"{len(download_links)} files are waiting for download")
+        return download_links
+
+    def split_files(
+            self, rejected: dict[int, str], link_constructor: "LinkConstructor"
+    ) -> dict[int, str]:
+        """
+        Отклонённые файлы помечаются как split, а их ID переходят в новые
+        файлы тех же заданий с меньшей пачкой
+        """
+        download_links = {}
+        for number, download_link in rejected.items():
+            jobs = self.jobs_of(number)
+            for job in jobs:
+                job["files"][str(number)]["state"] = "split"
+            links = link_constructor.split_download_links([download_link])
+            download_links.update(self.add_files(jobs, links, link_constructor))
+        self.save()
+        return download_links
+
+    def record_downloads(self, downloaded: Iterable[int], rejected: Iterable[int]) -> None:
+        for state, numbers in (("done", downloaded), ("rejected", rejected)):
+            for number in numbers:
+                for job in self.jobs_of(number):
+                    job["files"][str(number)]["state"] = state
+                    if all(file["state"] in ("done", "split") for file in job["files"].values()):
+                        job["state"] = "downloaded"
+        self.save()
+
+    def add_files(
+            self, jobs: list[dict], download_links: list[str], link_constructor: "LinkConstructor"
+    ) -> dict[int, str]:
+        content = self.get_content()
+        numbers = {}
+        for download_link in download_links:
+            number = content["next_file"]
+            content["next_file"] += 1
+            company_ids = set(link_constructor.get_company_ids(download_link).split(","))
+            for job in jobs:
+                if company_ids.intersection(job["company_ids"]):
+                    job["files"][str(number)] = {"link": download_link, "state": "pending"}
+            numbers[number] = download_link
+        return numbers
+
+    def jobs_of(self, number: int) -> list[dict]:
+        return [job for job in self.jobs.values() if str(number) in job["files"]]
+
+    def okved(self, query_link: str) -> int:
+        query = self.jobs[query_link]["query"] if query_link in self.jobs else None
+        return query["okved"] if query else LinkConstructor.okved
+
+    def okved_of_file(self, name: str) -> int:
+        """Файлы задания "cache" и скачанные до очереди заданий — из запроса по умолчанию"""
+        match = re.fullmatch(r"data_(\d+)\.xlsx", name)
+        number = match.group(1) if match else None
+        query_link = next(
+            (query_link for query_link, job in self.jobs.items() if number in job["files"]), ""
+        )
+        return self.okved(query_link)
+
+
+class Manifest(ReaderJSON):
+    """
+    sha256 каждого скачанного xlsx в manifest.json той же папки. Хэш
+    пересчитывается только если у файла поменялись размер или mtime
+    """
+    @override
+    def __init__(self, dir: Path = DOWNLOAD_DIR) -> None:
+        super().__init__(dir.joinpath("manifest.json"))
+        self.lock = threading.Lock()
+        self.entries: dict[str, dict] = self.load() if self.file_path.exists() else {}
+
+    def digest(self, file: Path) -> str:
+        stat = file.stat()
+        entry = self.entries.get(file.name)
+        if entry and (entry["size"], entry["mtime"]) == (stat.st_size, stat.st_mtime_ns):
+            return entry["sha256"]
+        self.update(file)
+        return self.entries[file.name]["sha256"]
+
+    def update(self, file: Path) -> bool:
+        """
+        Записывает актуальный хэш файла и возвращает True, если содержимое
+        отличается от прошлой версии
+        """
+        with open(file, "rb") as content:
+            sha256 = hashlib.file_digest(content, "sha256").hexdigest()
+        stat = file.stat()
+        return self.record(file.name, sha256, stat.st_size, stat.st_mtime_ns)
+
+    def record(self, name: str, sha256: str, size: int, mtime: int | None = None) -> bool:
+        """Без mtime запись означает файл, который разобрали в памяти и не сохранили"""
+        with self.lock:
+            previous = self.entries.get(name, {}).get("sha256")
+            self.entries[name] = {"sha256": sha256, "size": size, "mtime": mtime}
+            self.dump(self.entries)
+        return previous != sha256
+
+    def unarchived(self) -> list[tuple[str, str]]:
+        return [
+            (name, entry["sha256"])
+            for name, entry in self.entries.items()
+            if entry["mtime"] is None and not self.file_path.parent.joinpath(name).exists()
+        ]
 
 
 class CompanyDataDownloader(Base):
+    """
+    Скачивает xlsx файлы несколькими потоками через общий requests.Session.
+    Оборванная загрузка продолжается с места обрыва через HTTP Range, поэтому
+    каждый файл сначала пишется в data_{number}.xlsx.part
+    """
     dir = DOWNLOAD_DIR
-
-    def __init__(self, user_cookie: str, download_links: list[str]) -> None:
+    chunk_size = 8192
+    retryable_statuses = {416, 429, 500, 502, 503, 504}
+
+    def __init__(
+            self,
+            user_cookie: str,
+            download_links: list[str] | dict[int, str],  # Список нумеруется с нуля, словарь задаёт номера файлов
+            workers: int = DOWNLOAD_WORKERS,  # list-org быстро выдаёт капчу, поэтому по умолчанию немного потоков
+            retries: int = DOWNLOAD_RETRIES,
+            backoff: float = DOWNLOAD_BACKOFF,
+            job_queue: "JobQueue | None" = None,
+            ingest: "StreamingIngest | None" = None,  # Тело ответа отдаётся на разбор из памяти, а не пишется на диск
+            response_cache: ResponseCache | None = None,
+            governor: RequestGovernor | None = None,
+            recording: "Recording | None" = None,  # Ответы записываются или воспроизводятся вместо сети
+            dir: Path | None = None,
+    ) -> None:
+        self.dir = dir or self.dir
         self.user_cookie = user_cookie
-        self.download_links = download_links
+        self.download_links = (
+            dict(download_links) if isinstance(download_links, dict) else dict(enumerate(download_links))
+        )
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.job_queue = job_queue
+        self.ingest = ingest
+        self.response_cache = response_cache
+        self.governor = governor
+        self.recording = recording
+        self.downloaded: set[int] = set()
+        self.rejected: dict[int, str] = {}  # Вместо xlsx пришла HTML страница (cookie не принят или капча)
 
     @property
     def headers(self) -> dict[str, str]:
@@ -235,21 +1323,182 @@ class CompanyDataDownloader(Base):
         }
         return headers
 
-    def exec(self) -> None:
-        for number, download_link in enumerate(self.download_links):
-            response = self.make_request(download_link)
-            self.save_file(response, number)
+    def create_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if self.recording:
+            self.recording.mount(session)
+        session.headers.update(self.headers)
+        return session
 
-    def make_request(self, download_link: str) -> requests.Response:
-        return requests.get(download_link, stream=True, headers=self.headers)
+    def exec(self) -> None:
+        self.download_many(self.download_links)
 
-    def save_file(self, response: requests.Response, number: int) -> None:
+    def retry_rejected(self, user_cookie: str) -> None:
+        rejected, self.rejected = self.rejected, {}
+        self.user_cookie = user_cookie
+        self.download_many(rejected)
+
+    def download_many(self, download_links: dict[int, str]) -> None:
+        self.session = self.create_session()
+        self.manifest = Manifest(self.dir)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                downloads = executor.map(
+                    self.download, download_links.keys(), download_links.values()
+                )
+                list(downloads)  # Пробрасываем исключения из потоков
+        finally:
+            self.session.close()
+            if self.job_queue:  # Статус пишется и при ошибке, чтобы следующий запуск не качал файлы заново
+                self.job_queue.record_downloads(self.downloaded, self.rejected)
+
+    def download(self, number: int, download_link: str) -> None:
+        cached = self.response_cache.get(download_link) if self.response_cache else None
+        if cached and self.response_cache.is_fresh(cached):
+            self.response_cache.count("hits")
+            self.serve_cached(cached, number)
+            return
+        for attempt in range(1, self.retries + 1):
+            try:
+                part_path = None if self.ingest else self.part_path(number)
+                response = self.make_request(download_link, part_path, cached)
+                if response.status_code == 304 and cached:
+                    response.close()
+                    self.response_cache.refresh(download_link)
+                    self.serve_cached(cached, number)
+                    return
+                if self.is_html(response):
+                    captcha = RequestGovernor.is_captcha(response.content)
+                    response.close()
+                    self.rejected[number] = download_link
+                    self.log(
+                        f"Got {'a captcha' if captcha else 'an HTML page'} instead of xlsx "
+                        f"for data_{number}.xlsx", "WARNING"
+                    )
+                    if self.governor:
+                        self.governor.observe_page(captcha)
+                    return
+                if self.governor:
+                    self.governor.observe_page(False)
+                if self.ingest:
+                    body = self.hand_over(response, number)
+                else:
+                    body = self.save_file(response, number)
+                if self.response_cache:
+                    self.response_cache.count("misses")
+                    self.response_cache.put(download_link, body, response.headers)
+                return
+            except requests.RequestException as error:
+                if attempt == self.retries or not self.is_retryable(error):
+                    raise
+                delay = self.backoff * 2 ** (attempt - 1)
+                self.log(
+                    f"Download of data_{number}.xlsx failed ({error}), "
+                    f"retry {attempt}/{self.retries - 1} in {delay:.1f}s",
+                    "WARNING"
+                )
+                time.sleep(delay)
+
+    def make_request(
+            self,
+            download_link: str,
+            part_path: Path | None = None,
+            cached: CachedResponse | None = None,
+    ) -> requests.Response:
+        headers = {}
+        if part_path and part_path.exists() and part_path.stat().st_size:
+            headers["Range"] = f"bytes={part_path.stat().st_size}-"
+        elif cached:
+            headers.update(cached.validators)
+        if self.governor:
+            self.governor.acquire()
+        started = time.perf_counter()
+        try:
+            response = self.session.get(
+                download_link, stream=True, headers=headers, timeout=DOWNLOAD_TIMEOUT
+            )
+        except requests.RequestException as error:
+            metrics.record_request("download", time.perf_counter() - started, type(error).__name__)
+            raise
+        metrics.record_request("download", time.perf_counter() - started, response.status_code)
+        if self.governor:
+            self.governor.observe_status(response.status_code, response.headers.get("Retry-After"))
+        if response.status_code == 416 and part_path:
+            part_path.unlink()  # Часть файла не совпадает с ресурсом, качаем заново
+        response.raise_for_status()
+        return response
+
+    def save_file(self, response: requests.Response, number: int) -> Path:
         file_name = f"data_{number}.xlsx"
-        with open(self.dir.joinpath(file_name), "wb") as file:
-            for chunk in response.iter_content(chunk_size=8192):
+        part_path = self.part_path(number)
+        mode = "ab" if response.status_code == 206 else "wb"
+        started = time.perf_counter()
+        received = 0
+        with open(part_path, mode) as file:
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
                 if chunk:
                     file.write(chunk)
-        self.log(f"File {file_name} successfully downloaded in {self.dir}")
+                    received += len(chunk)
+        elapsed = time.perf_counter() - started
+        size = part_path.stat().st_size
+        part_path.replace(self.dir.joinpath(file_name))
+        changed = self.manifest.update(self.dir.joinpath(file_name))
+        self.downloaded.add(number)
+        metrics.add("download", bytes=received, files=1)
+        self.log(
+            f"File {file_name} successfully downloaded in {self.dir}: "
+            f"{size} bytes ({received} received) in {elapsed:.2f}s, "
+            f"{received / 1024 / max(elapsed, 1e-6):.1f} KB/s"
+            f"{'' if changed else ', content unchanged'}"
+        )
+        return self.dir.joinpath(file_name)
+
+    def hand_over(self, response: requests.Response, number: int) -> bytes:
+        """
+        Читает тело ответа в память и ставит в очередь разбора. Если разбор
+        отстаёт, очередь заполняется и загрузка ждёт
+        """
+        buffer = BytesIO()
+        started = time.perf_counter()
+        for chunk in response.iter_content(chunk_size=self.chunk_size):
+            buffer.write(chunk)
+        elapsed = time.perf_counter() - started
+        received = buffer.tell()
+        buffer.seek(0)
+        self.downloaded.add(number)
+        metrics.add("download", bytes=received, files=1)
+        self.log(
+            f"File data_{number}.xlsx downloaded to memory: {received} bytes in {elapsed:.2f}s, "
+            f"{received / 1024 / max(elapsed, 1e-6):.1f} KB/s"
+        )
+        self.ingest.submit(f"data_{number}.xlsx", buffer)
+        return buffer.getvalue()
+
+    def serve_cached(self, cached: CachedResponse, number: int) -> None:
+        file_name = f"data_{number}.xlsx"
+        if self.ingest:
+            self.ingest.submit(file_name, BytesIO(cached.body))
+        else:
+            part_path = self.part_path(number)
+            shutil.copyfile(cached.path, part_path)
+            part_path.replace(self.dir.joinpath(file_name))
+            self.manifest.update(self.dir.joinpath(file_name))
+        self.downloaded.add(number)
+        self.log(f"File {file_name} taken from the response cache")
+
+    def is_html(self, response: requests.Response) -> bool:
+        return "text/html" in response.headers.get("Content-Type", "")
+
+    def part_path(self, number: int) -> Path:
+        return self.dir.joinpath(f"data_{number}.xlsx.part")
+
+    def is_retryable(self, error: requests.RequestException) -> bool:
+        if isinstance(error, requests.HTTPError):
+            return error.response.status_code in self.retryable_statuses
+        return True
 
 
 class CompanySourceData:
@@ -264,34 +1513,131 @@ class CompanySourceData:
 
 
 class ReaderExcel(CompanySourceData):
+    """
+    exec читает все файлы целиком. stream отдаёт их частями по chunk_size
+    строк: при workers == 1 через read-only итератор openpyxl, иначе каждый
+    файл разбирается в отдельном процессе, и в работе одновременно не больше
+    workers файлов
+    """
     dir = DOWNLOAD_DIR
 
+    def __init__(
+            self,
+            chunk_size: int = READER_CHUNK_SIZE,
+            workers: int = READER_WORKERS,
+            dir: Path | None = None,
+    ) -> None:
+        self.dir = dir or self.dir
+        self.chunk_size = chunk_size
+        self.workers = workers
+
     def exec(self) -> pandas.DataFrame:
         files = self.get_company_data_files()
         company_data = pandas.concat(files, ignore_index=True)
         return company_data
 
+    def stream(self) -> Iterator[pandas.DataFrame]:
+        files = self.get_company_data_paths()
+        if self.workers > 1:
+            yield from self.stream_parallel(files)
+        else:
+            for file in files:
+                yield from self.read_file_chunks(file, self.source_columns, self.chunk_size)
+
+    def stream_parallel(self, files: list[Path]) -> Iterator[pandas.DataFrame]:
+        context = multiprocessing.get_context("spawn")  # fork небезопасен при живом потоке QueueListener
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as executor:
+            in_flight = deque()
+            for file in files:
+                in_flight.append(executor.submit(self.read_file, file, self.source_columns))
+                if len(in_flight) >= self.workers:
+                    yield from self.split(in_flight.popleft().result())
+            while in_flight:
+                yield from self.split(in_flight.popleft().result())
+
+    def split(self, company_data: pandas.DataFrame) -> Iterator[pandas.DataFrame]:
+        for start in range(0, len(company_data), self.chunk_size):
+            yield company_data.iloc[start:start + self.chunk_size]
+
     def get_company_data_files(self) -> list[pandas.DataFrame]:
         return [
-            pandas.read_excel(file, usecols=self.source_columns)
+            self.read_file(file, self.source_columns)
+            for file
+            in self.get_company_data_paths()
+        ]
+
+    def get_company_data_paths(self) -> list[Path]:
+        return sorted(
+            file
             for file
             in self.dir.iterdir()
             if file.is_file() and file.suffix == ".xlsx"
-        ]
+        )
+
+    @staticmethod
+    def read_file(file: Path, columns: list[str]) -> pandas.DataFrame:
+        return pandas.read_excel(file, usecols=columns)
+
+    @staticmethod
+    def read_file_chunks(
+            file: Path, columns: list[str], chunk_size: int
+    ) -> Iterator[pandas.DataFrame]:
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, ())
+            positions = [header.index(column) for column in columns]
+            chunk = []
+            for row in rows:
+                values = [row[position] if position < len(row) else None for position in positions]
+                if any(value is not None for value in values):
+                    chunk.append(values)
+                if len(chunk) == chunk_size:
+                    yield ReaderExcel.parse_chunk(chunk, columns)
+                    chunk = []
+            if chunk:
+                yield ReaderExcel.parse_chunk(chunk, columns)
+        finally:
+            workbook.close()
+
+    @staticmethod
+    def parse_chunk(chunk: list[list], columns: list[str]) -> pandas.DataFrame:
+        """
+        Через TextParser, как и pandas.read_excel, чтобы типы колонок
+        (например, ИНН, сохранённый в xlsx строкой) совпадали с exec
+        """
+        from pandas.io.parsers import TextParser
+        return TextParser([columns, *chunk], header=0).read()
 
 
 class Normalizer(CompanySourceData):
     blank = "—"
+    regions = RegionResolver(unknown=blank)  # Общий на все пачки, чтобы кэш адресов не терялся
 
     def __init__(self, company_data: pandas.DataFrame) -> None:
         self.company_data = company_data
 
+    @classmethod
+    def create(
+            cls, company_data: pandas.DataFrame, mode: str = NORMALIZER_MODE
+    ) -> "Normalizer":
+        if mode == "vectorized":
+            return VectorizedNormalizer(company_data)
+        return cls(company_data)
+
+    @classmethod
+    def stream(
+            cls, chunks: Iterable[pandas.DataFrame], mode: str = NORMALIZER_MODE
+    ) -> Iterator[NormalizedData]:
+        for chunk in chunks:
+            yield cls.create(chunk, mode).exec()
+
     def exec(self) -> NormalizedData:
-        normalized_data = [
-            asdict(self.normalize_row(row))
+        normalized_data = CompanyBatch.from_records(
+            self.normalize_row(row)
             for _, row
             in self.company_data.iterrows()
-        ]
+        )
         return normalized_data
 
     def normalize_row(self, row: pandas.Series) -> "CompanyData":
@@ -305,14 +1651,7 @@ class Normalizer(CompanySourceData):
         )
 
     def normalize_region(self, row: pandas.Series, index: int) -> str:
-        normalized_field = self.normalize_field(row, index).split(", ")
-        city, region = normalized_field[1], normalized_field[2]
-        if self.check_moscow_in_city_field(city):
-            return "Г. МОСКВА"
-        elif self.check_spb_in_city_field(city):
-            return "Г. САНКТ-ПЕТЕРБУРГ"
-        else:
-            return ",".join([city, region])
+        return self.regions.resolve(self.normalize_field(row, index))
 
     def normalize_phone(self, row: pandas.Series, index: int) -> str:
         normalized_field = self.normalize_field(row, index)
@@ -325,22 +1664,317 @@ class Normalizer(CompanySourceData):
             return source_row
         return self.blank
 
-    def check_moscow_in_city_field(self, city: str) -> bool:
-        pattern = re.compile(
-            r"(?:г\.?\s*)?Москва",
-            re.IGNORECASE
+
+class VectorizedNormalizer(Normalizer):
+    """
+    Та же нормализация, что и в Normalizer, но по колонкам целиком через
+    pandas .str методы. Результат совпадает с построчным вариантом
+    """
+    @override
+    def exec(self) -> NormalizedData:
+        if self.company_data.empty:
+            return CompanyBatch()
+        normalized_data = CompanyBatch(
+            inn=self.normalize_column(0).tolist(),
+            name=self.normalize_column(1).tolist(),
+            employees=array("q", self.normalize_column(2).astype(int).tolist()),
+            region=self.normalize_region_column(4).tolist(),
+            contacts=self.normalize_phone_column(5).tolist(),
+            site=self.normalize_column(3).tolist(),
+        )
+        return normalized_data
+
+    def normalize_region_column(self, index: int) -> pandas.Series:
+        codes, addresses = pandas.factorize(self.normalize_column(index))
+        regions = [self.regions.resolve(address) for address in addresses]  # Один разбор на уникальный адрес
+        return pandas.Series(regions, dtype=object).take(codes).set_axis(self.company_data.index)
+
+    def normalize_phone_column(self, index: int) -> pandas.Series:
+        return (
+            self.normalize_column(index)
+            .str.replace(" ", "", regex=False)
+            .str.replace("(", "-", regex=False)
+            .str.replace(")", "-", regex=False)
         )
-        return bool(pattern.search(city))
 
-    def check_spb_in_city_field(self, city: str) -> bool:
-        pattern = re.compile(
-            r"(?:г\.?\s*)?Санкт[-\s]?Петербург",
-            re.IGNORECASE
+    def normalize_column(self, index: int) -> pandas.Series:
+        column = self.company_data[self.source_columns[index]]
+        return column.astype(object).where(column.notna(), self.blank)
+
+
+class Validator(Base):
+    """
+    Проверяет и приводит к каноническому виду нормализованные пачки перед
+    выгрузкой: ИНН проверяется по контрольным цифрам (ведущий ноль,
+    потерянный в xlsx, возвращается), телефоны приводятся к E.164, сайты к
+    виду scheme://host/path. Строки с неверным ИНН отбрасываются, неверные
+    телефон или сайт заменяются прочерком. Всё отклонённое с исходными
+    значениями и причиной пишется в reject_file. Проверки идут по колонкам
+    целиком, без цикла по строкам
+    """
+    inn_weights = {  # Веса каждой контрольной цифры, она стоит сразу за взвешенными
+        10: ((2, 4, 10, 3, 5, 9, 4, 6, 8),),
+        12: ((7, 2, 4, 10, 3, 5, 9, 4, 6, 8), (3, 7, 2, 4, 10, 3, 5, 9, 4, 6, 8)),
+    }
+    phone_extension = r"(?:доб|вн|ext)\.?.*$"
+    site = re.compile(r"^(?:(https?)://)?([^/\s?#]+)(.*)$", re.IGNORECASE)
+    host = r"(?:[\w-]+\.)+[^\W\d_]{2,}(?::\d+)?"  # \w включает кириллицу доменов .рф
+
+    def __init__(self, reject_file: Path | None = VALIDATION_REJECT_FILE) -> None:
+        self.reject_file = reject_file
+        self.rows = 0
+        self.rejected = Counter()
+
+    def __enter__(self) -> "Validator":
+        if self.reject_file:
+            self.reject_file.unlink(missing_ok=True)  # Отклонённые прошлого запуска не смешиваются с новыми
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self.rejected:
+            reasons = ", ".join(f"{count} {reason}" for reason, count in self.rejected.items())
+            self.log(f"Invalid fields among {self.rows} companies: {reasons}", "WARNING")
+
+    def stream(self, batches: Iterable[NormalizedData]) -> Iterator[NormalizedData]:
+        for batch in batches:
+            with metrics.span("validate"):
+                valid = self.exec(batch)
+            metrics.add("validate", rows=len(batch), rejected=len(batch) - len(valid))
+            yield valid
+
+    def exec(self, batch: NormalizedData) -> NormalizedData:
+        if not len(batch):
+            return batch
+        self.rows += len(batch)
+        inn, inn_valid = self.validate_inn(pandas.Series(batch.inn, dtype=object))
+        contacts, phone_valid = self.canonicalize_phone(pandas.Series(batch.contacts, dtype=object))
+        site, site_valid = self.canonicalize_site(pandas.Series(batch.site, dtype=object))
+        self.reject(batch, {"inn": inn_valid, "phone": phone_valid, "site": site_valid})
+        columns = dict(zip(batch.__slots__, batch.columns))
+        columns.update(inn=inn.tolist(), contacts=contacts.tolist(), site=site.tolist())
+        return CompanyBatch(**columns).select(inn_valid.tolist())
+
+    def validate_inn(self, inn: pandas.Series) -> tuple[pandas.Series, pandas.Series]:
+        blank = inn == Normalizer.blank
+        inn = inn.astype(str).str.strip().str.replace(r"\.0$", "", regex=True)  # ИНН из колонки с пропусками — float
+        length = inn.str.len()
+        inn = inn.mask(length == 9, inn.str.zfill(10)).mask(length == 11, inn.str.zfill(12))
+        valid = pandas.Series(False, index=inn.index)
+        for digits_count in self.inn_weights:
+            selected = inn.str.fullmatch(rf"\d{{{digits_count}}}") & ~blank
+            if selected.any():
+                valid[selected] = self.inn_checksums(inn[selected], digits_count)
+        return inn.mask(blank, Normalizer.blank), valid | blank
+
+    def inn_checksums(self, inn: pandas.Series, digits_count: int) -> numpy.ndarray:
+        """Все ИНН одной длины разбираются в матрицу цифр одним буфером"""
+        digits = numpy.frombuffer("".join(inn).encode("ascii"), dtype=numpy.uint8)
+        digits = digits.reshape(-1, digits_count).astype(numpy.int64) - ord("0")
+        valid = numpy.ones(len(inn), dtype=bool)
+        for weights in self.inn_weights[digits_count]:
+            control = digits[:, :len(weights)] @ numpy.array(weights) % 11 % 10
+            valid &= control == digits[:, len(weights)]
+        return valid
+
+    def canonicalize_phone(self, phone: pandas.Series) -> tuple[pandas.Series, pandas.Series]:
+        """
+        Российские номера: 11 цифр с 7 или 8 в начале либо 10 цифр без кода
+        страны. Прочие принимаются только с + и 8-15 цифрами. Добавочный
+        номер отбрасывается
+        """
+        blank = phone == Normalizer.blank
+        phone = phone.astype(str).str.replace(self.phone_extension, "", regex=True, case=False)
+        digits = phone.str.replace(r"\D", "", regex=True)
+        length = digits.str.len()
+        international = phone.str.lstrip().str.startswith("+")
+        first = digits.str[:1]
+        russian = (
+            (length == 11) & ((first == "7") | ((first == "8") & ~international))
+            | (length == 10) & ~international
+        )
+        foreign = international & ~russian & length.between(8, 15)
+        canonical = ("+7" + digits.str[-10:]).where(russian, "+" + digits).where(
+            russian | foreign, Normalizer.blank
         )
-        return bool(pattern.search(city))
+        return canonical.mask(blank, Normalizer.blank), russian | foreign | blank
+
+    def canonicalize_site(self, site: pandas.Series) -> tuple[pandas.Series, pandas.Series]:
+        blank = site == Normalizer.blank
+        parts = site.astype(str).str.strip().str.extract(self.site)
+        scheme = parts[0].str.lower().fillna("http")
+        host = parts[1].str.lower().str.rstrip(".")
+        path = parts[2].fillna("").str.rstrip("/")
+        valid = host.str.fullmatch(self.host).fillna(False).astype(bool)
+        canonical = (scheme + "://" + host + path).where(valid, Normalizer.blank)
+        return canonical.mask(blank, Normalizer.blank), valid | blank
+
+    def reject(self, batch: NormalizedData, valid: dict[str, pandas.Series]) -> None:
+        invalid = pandas.DataFrame({field: ~column for field, column in valid.items()})
+        rejected = invalid.any(axis=1)
+        if not rejected.any():
+            return
+        self.rejected.update(invalid.sum()[lambda counts: counts > 0].to_dict())
+        if not self.reject_file:
+            return
+        invalid = invalid[rejected]
+        reasons = invalid.dot(invalid.columns + ",")  # True * "inn," == "inn,"
+        data_frame = batch.to_frame()[Exporter.columns_order][rejected.to_numpy()]
+        data_frame["reason"] = reasons.str.rstrip(",").to_numpy()
+        header = not self.reject_file.exists()
+        data_frame.to_csv(self.reject_file, mode="a", index=False, header=header)
+
+
+class IncrementalIngest(Base):
+    """
+    Читает и нормализует только новые или изменившиеся xlsx. Результат
+    нормализации каждого файла кэшируется в normalized/{sha256}.pkl, так что
+    неизменённые файлы берутся из кэша, а одинаковые по содержимому файлы
+    учитываются один раз
+    """
+    cache_version = "okved"  # Меняется вместе с форматом NormalizedData, старый кэш удаляется prune
+
+    def __init__(
+            self,
+            reader: ReaderExcel | None = None,
+            mode: str = NORMALIZER_MODE,
+            job_queue: "JobQueue | None" = None,
+    ) -> None:
+        self.reader = reader or ReaderExcel()
+        self.mode = mode
+        self.job_queue = job_queue or JobQueue()  # По заданию файла известен ОКВЭД его компаний
+        self.manifest = Manifest(self.reader.dir)
+        self.cache_dir = self.reader.dir.joinpath("normalized")
+        self.parsed: list[str] = []
+        self.reused: list[str] = []
+
+    def exec(self) -> Iterator[NormalizedData]:
+        self.cache_dir.mkdir(exist_ok=True)
+        digests = set()
+        for file in self.reader.get_company_data_paths():
+            digest = self.manifest.digest(file)
+            if digest in digests:
+                self.log(f"{file.name} duplicates an already ingested file, skipping")
+                continue
+            digests.add(digest)
+            batch = self.load_or_normalize(file, self.cached_file(digest), file.name, file.stat().st_size)
+            yield batch.with_okved(self.job_queue.okved_of_file(file.name))
+        for name, digest in self.manifest.unarchived():
+            cached_file = self.cached_file(digest)
+            if digest in digests:
+                continue
+            if not cached_file.exists():
+                self.log(f"{name} was not archived and its parsed cache is missing, skipping", "WARNING")
+                continue
+            digests.add(digest)
+            yield self.load_cached(cached_file, name).with_okved(self.job_queue.okved_of_file(name))
+        self.prune(digests)
+        self.log(f"Ingested {len(self.parsed)} new files, reused {len(self.reused)} cached")
+
+    def load_or_normalize(
+            self, file: Path | BytesIO, cached_file: Path, name: str, size: int
+    ) -> NormalizedData:
+        if cached_file.exists():
+            return self.load_cached(cached_file, name)
+        self.parsed.append(name)
+        metrics.add("read", bytes=size, files=1)
+        chunks = metrics.iterate("read", self.reader.read_file_chunks(
+            file, self.reader.source_columns, self.reader.chunk_size
+        ))
+        batches = metrics.iterate("normalize", Normalizer.stream(chunks, self.mode))
+        normalized_data = CompanyBatch.concat(batches)
+        temp_file = cached_file.with_suffix(".tmp")
+        with open(temp_file, "wb") as cached:
+            pickle.dump(normalized_data, cached, protocol=pickle.HIGHEST_PROTOCOL)
+        temp_file.replace(cached_file)
+        return normalized_data
+
+    def load_cached(self, cached_file: Path, name: str) -> NormalizedData:
+        self.reused.append(name)
+        with metrics.span("read"), open(cached_file, "rb") as cached:
+            normalized_data = pickle.load(cached)
+        metrics.add("read", rows=len(normalized_data), cached_files=1)
+        return normalized_data
+
+    def cached_file(self, digest: str) -> Path:
+        return self.cache_dir.joinpath(f"{digest}.{self.cache_version}.pkl")
 
+    def prune(self, digests: set[str]) -> None:
+        kept = {self.cached_file(digest) for digest in digests}
+        for cached_file in self.cache_dir.glob("*.pkl"):
+            if cached_file not in kept:
+                cached_file.unlink()
 
-@dataclass
+
+class StreamingIngest(IncrementalIngest):
+    """
+    Разбор xlsx, перекрытый с загрузкой: CompanyDataDownloader отдаёт тело
+    ответа в BytesIO через ограниченную очередь, а отдельный поток
+    нормализует его в тот же кэш normalized/, что и IncrementalIngest. При
+    archive xlsx дополнительно сохраняется в папку загрузок, иначе в
+    manifest остаётся только хэш, по которому следующие этапы найдут кэш
+    """
+    @override
+    def __init__(
+            self,
+            reader: ReaderExcel | None = None,
+            mode: str = NORMALIZER_MODE,
+            archive: bool = DOWNLOAD_ARCHIVE,
+            queue_size: int = DOWNLOAD_WORKERS * 2,
+            job_queue: "JobQueue | None" = None,
+    ) -> None:
+        super().__init__(reader, mode, job_queue)
+        self.archive = archive
+        self.queue: queue.Queue[tuple[str, BytesIO] | None] = queue.Queue(maxsize=queue_size)
+        self.worker = threading.Thread(target=self.consume, name="streaming-ingest", daemon=True)
+        self.error: Exception | None = None
+
+    def __enter__(self) -> "StreamingIngest":
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.worker.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def submit(self, name: str, buffer: BytesIO) -> None:
+        self.queue.put((name, buffer))
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self.worker.join()
+        self.log(f"Parsed {len(self.parsed)} downloaded files in memory, reused {len(self.reused)} cached")
+        if self.error:
+            raise self.error
+
+    def consume(self) -> None:
+        while (item := self.queue.get()) is not None:
+            if self.error:
+                continue  # Очередь всё равно вычитываем, чтобы загрузка не зависла на put
+            try:
+                self.ingest_buffer(*item)
+            except Exception as error:
+                self.error = error
+
+    def ingest_buffer(self, name: str, buffer: BytesIO) -> NormalizedData:
+        with buffer.getbuffer() as content:
+            sha256 = hashlib.sha256(content).hexdigest()
+            size = content.nbytes
+            if self.archive:
+                self.save(name, content, sha256)
+            else:
+                self.manifest.record(name, sha256, size)
+        return self.load_or_normalize(buffer, self.cached_file(sha256), name, size)
+
+    def save(self, name: str, content: memoryview, sha256: str) -> None:
+        file = self.reader.dir.joinpath(name)
+        part_path = file.with_name(f"{name}.part")
+        part_path.write_bytes(content)
+        part_path.replace(file)
+        stat = file.stat()
+        self.manifest.record(name, sha256, stat.st_size, stat.st_mtime_ns)
+
+
+@dataclass(slots=True)
 class CompanyData:
     inn: str
     name: str
@@ -348,13 +1982,271 @@ class CompanyData:
     region: str
     contacts: str
     site: str
-    source: str = "www.list-org.com"
-    okved_main: int = 62  # Т.к. мы делали запрос к list-org.com по ОКВЭД коду
-                          # мы гарантированно знаем, что компания занимается
-                          # смежной детяельностью
-
+    source: str = LinkConstructor.source
+    okved_main: int = LinkConstructor.okved  # Класс ОКВЭД из запроса к list-org.com, по которому
+                                             # найдена компания: мы гарантированно знаем, что она
+                                             # занимается смежной деятельностью
+
+
+class CompanyBatch:
+    """
+    Пачка нормализованных компаний по колонкам: строки в списках,
+    сотрудники и ОКВЭД в array("q"). Если source и okved_main не переданы,
+    все компании пачки считаются найденными запросом list-org по умолчанию
+    """
+    __slots__ = ("inn", "name", "employees", "region", "contacts", "site", "source", "okved_main")
+
+    def __init__(
+            self,
+            inn: list[str] | None = None,
+            name: list[str] | None = None,
+            employees: array | None = None,
+            region: list[str] | None = None,
+            contacts: list[str] | None = None,
+            site: list[str] | None = None,
+            source: list[str] | None = None,
+            okved_main: array | None = None,
+    ) -> None:
+        self.inn = inn or []
+        self.name = name or []
+        self.employees = employees or array("q")
+        self.region = region or []
+        self.contacts = contacts or []
+        self.site = site or []
+        rows = len(self.inn)
+        self.source = source if source is not None else [LinkConstructor.source] * rows
+        self.okved_main = okved_main if okved_main is not None else array("q", [LinkConstructor.okved]) * rows
+
+    @classmethod
+    def from_records(cls, records: Iterable[CompanyData]) -> "CompanyBatch":
+        batch = cls()
+        for record in records:
+            batch.append(record)
+        return batch
+
+    @classmethod
+    def concat(cls, batches: Iterable["CompanyBatch"]) -> "CompanyBatch":
+        batch = cls()
+        for other in batches:
+            batch.extend(other)
+        return batch
 
-class Exporter:
+    @property
+    def columns(self) -> tuple[list[str] | array, ...]:
+        return tuple(getattr(self, column) for column in self.__slots__)
+
+    def __len__(self) -> int:
+        return len(self.inn)
+
+    def __iter__(self) -> Iterator[CompanyData]:
+        return map(CompanyData, *self.columns)
+
+    def __getitem__(self, index: int | slice) -> "CompanyData | CompanyBatch":
+        if isinstance(index, slice):
+            return CompanyBatch(*(column[index] for column in self.columns))
+        return CompanyData(*(column[index] for column in self.columns))
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, CompanyBatch):
+            return NotImplemented
+        return self.columns == other.columns
+
+    def append(self, record: CompanyData) -> None:
+        for column in self.__slots__:
+            getattr(self, column).append(getattr(record, column))
+
+    def extend(self, other: "CompanyBatch") -> None:
+        for column, values in zip(self.columns, other.columns):
+            column.extend(values)
+
+    def select(self, keep: Iterable[bool]) -> "CompanyBatch":
+        keep = list(keep)
+        return CompanyBatch(*(
+            array("q", compress(column, keep)) if isinstance(column, array) else list(compress(column, keep))
+            for column in self.columns
+        ))
+
+    def with_okved(self, okved_main: int) -> "CompanyBatch":
+        """ОКВЭД нужен строкам xlsx, которые его не содержат: он известен по заданию файла"""
+        self.okved_main = array("q", [okved_main]) * len(self)
+        return self
+
+    def to_frame(self) -> pandas.DataFrame:
+        return pandas.DataFrame(dict(zip(self.__slots__, self.columns)))
+
+
+class CompanyStore(Base):
+    """
+    Накопительная база компаний в SQLite с ключом по ИНН и индексами по
+    региону и числу сотрудников. Каждый запуск дописывает новые компании и
+    обновляет изменившиеся, не пересобирая базу. Компании без ИНН не
+    сохраняются: их не с чем сопоставить между запусками
+    """
+    columns = ("inn", "name", "employees", "region", "contacts", "site", "source", "okved_main")
+
+    def __init__(self, file_path: Path = STORE_FILE) -> None:
+        self.file_path = file_path
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(file_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS companies ("
+                "inn TEXT PRIMARY KEY, name TEXT NOT NULL, employees INTEGER NOT NULL, "
+                "region TEXT NOT NULL, contacts TEXT NOT NULL, site TEXT NOT NULL, "
+                "source TEXT NOT NULL, okved_main INTEGER NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS companies_region ON companies (region, employees)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS companies_employees ON companies (employees)"
+            )
+
+    def __enter__(self) -> "CompanyStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.connection.close()
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM companies").fetchone()[0]
+
+    def upsert(self, batch: CompanyBatch) -> int:
+        """
+        Возвращает число добавленных или изменённых компаний. Совпадающие
+        строки не перезаписываются, и updated_at у них не меняется. Пустые
+        поля (строки из выдачи поиска без контактов) не затирают известные
+        """
+        columns = ", ".join(self.columns)
+        updates = ", ".join(f"{column} = {self.merged(column)}" for column in self.columns[1:])
+        changed = ", ".join(f"companies.{column}" for column in self.columns[1:])
+        incoming = ", ".join(self.merged(column) for column in self.columns[1:])
+        now = time.time()
+        rows = (
+            (str(record.inn), *(getattr(record, column) for column in self.columns[1:]), now)
+            for record in batch
+            if record.inn != Normalizer.blank
+        )
+        with self.connection:
+            cursor = self.connection.executemany(
+                f"INSERT INTO companies ({columns}, updated_at) "
+                f"VALUES ({', '.join('?' * (len(self.columns) + 1))}) "
+                f"ON CONFLICT (inn) DO UPDATE SET {updates}, updated_at = excluded.updated_at "
+                f"WHERE ({changed}) IS NOT ({incoming})",
+                rows
+            )
+        return cursor.rowcount
+
+    def merged(self, column: str) -> str:
+        unknown = 0 if column == "employees" else f"'{Normalizer.blank}'"
+        return f"coalesce(nullif(excluded.{column}, {unknown}), companies.{column})"
+
+    def get(self, inn: str) -> CompanyData | None:
+        row = self.connection.execute(
+            f"SELECT {', '.join(self.columns)} FROM companies WHERE inn = ?", (str(inn),)
+        ).fetchone()
+        return CompanyData(*row) if row else None
+
+    def find(
+            self,
+            region: str | None = None,
+            employees_min: int | None = None,
+            employees_max: int | None = None,
+            limit: int | None = None,
+    ) -> CompanyBatch:
+        """Компании по убыванию числа сотрудников. Пустой фильтр не ограничивает выборку"""
+        conditions, params = [], []
+        for condition, value in (
+                ("region = ?", region),
+                ("employees >= ?", employees_min),
+                ("employees <= ?", employees_max),
+        ):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self.connection.execute(
+            f"SELECT {', '.join(self.columns)} FROM companies {where} "
+            f"ORDER BY employees DESC, inn LIMIT ?",
+            (*params, -1 if limit is None else limit)
+        )
+        return CompanyBatch.from_records(CompanyData(*row) for row in rows)
+
+
+class ExportState(Base):
+    """
+    Отпечатки строк последней выгрузки по ИНН. ИНН, которых не было в
+    текущей выгрузке, считаются удалёнными. Изменения сохраняются только
+    commit'ом после записи файлов, поэтому упавшая выгрузка в следующий раз
+    даст ту же дельту
+    """
+    def __init__(self, file_path: Path) -> None:
+        self.file_path = file_path
+        self.file_path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(file_path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS exported (inn TEXT PRIMARY KEY, fingerprint INTEGER NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TEMP TABLE incoming (inn TEXT PRIMARY KEY, fingerprint INTEGER NOT NULL)"
+        )
+        self.connection.execute("CREATE TEMP TABLE seen (inn TEXT PRIMARY KEY)")
+
+    def __enter__(self) -> "ExportState":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.connection.close()  # Без commit всё записанное за выгрузку откатывается
+
+    @staticmethod
+    def fingerprints(data_frame: pandas.DataFrame) -> list[int]:
+        hashes = pandas.util.hash_pandas_object(data_frame.astype(str), index=False)
+        return hashes.to_numpy().view("int64").tolist()  # SQLite хранит только знаковые 64 бита
+
+    def compare(self, inns: pandas.Series, fingerprints: list[int]) -> pandas.Series:
+        """Для каждой строки "added", "changed" или "unchanged". ИНН в пачке не повторяются"""
+        self.connection.execute("DELETE FROM incoming")
+        self.connection.executemany("INSERT INTO incoming VALUES (?, ?)", zip(inns, fingerprints))
+        self.connection.execute("INSERT INTO seen SELECT inn FROM incoming")
+        changes = dict(self.connection.execute(
+            "SELECT incoming.inn, CASE "
+            "WHEN exported.inn IS NULL THEN 'added' "
+            "WHEN exported.fingerprint = incoming.fingerprint THEN 'unchanged' "
+            "ELSE 'changed' END "
+            "FROM incoming LEFT JOIN exported USING (inn)"
+        ))
+        self.connection.execute(
+            "INSERT INTO exported SELECT inn, fingerprint FROM incoming WHERE true "
+            "ON CONFLICT (inn) DO UPDATE SET fingerprint = excluded.fingerprint "
+            "WHERE fingerprint != excluded.fingerprint"
+        )
+        return inns.map(changes)
+
+    def removed(self) -> list[str]:
+        """Вызывается после последней пачки"""
+        condition = "inn NOT IN (SELECT inn FROM seen)"
+        inns = [inn for inn, in self.connection.execute(f"SELECT inn FROM exported WHERE {condition}")]
+        self.connection.execute(f"DELETE FROM exported WHERE {condition}")
+        return inns
+
+    def commit(self) -> None:
+        self.connection.commit()
+
+
+class Exporter(Base):
+    """
+    Пишет данные пачками по мере поступления в один из форматов: csv,
+    csv.gz, csv.zst, jsonl или parquet (последним двум нужны zstandard и
+    pyarrow). Компании с уже записанным ИНН пропускаются, поэтому
+    пересекающиеся по ID файлы не дают дубликатов.
+
+    Кроме полной выгрузки пишет companies.delta.{формат}: компании,
+    добавленные, изменённые или удалённые с прошлой выгрузки в ту же папку,
+    с колонкой change. У удалённых заполнен только ИНН. Компании без ИНН в
+    дельту не попадают
+    """
     columns_order = [
         "inn",
         "name",
@@ -365,16 +2257,159 @@ class Exporter:
         "site",
         "source"
     ]
-
-    def __init__(self, normalized_data: NormalizedData) -> None:
-        self.normalized_data = normalized_data
+    dtypes = {"employees": "int64", "okved_main": "int64", "region": "category"}
+    formats = ("csv", "csv.gz", "csv.zst", "jsonl", "parquet")
+    state_name = "export_state.sqlite3"
+
+    def __init__(
+            self,
+            normalized_data: NormalizedData | Iterable[NormalizedData],
+            format: str = EXPORT_FORMAT,
+            export_dir: Path | None = None,
+            snapshot: bool = EXPORT_SNAPSHOT,
+            delta: bool = EXPORT_DELTA,
+            state_file: Path | None = None,  # Своё состояние у каждого источника, иначе дельты путаются
+    ) -> None:
+        if format not in self.formats:
+            raise ValueError(f"Unknown export format: {format}")
+        if not (snapshot or delta):
+            raise ValueError("Nothing to export: both snapshot and delta are off")
+        self.normalized_data = normalized_data  # Одна пачка или поток пачек из Normalizer.stream
+        self.format = format
+        self.export_dir = export_dir or EXPORT_DIR
+        self.snapshot = snapshot
+        self.delta = delta
+        self.state_file = state_file or self.export_dir.joinpath(self.state_name)
+        self.seen_inns: set[str] = set()
+        self.rows = 0
+        self.changes: Counter[str] = Counter()
 
     @property
     def file_path(self) -> Path:
-        return EXPORT_DIR.joinpath("companies.csv")
+        return self.export_dir.joinpath(f"companies.{self.format}")
+
+    @property
+    def delta_path(self) -> Path:
+        return self.export_dir.joinpath(f"companies.delta.{self.format}")
+
+    @property
+    def batches(self) -> Iterable[NormalizedData]:
+        data = self.normalized_data
+        if isinstance(data, CompanyBatch):
+            return [data]
+        return data
 
     def exec(self) -> None:
-        data_frame = pandas.DataFrame(
-            self.normalized_data, columns=self.columns_order
-        )
-        data_frame.to_csv(self.file_path, index=False, encoding="utf-8")
+        state = ExportState(self.state_file) if self.delta else None
+        with state or nullcontext(), ExitStack() as writers:
+            if self.snapshot:
+                write_snapshot = writers.enter_context(self.writer(self.file_path, self.columns_order))
+            if state:
+                write_delta = writers.enter_context(
+                    self.writer(self.delta_path, [*self.columns_order, "change"])
+                )
+            for data_frame in self.data_frames():
+                if self.snapshot:
+                    write_snapshot(data_frame)
+                if state:
+                    write_delta(self.changed(data_frame, state))
+            if state:
+                write_delta(self.removed(state))
+                writers.close()
+                state.commit()
+        if self.snapshot:
+            self.log(f"Exported {self.rows} companies to {self.file_path}")
+        if self.delta:
+            added, changed, removed = (self.changes[change] for change in ("added", "changed", "removed"))
+            self.log(f"Exported {added} added, {changed} changed and {removed} removed companies "
+                     f"to {self.delta_path}")
+
+    def changed(self, data_frame: pandas.DataFrame, state: ExportState) -> pandas.DataFrame:
+        inns = data_frame["inn"].astype(str)
+        tracked = inns != Normalizer.blank
+        change = state.compare(inns[tracked], state.fingerprints(data_frame[tracked]))
+        self.changes.update(change)
+        return data_frame[tracked].assign(change=change)[change != "unchanged"]
+
+    def removed(self, state: ExportState) -> pandas.DataFrame:
+        inns = state.removed()
+        self.changes["removed"] += len(inns)
+        blank = Normalizer.blank
+        data_frame = pandas.DataFrame({
+            column: inns if column == "inn" else 0 if self.dtypes.get(column) == "int64" else blank
+            for column in self.columns_order
+        }, index=range(len(inns)))
+        return data_frame.astype(self.dtypes).assign(change="removed")
+
+    def writer(
+            self, path: Path, columns: list[str]
+    ) -> AbstractContextManager[Callable[[pandas.DataFrame], None]]:
+        if self.format == "parquet":
+            return self.parquet_writer(path, columns)
+        return self.text_writer(path, columns)
+
+    @contextmanager
+    def text_writer(
+            self, path: Path, columns: list[str]
+    ) -> Iterator[Callable[[pandas.DataFrame], None]]:
+        with self.open_text_file(path) as file:
+            if self.format != "jsonl":
+                pandas.DataFrame(columns=columns).to_csv(file, index=False)
+
+            def write(data_frame: pandas.DataFrame) -> None:
+                if self.format == "jsonl":
+                    data_frame.to_json(file, orient="records", lines=True, force_ascii=False)
+                else:
+                    data_frame.to_csv(file, index=False, header=False)
+
+            yield write
+
+    def open_text_file(self, path: Path) -> TextIO:
+        if self.format == "csv.gz":
+            return gzip.open(path, "wt", encoding="utf-8", newline="")
+        if self.format == "csv.zst":
+            import zstandard
+            return zstandard.open(path, "w", encoding="utf-8", newline="")
+        return open(path, "w", encoding="utf-8", newline="")
+
+    @contextmanager
+    def parquet_writer(
+            self, path: Path, columns: list[str]
+    ) -> Iterator[Callable[[pandas.DataFrame], None]]:
+        import pyarrow
+        import pyarrow.parquet
+
+        types = {
+            "inn": pyarrow.string(),
+            "name": pyarrow.string(),
+            "employees": pyarrow.int64(),
+            "okved_main": pyarrow.int64(),
+            "region": pyarrow.dictionary(pyarrow.int32(), pyarrow.string()),
+            "contacts": pyarrow.string(),
+            "site": pyarrow.string(),
+            "source": pyarrow.string(),
+            "change": pyarrow.string(),
+        }
+        schema = pyarrow.schema([(column, types[column]) for column in columns])
+        with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+            def write(data_frame: pandas.DataFrame) -> None:
+                data_frame = data_frame.astype({"inn": str})
+                writer.write_table(
+                    pyarrow.Table.from_pandas(data_frame, schema=schema, preserve_index=False)
+                )
+
+            yield write
+
+    def data_frames(self) -> Iterator[pandas.DataFrame]:
+        for batch in self.batches:
+            data_frame = self.deduplicate(batch.to_frame()[self.columns_order])
+            if not data_frame.empty:
+                self.rows += len(data_frame)
+                yield data_frame.astype(self.dtypes)
+
+    def deduplicate(self, data_frame: pandas.DataFrame) -> pandas.DataFrame:
+        inns = data_frame["inn"].astype(str)
+        blank = inns == Normalizer.blank  # Компании без ИНН не с чем сравнивать, оставляем
+        duplicated = inns.duplicated() | inns.isin(self.seen_inns)
+        self.seen_inns.update(inns[~blank])
+        return data_frame[blank | ~duplicated]
@@ -0,0 +1,260 @@
+"""
+Офлайн-бенчмарк пайплайна на синтетических данных в формате list-org.
+
+    python -m src.bench --rows 20000 --files 4 --output bench.json
+
+Замеряет ReaderExcel, Normalizer (построчный и векторный), Exporter и весь
+путь целиком, а также CompanyDataDownloader против локального HTTP сервера.
+Результат пишется в JSON, чтобы сравнивать прогоны между коммитами
+"""
+import argparse, json, platform, random, subprocess, tempfile, threading, time, tracemalloc
+from collections.abc import Callable
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import openpyxl
+
+from src.app import (
+    CompanyDataDownloader,
+    CompanySourceData,
+    Exporter,
+    Normalizer,
+    ReaderExcel,
+    Validator,
+    VectorizedNormalizer,
+)
+from src.config import BASE_DIR
+from src.utils import Base
+
+
+class SyntheticData(CompanySourceData):
+    """
+    Генерирует xlsx файлы с теми же колонками, что отдаёт excel_list.php
+    """
+    columns = [
+        "Ссылка на www.list-org.com",
+        "Наименование",
+        "Юридическое наименование",
+        "Статус",
+        "Руководитель",
+        "ИНН",
+        "ОГРН",
+        "Телефон (один из)",
+        "E-mail",
+        "Сайт",
+        "Юридический адрес",
+        "Сотрудников",
+        "Выручка (Ф2.2110)",
+        "Прибыль (Ф2.2400)",
+        "Стоимость (Ф1.1300)",
+        "Описание",
+        "В избранном",
+    ]
+    addresses = [
+        "{index}, Г.Москва, МУНИЦИПАЛЬНЫЙ ОКРУГ ТВЕРСКОЙ, УЛ ТВЕРСКАЯ, Д. {house}",
+        "{index}, МОСКВА ГОРОД, УЛ. ВАВИЛОВА, Д.{house}",
+        "{index}, Г.САНКТ-ПЕТЕРБУРГ, УЛ. КИЕВСКАЯ, Д. {house}",
+        "{index}, ЯРОСЛАВСКАЯ ОБЛАСТЬ, Г. ЯРОСЛАВЛЬ, ПР-КТ МОСКОВСКИЙ, Д.{house}",
+        "{index}, РЕСПУБЛИКА ТАТАРСТАН (ТАТАРСТАН), Г. ИННОПОЛИС, УЛ. УНИВЕРСИТЕТСКАЯ, Д. {house}",
+        "{index}, КРАСНОДАРСКИЙ КРАЙ, Г. КРАСНОДАР, УЛ. СОЛНЕЧНАЯ, ДОМ {house}",
+    ]
+
+    def __init__(self, seed: int = 0) -> None:
+        self.random = random.Random(seed)
+        self.next_inn = 7700000000
+
+    def write_files(self, dir: Path, files: int, rows: int) -> list[Path]:
+        paths = []
+        for number in range(files):
+            path = dir.joinpath(f"data_{number}.xlsx")
+            self.write_file(path, rows)
+            paths.append(path)
+        return paths
+
+    def write_file(self, path: Path, rows: int) -> None:
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(self.columns)
+        for _ in range(rows):
+            sheet.append(self.row())
+        workbook.save(path)
+
+    def row(self) -> list:
+        self.next_inn += 1
+        values = {
+            "Наименование": f"ООО \"КОМПАНИЯ {self.next_inn}\"",
+            "Юридическое наименование": f"ОБЩЕСТВО С ОГРАНИЧЕННОЙ ОТВЕТСТВЕННОСТЬЮ \"КОМПАНИЯ {self.next_inn}\"",
+            "Статус": "действующее",
+            "ИНН": str(self.next_inn),
+            "ОГРН": 1027700000000 + self.next_inn % 10 ** 6,
+            "Телефон (один из)": self.maybe(
+                f"+7 ({self.random.randint(300, 999)}) "
+                f"{self.random.randint(100, 999)}-{self.random.randint(10, 99)}-{self.random.randint(10, 99)}"
+            ),
+            "Сайт": self.maybe(f"www.company{self.next_inn}.ru"),
+            "Юридический адрес": self.random.choice(self.addresses).format(
+                index=self.random.randint(100000, 199999), house=self.random.randint(1, 200)
+            ),
+            "Сотрудников": self.random.randint(100, 10000),
+        }
+        return [values.get(column) for column in self.columns]
+
+    def maybe(self, value: str) -> str | None:
+        return value if self.random.random() < 0.7 else None
+
+
+class XlsxRequestHandler(BaseHTTPRequestHandler):
+    """
+    Локальная замена excel_list.php: отдаёт один и тот же xlsx на любой GET
+    """
+    payload = b""
+
+    def do_GET(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.ms-excel")
+        self.send_header("Content-Length", str(len(self.payload)))
+        self.end_headers()
+        self.wfile.write(self.payload)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class LocalServer:
+    def __init__(self, payload: bytes) -> None:
+        handler = type("Handler", (XlsxRequestHandler,), {"payload": payload})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/excel_list.php?ids="
+
+    def __enter__(self) -> "LocalServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class Benchmark(Base):
+    def __init__(
+            self, rows: int = 10_000, files: int = 4, memory: bool = True, seed: int = 0
+    ) -> None:
+        self.rows = rows
+        self.files = files
+        self.memory = memory  # tracemalloc замедляет код, поэтому память меряется отдельным прогоном
+        self.seed = seed
+        self.stages: dict[str, dict] = {}
+
+    def exec(self) -> dict:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            work_dir = Path(temp_dir)
+            source_dir = work_dir.joinpath("source")
+            source_dir.mkdir()
+            SyntheticData(self.seed).write_files(source_dir, self.files, self.rows)
+            self.run_pipeline_stages(source_dir, work_dir)
+            self.run_download_stage(source_dir, work_dir)
+        return self.report()
+
+    def run_pipeline_stages(self, source_dir: Path, work_dir: Path) -> None:
+        reader = ReaderExcel()
+        reader.dir = source_dir
+        company_data = self.measure("read", reader.exec, rows=len)
+        self.measure(
+            "read_stream", lambda: sum(len(chunk) for chunk in reader.stream()), rows=int
+        )
+        self.measure("normalize_rows", Normalizer(company_data).exec, rows=len)
+        normalized_data = self.measure(
+            "normalize_vectorized", VectorizedNormalizer(company_data).exec, rows=len
+        )
+        self.measure(
+            "validate",
+            lambda: Validator(reject_file=None).exec(normalized_data),
+            rows=lambda _: len(normalized_data),
+        )
+        for format in ("csv", "jsonl"):
+            self.measure(
+                f"export_{format}",
+                lambda: Exporter(normalized_data, format, work_dir, delta=False).exec(),
+                rows=lambda _: len(normalized_data),
+            )
+        self.measure("end_to_end", lambda: self.end_to_end(reader, work_dir), rows=int)
+
+    def end_to_end(self, reader: ReaderExcel, export_dir: Path) -> int:
+        exporter = Exporter(Normalizer.stream(reader.stream()), "csv", export_dir, delta=False)
+        exporter.exec()
+        return exporter.rows
+
+    def run_download_stage(self, source_dir: Path, work_dir: Path) -> None:
+        download_dir = work_dir.joinpath("downloads")
+        download_dir.mkdir()
+        payload = source_dir.joinpath("data_0.xlsx").read_bytes()
+        with LocalServer(payload) as server:
+            links = [f"{server.url}{number}" for number in range(self.files)]
+
+            def download() -> None:
+                downloader = CompanyDataDownloader("benchmark", links)
+                downloader.dir = download_dir
+                downloader.exec()
+
+            self.measure("download", download, rows=lambda _: self.rows * self.files)
+        self.stages["download"]["bytes"] = len(payload) * self.files
+
+    def measure(self, stage: str, function: Callable, rows: Callable) -> object:
+        started = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - started
+        self.stages[stage] = {
+            "seconds": round(seconds, 6),
+            "rows": rows(result),
+            "rows_per_second": round(rows(result) / seconds, 1) if seconds else None,
+        }
+        if self.memory:
+            tracemalloc.start()
+            try:
+                function()
+                self.stages[stage]["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        self.log(f"Benchmark stage {stage}: {seconds:.3f}s")
+        return result
+
+    def report(self) -> dict:
+        return {
+            "commit": self.commit(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "params": {"rows": self.rows, "files": self.files, "seed": self.seed},
+            "stages": self.stages,
+        }
+
+    def commit(self) -> str | None:
+        try:
+            result = subprocess.run(
+                ["git", "rev-parse", "HEAD"],
+                cwd=BASE_DIR, capture_output=True, text=True, check=True
+            )
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        return result.stdout.strip()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=10_000, help="строк в каждом файле")
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="не замерять пиковую память")
+    parser.add_argument("--output", type=Path, default=Path("bench.json"))
+    args = parser.parse_args()
+
+    report = Benchmark(args.rows, args.files, not args.no_memory, args.seed).exec()
+    args.output.write_text(json.dumps(report, indent=4, ensure_ascii=False), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,10 +3,86 @@ from pathlib import Path
 BASE_DIR = Path(__file__).resolve().parent
 
 CACHE_FILE = BASE_DIR.joinpath("cache.json")
+CACHE_DB_FILE = BASE_DIR.joinpath("cache.sqlite3")
+CACHE_BACKEND = "json"  # "json" или "sqlite" (при первом запуске в базу переносится cache.json)
+CACHE_FLUSH_EVERY = 1000
+BATCH_STATE_FILE = BASE_DIR.joinpath("batch_state.json")
+COOKIE_FILE = BASE_DIR.joinpath("cookies.json")
+JOBS_FILE = BASE_DIR.joinpath("jobs.json")
+COOKIE_SESSION_TTL = 6 * 60 * 60  # секунды, для cookie без явного expires
 DOWNLOAD_DIR = BASE_DIR.joinpath("company_data")
+SEARCH_PAGES_DIR = DOWNLOAD_DIR.joinpath("pages")  # HTML страниц поиска, из них берутся строки компаний
 LOGGING_CONFIG = BASE_DIR.joinpath("logger_config.json")
 EXPORT_DIR = BASE_DIR.parent.joinpath("data")
 
-ITERATIONS = 4
+ITERATIONS = 4  # Мы делаем 4 реквеста из 10 возможных для сбора данных
+
+# Поисковые запросы: каждая страница выдачи становится отдельным заданием в JOBS_FILE
+QUERIES = [
+    {"okved": 62, "staff_min": 100, "staff_max": None, "pages": range(1, ITERATIONS + 1)},
+]
+
+BATCH_SIZE_START = 100  # ID в одной ссылке на скачивание, 100 работает всегда
+BATCH_SIZE_MIN = 25
+BATCH_SIZE_MAX = 250
+BATCH_SIZE_STEP = 50
+
+SCRAPER_MODE = "fast"  # "fast" (headless, параллельные вкладки), "browser" или "http" (страницы поиска по HTTP с сохранённым cookie)
+SCRAPER_POOL_SIZE = 2
+SCRAPER_TIMEOUT = 30_000  # миллисекунды
+SCRAPER_CAPTCHA_TIMEOUT = 5 * 60 * 1000  # миллисекунды на ручное прохождение капчи в окне браузера
+
+DOWNLOAD_WORKERS = 2
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_BACKOFF = 2.0  # секунды, удваивается с каждой попыткой
+DOWNLOAD_TIMEOUT = 30
+DOWNLOAD_PARSE_OVERLAP = True  # Разбирать xlsx из памяти, пока качаются следующие файлы
+DOWNLOAD_ARCHIVE = True  # Сохранять скачанные xlsx в DOWNLOAD_DIR (иначе остаётся только кэш нормализации)
+DOWNLOAD_XLSX = True  # xlsx добавляют телефоны и сайты; False — компании только из HTML страниц поиска, вдвое меньше реквестов
+
+GOVERNOR_FILE = BASE_DIR.joinpath("governor.json")
+REQUEST_BUDGET = 10  # Реквестов к list-org в сутки: страницы поиска, страница для cookie и xlsx
+REQUEST_RATE = 0.5  # Реквестов в секунду в среднем
+REQUEST_BURST = 2  # Реквестов подряд без ожидания
+REQUEST_COOLDOWN = 15 * 60  # секунды паузы после блокировки, удваивается при повторной
+CAPTCHA_LIMIT = 2  # Капч подряд, после которых включается пауза
+
+TRANSPORT = "live"  # "record" — сохранять ответы list-org в RECORDING_DIR, "replay" — отдавать их оттуда без сети
+RECORDING_DIR = BASE_DIR.joinpath("recording")
+
+RESPONSE_CACHE = True  # Кэш ответов list-org (страницы поиска и xlsx) на диске
+RESPONSE_CACHE_DIR = BASE_DIR.joinpath("responses")
+RESPONSE_CACHE_TTL = 12 * 60 * 60  # секунды: более свежий ответ отдаётся без запроса, старый перепроверяется
+RESPONSE_CACHE_MAX_BYTES = 512 * 1024 * 1024  # Сверх этого удаляются давно не использованные ответы
+
+READER_CHUNK_SIZE = 5000  # Строк в одной пачке при потоковом чтении xlsx
+READER_WORKERS = 1  # Больше 1 — файлы разбираются в пуле процессов
+
+NORMALIZER_MODE = "vectorized"  # "vectorized" или "rows" (построчный Normalizer)
+VALIDATION_REJECT_FILE = EXPORT_DIR.joinpath("rejected.csv")  # Строки с неверным ИНН, телефоном или сайтом и причиной
+REGION_CACHE_SIZE = 100_000  # Уникальных адресов, для которых запоминается субъект РФ
+
+DUMP_CHUNK_SIZE = 50_000  # Строк дампа реестра в одной пачке src.dump
+DUMP_WORKERS = 4  # Процессов нормализации дампа, 1 — без пула
+# Колонки Normalizer (как в xlsx list-org) -> колонки дампа; сайта и телефона в дампе может не быть
+DUMP_COLUMNS = {
+    "ИНН": "inn",
+    "Юридическое наименование": "full_name",
+    "Сотрудников": "employees",
+    "Сайт": "site",
+    "Юридический адрес": "address",
+    "Телефон (один из)": "phone",
+}
+DUMP_OKVED_COLUMN = "okved"  # Основной ОКВЭД, например "62.01"
+DUMP_EXPORT_DIR = EXPORT_DIR.joinpath("dumps")  # Отдельно от выгрузки list-org в EXPORT_DIR
+
+METRICS_DIR = BASE_DIR.joinpath("metrics")
+METRICS_TRACE_MEMORY = False  # Пиковая память этапов через tracemalloc (медленно), иначе прирост RSS
+PROFILE_STAGE = None  # Например "normalize": cProfile для одного этапа, .prof кладётся в METRICS_DIR
+
+EXPORT_FORMAT = "csv"  # "csv", "csv.gz", "csv.zst", "jsonl" или "parquet"
+EXPORT_SNAPSHOT = True  # Полная выгрузка companies.{формат}
+EXPORT_DELTA = True  # companies.delta.{формат}: добавленные, изменённые и удалённые с прошлой выгрузки
+STORE_FILE = EXPORT_DIR.joinpath("companies.sqlite3")  # Накопительная база компаний, обновляется каждым запуском
 
 TEST_DATA = BASE_DIR.joinpath("test_data.json")
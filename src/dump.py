@@ -0,0 +1,322 @@
+"""
+Потоковая загрузка больших дампов реестров в схему CompanyData.
+
+    python -m src.dump egrul.sql.gz --okved 62 --staff-min 100 --workers 8
+
+Дамп (CSV или SQL с INSERT/COPY, можно в .gz) читается пачками по
+DUMP_CHUNK_SIZE строк, отбор по ОКВЭД и числу сотрудников и нормализация
+идут в пуле процессов, а результат после Validator пишет Exporter в тех же
+колонках, что и для list-org, но в DUMP_EXPORT_DIR. source у строк — имя
+дампа, okved_main — класс их собственного ОКВЭД. В памяти одновременно не
+больше workers * 2 пачек
+"""
+import argparse, csv, gzip, multiprocessing, re
+from array import array
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import TextIO, override
+
+import pandas
+
+from src.app import CompanyBatch, CompanySourceData, Exporter, Normalizer, Validator
+from src.config import (
+    DUMP_CHUNK_SIZE,
+    DUMP_COLUMNS,
+    DUMP_EXPORT_DIR,
+    DUMP_OKVED_COLUMN,
+    DUMP_WORKERS,
+    EXPORT_FORMAT,
+    NORMALIZER_MODE,
+    VALIDATION_REJECT_FILE,
+)
+from src.metrics import metrics
+from src.utils import Base
+
+
+class DumpReader(Base):
+    """
+    Отдаёт дамп пачками DataFrame со строковыми колонками. Остаются только
+    колонки из columns, недостающие заполняются пустыми значениями
+    """
+    def __init__(
+            self, path: Path, columns: list[str], chunk_size: int = DUMP_CHUNK_SIZE
+    ) -> None:
+        self.path = path
+        self.columns = columns
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def create(
+            cls, path: Path, columns: list[str], chunk_size: int = DUMP_CHUNK_SIZE
+    ) -> "DumpReader":
+        suffixes = [suffix for suffix in path.suffixes if suffix != ".gz"]
+        if suffixes and suffixes[-1] == ".sql":
+            return SQLDumpReader(path, columns, chunk_size)
+        return CSVDumpReader(path, columns, chunk_size)
+
+    def open(self) -> TextIO:
+        if self.path.suffix == ".gz":
+            return gzip.open(self.path, "rt", encoding="utf-8", newline="")
+        return open(self.path, encoding="utf-8", newline="")
+
+    def stream(self) -> Iterator[pandas.DataFrame]:
+        raise NotImplementedError
+
+    def frame(self, rows: list[list[str | None]], header: list[str]) -> pandas.DataFrame:
+        data_frame = pandas.DataFrame(rows, columns=header, dtype=object)
+        return data_frame.reindex(columns=self.columns)
+
+
+class CSVDumpReader(DumpReader):
+    @override
+    def stream(self) -> Iterator[pandas.DataFrame]:
+        with self.open() as file:
+            sample = file.read(64 * 1024)
+            file.seek(0)
+            chunks = pandas.read_csv(
+                file,
+                sep=self.delimiter(sample),
+                dtype=str,
+                usecols=lambda column: column in self.columns,
+                chunksize=self.chunk_size,
+            )
+            for chunk in chunks:
+                yield chunk.reindex(columns=self.columns)
+
+    def delimiter(self, sample: str) -> str:
+        try:
+            return csv.Sniffer().sniff(sample, delimiters=",;\t|").delimiter
+        except csv.Error:
+            return ","
+
+
+class SQLDumpReader(DumpReader):
+    """
+    Разбирает INSERT INTO ... VALUES (...), (...); (с перечнем колонок или
+    без него, тогда колонки берутся из CREATE TABLE) и блоки COPY ... FROM
+    stdin. Строки одной пачки всегда из одной таблицы; таблицы без нужных
+    колонок пропускаются
+    """
+    create_table = re.compile(r"CREATE TABLE (?:IF NOT EXISTS )?([\w.`\"]+)\s*\(", re.IGNORECASE)
+    insert = re.compile(
+        r"INSERT INTO ([\w.`\"]+)\s*(?:\(([^)]*)\))?\s*VALUES\s*", re.IGNORECASE
+    )
+    copy = re.compile(r"COPY ([\w.`\"]+)\s*\(([^)]*)\)\s*FROM stdin", re.IGNORECASE)
+    row = re.compile(r"\(((?:[^()']|'(?:[^'\\]|\\.|'')*')*)\)")
+    value = re.compile(r"'((?:[^'\\]|\\.|'')*)'|([^,\s]+)")
+    escapes = {"n": "\n", "t": "\t", "r": "\r", "0": "\0"}
+
+    @override
+    def stream(self) -> Iterator[pandas.DataFrame]:
+        tables: dict[str, list[str]] = {}
+        rows, header = [], None
+        with self.open() as file:
+            for columns, values in self.statements(file, tables):
+                if not set(self.columns) & set(columns):
+                    continue
+                if columns != header and rows:
+                    yield self.frame(rows, header)
+                    rows = []
+                header = columns
+                for row in values:
+                    rows.append(row)
+                    if len(rows) == self.chunk_size:
+                        yield self.frame(rows, header)
+                        rows = []
+        if rows:
+            yield self.frame(rows, header)
+
+    def statements(
+            self, file: TextIO, tables: dict[str, list[str]]
+    ) -> Iterator[tuple[list[str], Iterator[list[str | None]]]]:
+        lines = iter(file)
+        for line in lines:
+            if match := self.create_table.match(line):
+                tables[self.name(match.group(1))] = self.table_columns(lines)
+            elif match := self.copy.match(line):
+                yield self.column_list(match.group(2)), self.copy_rows(lines)
+            elif match := self.insert.match(line):
+                statement = line
+                while not statement.rstrip().endswith(";"):  # INSERT может занимать несколько строк
+                    statement += next(lines, ";")
+                table = self.name(match.group(1))
+                columns = self.column_list(match.group(2)) if match.group(2) else tables.get(table, [])
+                yield columns, self.insert_rows(statement[match.end():])
+
+    def table_columns(self, lines: Iterator[str]) -> list[str]:
+        columns = []
+        for line in lines:
+            line = line.strip()
+            if line.startswith(")"):
+                break
+            name = line.split(maxsplit=1)[0] if line else ""
+            if name and name.upper() not in {"PRIMARY", "KEY", "UNIQUE", "CONSTRAINT", "INDEX", "FOREIGN"}:
+                columns.append(self.name(name))
+        return columns
+
+    def copy_rows(self, lines: Iterator[str]) -> Iterator[list[str | None]]:
+        for line in lines:
+            line = line.rstrip("\n")
+            if line == "\\.":
+                return
+            yield [None if value == "\\N" else self.unescape(value) for value in line.split("\t")]
+
+    def insert_rows(self, values: str) -> Iterator[list[str | None]]:
+        for row in self.row.finditer(values):
+            yield [self.parse_value(*value) for value in self.value.findall(row.group(1))]
+
+    def parse_value(self, quoted: str, bare: str) -> str | None:
+        if not bare:
+            return self.unescape(quoted.replace("''", "'"))
+        return None if bare.upper() == "NULL" else bare
+
+    def unescape(self, value: str) -> str:
+        if "\\" not in value:
+            return value
+        return re.sub(r"\\(.)", lambda match: self.escapes.get(match.group(1), match.group(1)), value)
+
+    def column_list(self, columns: str) -> list[str]:
+        return [self.name(column) for column in columns.split(",")]
+
+    @staticmethod
+    def name(identifier: str) -> str:
+        return identifier.strip().strip(",").split(".")[-1].strip("`\"")
+
+
+class DumpIngest(Base):
+    """
+    Отбирает компании дампа по префиксу ОКВЭД и числу сотрудников и
+    нормализует их Normalizer'ом. При workers > 1 пачки разбираются в пуле
+    процессов, чтение дампа в это время продолжается
+    """
+    def __init__(
+            self,
+            reader: DumpReader,
+            okved: str = "62",
+            staff_min: int | None = 100,
+            staff_max: int | None = None,
+            columns: dict[str, str] = DUMP_COLUMNS,  # Колонка list-org -> колонка дампа
+            okved_column: str = DUMP_OKVED_COLUMN,
+            workers: int = DUMP_WORKERS,
+            mode: str = NORMALIZER_MODE,
+            source: str = "dump",
+    ) -> None:
+        self.reader = reader
+        self.okved = okved
+        self.staff_min = staff_min
+        self.staff_max = staff_max
+        self.columns = columns
+        self.okved_column = okved_column
+        self.workers = workers
+        self.mode = mode
+        self.source = source
+        self.rows = 0
+        self.kept = 0
+
+    @classmethod
+    def create(cls, path: Path, chunk_size: int = DUMP_CHUNK_SIZE, **kwargs) -> "DumpIngest":
+        columns = kwargs.get("columns", DUMP_COLUMNS)
+        okved_column = kwargs.get("okved_column", DUMP_OKVED_COLUMN)
+        reader = DumpReader.create(path, [*columns.values(), okved_column], chunk_size)
+        return cls(reader, **{"source": path.name} | kwargs)
+
+    def exec(self) -> Iterator[CompanyBatch]:
+        chunks = metrics.iterate("read", self.reader.stream())
+        if self.workers > 1:
+            batches = self.normalize_parallel(chunks)
+        else:
+            batches = (self.normalize_chunk(chunk, *self.arguments) for chunk in chunks)
+        for rows, batch in batches:
+            self.rows += rows
+            self.kept += len(batch)
+            metrics.add("read", rows=rows)
+            metrics.add("normalize", rows=len(batch))
+            yield batch
+        self.log(f"Read {self.rows} dump rows, kept {self.kept} matching companies")
+
+    def normalize_parallel(
+            self, chunks: Iterator[pandas.DataFrame]
+    ) -> Iterator[tuple[int, CompanyBatch]]:
+        context = multiprocessing.get_context("spawn")  # fork небезопасен при живом потоке QueueListener
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as executor:
+            in_flight = deque()
+            for chunk in chunks:
+                in_flight.append(executor.submit(self.normalize_chunk, chunk, *self.arguments))
+                if len(in_flight) >= self.workers * 2:
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
+
+    @property
+    def arguments(self) -> tuple:
+        return (
+            self.columns, self.okved_column, self.okved, self.staff_min, self.staff_max, self.mode,
+            self.source,
+        )
+
+    @staticmethod
+    def normalize_chunk(
+            chunk: pandas.DataFrame,
+            columns: dict[str, str],
+            okved_column: str,
+            okved: str,
+            staff_min: int | None,
+            staff_max: int | None,
+            mode: str,
+            source: str,
+    ) -> tuple[int, CompanyBatch]:
+        """Выполняется в процессе пула: возвращает число прочитанных строк и отобранные компании"""
+        staff = pandas.to_numeric(chunk[columns["Сотрудников"]], errors="coerce")
+        selected = chunk[okved_column].fillna("").str.strip().str.startswith(okved) & staff.notna()
+        if staff_min is not None:
+            selected &= staff >= staff_min
+        if staff_max is not None:
+            selected &= staff <= staff_max
+        company_data = pandas.DataFrame({
+            source_column: chunk.loc[selected, dump_column]
+            for source_column, dump_column in columns.items()
+        }, columns=CompanySourceData.source_columns)
+        company_data["Сотрудников"] = staff[selected].astype("int64")
+        batch = Normalizer.create(company_data, mode).exec()
+        okved_class = chunk.loc[selected, okved_column].str.strip().str.extract(r"^(\d+)")[0]  # "63.11" -> 63
+        batch.okved_main = array("q", pandas.to_numeric(okved_class).fillna(0).astype("int64").tolist())
+        batch.source = [source] * len(batch)
+        return len(chunk), batch
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("dump", type=Path, help="CSV или SQL дамп, можно .gz")
+    parser.add_argument("--okved", default="62", help="префикс кода ОКВЭД")
+    parser.add_argument("--staff-min", type=int, default=100)
+    parser.add_argument("--staff-max", type=int)
+    parser.add_argument("--chunk-size", type=int, default=DUMP_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=DUMP_WORKERS)
+    parser.add_argument("--format", default=EXPORT_FORMAT, choices=Exporter.formats)
+    parser.add_argument("--output", type=Path, default=DUMP_EXPORT_DIR, help="папка для выгрузки, по умолчанию DUMP_EXPORT_DIR")
+    args = parser.parse_args()
+    ingest = DumpIngest.create(
+        args.dump,
+        args.chunk_size,
+        okved=args.okved,
+        staff_min=args.staff_min,
+        staff_max=args.staff_max,
+        workers=args.workers,
+    )
+    args.output.mkdir(parents=True, exist_ok=True)
+    reject_file = args.output.joinpath(VALIDATION_REJECT_FILE.name)
+    metrics.start()
+    with metrics.span("export"), Validator(reject_file) as validator:
+        Exporter(
+            validator.stream(ingest.exec()),
+            args.format,
+            args.output,
+            state_file=args.output.joinpath(f"{args.dump.name}.{Exporter.state_name}"),
+        ).exec()
+    metrics.dump()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Учёт реквестов к list-org, общий для Scraper и CompanyDataDownloader:
+дневной бюджет, темп и пауза после блокировки
+"""
+import threading, time
+from pathlib import Path
+from typing import override
+
+from src.config import (
+    CAPTCHA_LIMIT,
+    GOVERNOR_FILE,
+    REQUEST_BUDGET,
+    REQUEST_BURST,
+    REQUEST_COOLDOWN,
+    REQUEST_RATE,
+)
+from src.utils import Base, ReaderJSON
+
+
+class RequestBudgetExceeded(Exception):
+    """Дневной бюджет реквестов исчерпан или list-org временно блокирует запросы"""
+
+
+class RequestGovernor(Base, ReaderJSON):
+    """
+    Общий для Scraper и CompanyDataDownloader учёт реквестов к list-org:
+    дневной бюджет, который переживает перезапуски, равномерный темп через
+    token bucket и пауза после блокировки. Ответы 403/429 и несколько капч
+    подряд включают паузу, которая удваивается при повторной блокировке.
+    Пока она идёт или бюджет исчерпан, acquire сразу бросает
+    RequestBudgetExceeded: запуск не тратит реквесты впустую и не висит
+    """
+    blocked_statuses = {403, 429}
+    captcha_markers = ("captcha", "капч", "подтвердите, что вы не робот")
+
+    @override
+    def __init__(
+            self,
+            file_path: Path = GOVERNOR_FILE,
+            budget: int = REQUEST_BUDGET,
+            rate: float = REQUEST_RATE,
+            burst: int = REQUEST_BURST,
+            cooldown: float = REQUEST_COOLDOWN,
+            captcha_limit: int = CAPTCHA_LIMIT,
+    ) -> None:
+        super().__init__(file_path)
+        self.budget = budget
+        self.rate = rate
+        self.burst = burst
+        self.cooldown = cooldown
+        self.captcha_limit = captcha_limit
+        self.lock = threading.Lock()
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        self.state = {"day": "", "used": 0, "captchas": 0, "blocks": 0, "cooldown_until": 0.0}
+        if file_path.exists():
+            self.state.update(self.load())
+
+    @classmethod
+    def is_captcha(cls, html: str | bytes) -> bool:
+        if isinstance(html, bytes):
+            html = html.decode("utf-8", errors="replace")
+        html = html.lower()
+        return any(marker in html for marker in cls.captcha_markers)
+
+    def acquire(self) -> None:
+        """Списывает реквест из бюджета и ждёт своей очереди в token bucket"""
+        with self.lock:
+            self.start_day()
+            cooldown = self.state["cooldown_until"] - time.time()
+            if cooldown > 0:
+                raise RequestBudgetExceeded(f"list-org is blocking requests, cooling down for {cooldown:.0f}s")
+            if self.state["used"] >= self.budget:
+                raise RequestBudgetExceeded(f"Daily budget of {self.budget} requests is used up")
+            self.state["used"] += 1
+            self.dump(self.state)
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate) - 1
+            self.refilled_at = now
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0  # Токен занят заранее, ждём его вне lock
+        if wait:
+            time.sleep(wait)
+
+    def refund(self) -> None:
+        """Возвращает реквест, который не понадобился: страницу отдал кэш"""
+        with self.lock:
+            self.state["used"] = max(0, self.state["used"] - 1)
+            self.dump(self.state)
+            self.tokens = min(self.burst, self.tokens + 1)
+
+    def observe_status(self, status: int, retry_after: str | None = None) -> None:
+        if status in self.blocked_statuses:
+            with self.lock:
+                self.block(f"HTTP {status}", retry_after)
+
+    def observe_page(self, captcha: bool) -> None:
+        with self.lock:
+            if not captcha:
+                self.state.update(captchas=0, blocks=0)
+            else:
+                self.state["captchas"] += 1
+                if self.state["captchas"] >= self.captcha_limit:
+                    self.block(f"{self.state['captchas']} captchas in a row")
+            self.dump(self.state)
+
+    def block(self, reason: str, retry_after: str | None = None) -> None:
+        cooldown = self.cooldown * 2 ** self.state["blocks"]
+        if retry_after and retry_after.isdigit():
+            cooldown = max(cooldown, int(retry_after))
+        self.state.update(
+            cooldown_until=time.time() + cooldown, blocks=self.state["blocks"] + 1, captchas=0
+        )
+        self.dump(self.state)
+        self.log(f"{reason}, pausing requests to list-org for {cooldown:.0f}s", "WARNING")
+
+    def start_day(self) -> None:
+        today = time.strftime("%Y-%m-%d")
+        if self.state["day"] != today:
+            self.state.update(day=today, used=0)
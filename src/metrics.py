@@ -0,0 +1,177 @@
+import cProfile, json, os, sys, threading, time, tracemalloc
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager, suppress
+from datetime import datetime
+from pathlib import Path
+from typing import Sized
+
+from src.config import METRICS_DIR, METRICS_TRACE_MEMORY, PROFILE_STAGE
+from src.utils import Base
+
+if sys.platform != "win32":
+    import resource
+else:
+    resource = None
+
+
+class Metrics(Base):
+    """
+    Метрики одного запуска: время и память по этапам, число строк и байт,
+    гистограммы задержек и статусов запросов. Время этапов считается
+    эксклюзивно: если внутри export идёт чтение и нормализация (потоковый
+    пайплайн), их время не попадает в export. Этапы в разных потоках
+    считаются независимо, поэтому при перекрытии загрузки и разбора сумма
+    секунд этапов может превышать время запуска. Память этапа — наибольший
+    прирост RSS за один его отрезок (вложенные этапы входят в него), пиковый
+    RSS всего процесса пишется в отчёт отдельно. Для одного этапа можно включить
+    cProfile через PROFILE_STAGE или переменную окружения SCRIPTORIUM_PROFILE
+    """
+    latency_buckets = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # секунды
+
+    def __init__(
+            self,
+            metrics_dir: Path = METRICS_DIR,
+            profile_stage: str | None = PROFILE_STAGE,
+            trace_memory: bool = METRICS_TRACE_MEMORY,
+    ) -> None:
+        self.metrics_dir = metrics_dir
+        self.profile_stage = os.environ.get("SCRIPTORIUM_PROFILE", profile_stage)
+        self.trace_memory = trace_memory  # tracemalloc точнее, но заметно замедляет код
+        self.lock = threading.Lock()
+        self.started_at = datetime.now()
+        self.stages: dict[str, dict[str, float]] = {}
+        self.requests: dict[str, dict] = {}
+        self.local = threading.local()  # Свой стек этапов у каждого потока
+        self.profile: cProfile.Profile | None = None
+        self.profile_depth = 0
+
+    @property
+    def stack(self) -> list[list]:
+        """[этап, момент начала текущего отрезка] для текущего потока"""
+        return self.local.__dict__.setdefault("stack", [])
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        now = time.perf_counter()
+        if self.stack:
+            self.charge(self.stack[-1], now)
+        self.stack.append([stage, now])
+        self.start_profile(stage)
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        rss = self.rss()
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self.charge(self.stack.pop(), now)
+            self.stop_profile(stage)
+            self.record_memory(stage, rss)
+            if self.stack:
+                self.stack[-1][1] = now
+            self.add(stage, calls=1)
+
+    def iterate[T: Sized](self, stage: str, iterable: Iterable[T]) -> Iterator[T]:
+        """
+        Относит к этапу время, потраченное на получение каждого элемента,
+        и число строк в нём
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.span(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                self.add(stage, rows=len(item))
+            yield item
+
+    def add(self, stage: str, **counters: float) -> None:
+        with self.lock:
+            stage_metrics = self.stages.setdefault(stage, {"seconds": 0.0})
+            for name, value in counters.items():
+                stage_metrics[name] = stage_metrics.get(name, 0) + value
+
+    def record_request(self, kind: str, seconds: float, status: int | str | None) -> None:
+        bucket = bisect_left(self.latency_buckets, seconds)
+        label = f"<={self.latency_buckets[bucket]}s" if bucket < len(self.latency_buckets) else "inf"
+        with self.lock:
+            requests = self.requests.setdefault(
+                kind, {"count": 0, "seconds": 0.0, "latency": Counter(), "status": Counter()}
+            )
+            requests["count"] += 1
+            requests["seconds"] += seconds
+            requests["latency"][label] += 1
+            requests["status"][str(status)] += 1
+
+    def charge(self, frame: list, now: float) -> None:
+        stage, started = frame
+        self.add(stage, seconds=now - started)
+
+    def record_memory(self, stage: str, rss: int | None) -> None:
+        peaks = {}
+        if rss is not None:
+            peaks["rss_delta_bytes"] = self.rss() - rss
+        if self.trace_memory and tracemalloc.is_tracing():
+            peaks["peak_traced_bytes"] = tracemalloc.get_traced_memory()[1]
+        with self.lock:
+            stage_metrics = self.stages.setdefault(stage, {"seconds": 0.0})
+            for name, value in peaks.items():
+                stage_metrics[name] = max(stage_metrics.get(name, value), value)
+
+    @staticmethod
+    def rss() -> int | None:
+        """Текущий RSS процесса из /proc. Где его нет (macOS), прирост считается по ru_maxrss"""
+        with suppress(OSError), open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        return Metrics.max_rss()
+
+    @staticmethod
+    def max_rss() -> int | None:
+        if not resource:
+            return None
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss * (1 if sys.platform == "darwin" else 1024)
+
+    def start_profile(self, stage: str) -> None:
+        if stage != self.profile_stage:
+            return
+        if not self.profile_depth:
+            self.profile = self.profile or cProfile.Profile()
+            self.profile.enable()
+        self.profile_depth += 1
+
+    def stop_profile(self, stage: str) -> None:
+        if stage != self.profile_stage:
+            return
+        self.profile_depth -= 1
+        if not self.profile_depth:
+            self.profile.disable()
+
+    def start(self) -> None:
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def dump(self) -> Path:
+        self.metrics_dir.mkdir(parents=True, exist_ok=True)
+        run_id = self.started_at.strftime("%Y%m%d_%H%M%S")
+        file_path = self.metrics_dir.joinpath(f"run_{run_id}.json")
+        report = {
+            "started_at": self.started_at.isoformat(),
+            "finished_at": datetime.now().isoformat(),
+            "max_rss_bytes": self.max_rss(),
+            "stages": self.stages,
+            "requests": self.requests,
+        }
+        if self.profile:
+            profile_path = self.metrics_dir.joinpath(f"run_{run_id}_{self.profile_stage}.prof")
+            self.profile.dump_stats(profile_path)
+            report["profile"] = str(profile_path)
+        with open(file_path, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=4, ensure_ascii=False)
+        return file_path
+
+
+metrics = Metrics()
@@ -0,0 +1,152 @@
+"""
+Определение субъекта РФ по юридическому адресу. Адрес делится на части по
+запятым, каждая часть приводится к верхнему регистру без скобок, точек и
+пробелов вокруг дефиса и целиком сравнивается одним скомпилированным
+выражением со всеми вариантами названий субъектов
+"""
+import re
+from functools import lru_cache
+
+from src.config import REGION_CACHE_SIZE
+
+# Тип субъекта может стоять до или после названия: "Г. МОСКВА", "МОСКВА ГОРОД", "ОБЛ ТВЕРСКАЯ"
+SUBJECT_TYPES = (
+    "АВТОНОМНЫЙ ОКРУГ|АВТОНОМНАЯ ОБЛАСТЬ|РЕСПУБЛИКА|ОБЛАСТЬ|ГОРОД|РЕСП|АОБЛ|ОБЛ|КРАЙ|ГОР|АО|Г"
+)
+
+# Код субъекта, каноническое название и варианты написания (регулярное выражение без типа)
+SUBJECTS = (
+    ("01", "РЕСПУБЛИКА АДЫГЕЯ", "АДЫГЕЯ"),
+    ("02", "РЕСПУБЛИКА БАШКОРТОСТАН", "БАШКОРТОСТАН|БАШКИРИЯ"),
+    ("03", "РЕСПУБЛИКА БУРЯТИЯ", "БУРЯТИЯ"),
+    ("04", "РЕСПУБЛИКА АЛТАЙ", "АЛТАЙ"),
+    ("05", "РЕСПУБЛИКА ДАГЕСТАН", "ДАГЕСТАН"),
+    ("06", "РЕСПУБЛИКА ИНГУШЕТИЯ", "ИНГУШЕТИЯ"),
+    ("07", "КАБАРДИНО-БАЛКАРСКАЯ РЕСПУБЛИКА", "КАБАРДИНО-БАЛКАРСКАЯ|КАБАРДИНО-БАЛКАРИЯ"),
+    ("08", "РЕСПУБЛИКА КАЛМЫКИЯ", "КАЛМЫКИЯ"),
+    ("09", "КАРАЧАЕВО-ЧЕРКЕССКАЯ РЕСПУБЛИКА", "КАРАЧАЕВО-ЧЕРКЕССКАЯ|КАРАЧАЕВО-ЧЕРКЕСИЯ"),
+    ("10", "РЕСПУБЛИКА КАРЕЛИЯ", "КАРЕЛИЯ"),
+    ("11", "РЕСПУБЛИКА КОМИ", "КОМИ"),
+    ("12", "РЕСПУБЛИКА МАРИЙ ЭЛ", "МАРИЙ ЭЛ"),
+    ("13", "РЕСПУБЛИКА МОРДОВИЯ", "МОРДОВИЯ"),
+    ("14", "РЕСПУБЛИКА САХА (ЯКУТИЯ)", "САХА(?: ЯКУТИЯ)?|ЯКУТИЯ"),
+    ("15", "РЕСПУБЛИКА СЕВЕРНАЯ ОСЕТИЯ - АЛАНИЯ", "СЕВЕРНАЯ ОСЕТИЯ(?:-АЛАНИЯ)?"),
+    ("16", "РЕСПУБЛИКА ТАТАРСТАН", "ТАТАРСТАН"),
+    ("17", "РЕСПУБЛИКА ТЫВА", "ТЫВА|ТУВА"),
+    ("18", "УДМУРТСКАЯ РЕСПУБЛИКА", "УДМУРТСКАЯ|УДМУРТИЯ"),
+    ("19", "РЕСПУБЛИКА ХАКАСИЯ", "ХАКАСИЯ"),
+    ("20", "ЧЕЧЕНСКАЯ РЕСПУБЛИКА", "ЧЕЧЕНСКАЯ|ЧЕЧНЯ"),
+    ("21", "ЧУВАШСКАЯ РЕСПУБЛИКА", "ЧУВАШСКАЯ(?: РЕСПУБЛИКА)?(?:-ЧУВАШИЯ)?|ЧУВАШИЯ"),
+    ("22", "АЛТАЙСКИЙ КРАЙ", "АЛТАЙСКИЙ"),
+    ("23", "КРАСНОДАРСКИЙ КРАЙ", "КРАСНОДАРСКИЙ"),
+    ("24", "КРАСНОЯРСКИЙ КРАЙ", "КРАСНОЯРСКИЙ"),
+    ("25", "ПРИМОРСКИЙ КРАЙ", "ПРИМОРСКИЙ"),
+    ("26", "СТАВРОПОЛЬСКИЙ КРАЙ", "СТАВРОПОЛЬСКИЙ"),
+    ("27", "ХАБАРОВСКИЙ КРАЙ", "ХАБАРОВСКИЙ"),
+    ("28", "АМУРСКАЯ ОБЛАСТЬ", "АМУРСКАЯ"),
+    ("29", "АРХАНГЕЛЬСКАЯ ОБЛАСТЬ", "АРХАНГЕЛЬСКАЯ"),
+    ("30", "АСТРАХАНСКАЯ ОБЛАСТЬ", "АСТРАХАНСКАЯ"),
+    ("31", "БЕЛГОРОДСКАЯ ОБЛАСТЬ", "БЕЛГОРОДСКАЯ"),
+    ("32", "БРЯНСКАЯ ОБЛАСТЬ", "БРЯНСКАЯ"),
+    ("33", "ВЛАДИМИРСКАЯ ОБЛАСТЬ", "ВЛАДИМИРСКАЯ"),
+    ("34", "ВОЛГОГРАДСКАЯ ОБЛАСТЬ", "ВОЛГОГРАДСКАЯ"),
+    ("35", "ВОЛОГОДСКАЯ ОБЛАСТЬ", "ВОЛОГОДСКАЯ"),
+    ("36", "ВОРОНЕЖСКАЯ ОБЛАСТЬ", "ВОРОНЕЖСКАЯ"),
+    ("37", "ИВАНОВСКАЯ ОБЛАСТЬ", "ИВАНОВСКАЯ"),
+    ("38", "ИРКУТСКАЯ ОБЛАСТЬ", "ИРКУТСКАЯ"),
+    ("39", "КАЛИНИНГРАДСКАЯ ОБЛАСТЬ", "КАЛИНИНГРАДСКАЯ"),
+    ("40", "КАЛУЖСКАЯ ОБЛАСТЬ", "КАЛУЖСКАЯ"),
+    ("41", "КАМЧАТСКИЙ КРАЙ", "КАМЧАТСКИЙ"),
+    ("42", "КЕМЕРОВСКАЯ ОБЛАСТЬ - КУЗБАСС", "КЕМЕРОВСКАЯ(?: ОБЛАСТЬ-КУЗБАСС)?|КУЗБАСС"),
+    ("43", "КИРОВСКАЯ ОБЛАСТЬ", "КИРОВСКАЯ"),
+    ("44", "КОСТРОМСКАЯ ОБЛАСТЬ", "КОСТРОМСКАЯ"),
+    ("45", "КУРГАНСКАЯ ОБЛАСТЬ", "КУРГАНСКАЯ"),
+    ("46", "КУРСКАЯ ОБЛАСТЬ", "КУРСКАЯ"),
+    ("47", "ЛЕНИНГРАДСКАЯ ОБЛАСТЬ", "ЛЕНИНГРАДСКАЯ"),
+    ("48", "ЛИПЕЦКАЯ ОБЛАСТЬ", "ЛИПЕЦКАЯ"),
+    ("49", "МАГАДАНСКАЯ ОБЛАСТЬ", "МАГАДАНСКАЯ"),
+    ("50", "МОСКОВСКАЯ ОБЛАСТЬ", "МОСКОВСКАЯ"),
+    ("51", "МУРМАНСКАЯ ОБЛАСТЬ", "МУРМАНСКАЯ"),
+    ("52", "НИЖЕГОРОДСКАЯ ОБЛАСТЬ", "НИЖЕГОРОДСКАЯ"),
+    ("53", "НОВГОРОДСКАЯ ОБЛАСТЬ", "НОВГОРОДСКАЯ"),
+    ("54", "НОВОСИБИРСКАЯ ОБЛАСТЬ", "НОВОСИБИРСКАЯ"),
+    ("55", "ОМСКАЯ ОБЛАСТЬ", "ОМСКАЯ"),
+    ("56", "ОРЕНБУРГСКАЯ ОБЛАСТЬ", "ОРЕНБУРГСКАЯ"),
+    ("57", "ОРЛОВСКАЯ ОБЛАСТЬ", "ОРЛОВСКАЯ"),
+    ("58", "ПЕНЗЕНСКАЯ ОБЛАСТЬ", "ПЕНЗЕНСКАЯ"),
+    ("59", "ПЕРМСКИЙ КРАЙ", "ПЕРМСКИЙ|ПЕРМСКАЯ"),
+    ("60", "ПСКОВСКАЯ ОБЛАСТЬ", "ПСКОВСКАЯ"),
+    ("61", "РОСТОВСКАЯ ОБЛАСТЬ", "РОСТОВСКАЯ"),
+    ("62", "РЯЗАНСКАЯ ОБЛАСТЬ", "РЯЗАНСКАЯ"),
+    ("63", "САМАРСКАЯ ОБЛАСТЬ", "САМАРСКАЯ"),
+    ("64", "САРАТОВСКАЯ ОБЛАСТЬ", "САРАТОВСКАЯ"),
+    ("65", "САХАЛИНСКАЯ ОБЛАСТЬ", "САХАЛИНСКАЯ"),
+    ("66", "СВЕРДЛОВСКАЯ ОБЛАСТЬ", "СВЕРДЛОВСКАЯ"),
+    ("67", "СМОЛЕНСКАЯ ОБЛАСТЬ", "СМОЛЕНСКАЯ"),
+    ("68", "ТАМБОВСКАЯ ОБЛАСТЬ", "ТАМБОВСКАЯ"),
+    ("69", "ТВЕРСКАЯ ОБЛАСТЬ", "ТВЕРСКАЯ"),
+    ("70", "ТОМСКАЯ ОБЛАСТЬ", "ТОМСКАЯ"),
+    ("71", "ТУЛЬСКАЯ ОБЛАСТЬ", "ТУЛЬСКАЯ"),
+    ("72", "ТЮМЕНСКАЯ ОБЛАСТЬ", "ТЮМЕНСКАЯ"),
+    ("73", "УЛЬЯНОВСКАЯ ОБЛАСТЬ", "УЛЬЯНОВСКАЯ"),
+    ("74", "ЧЕЛЯБИНСКАЯ ОБЛАСТЬ", "ЧЕЛЯБИНСКАЯ"),
+    ("75", "ЗАБАЙКАЛЬСКИЙ КРАЙ", "ЗАБАЙКАЛЬСКИЙ"),
+    ("76", "ЯРОСЛАВСКАЯ ОБЛАСТЬ", "ЯРОСЛАВСКАЯ"),
+    ("77", "Г. МОСКВА", "МОСКВА"),
+    ("78", "Г. САНКТ-ПЕТЕРБУРГ", "САНКТ-ПЕТЕРБУРГ|САНКТ ПЕТЕРБУРГ|С-ПЕТЕРБУРГ|СПБ"),
+    ("79", "ЕВРЕЙСКАЯ АВТОНОМНАЯ ОБЛАСТЬ", "ЕВРЕЙСКАЯ"),
+    ("80", "ДОНЕЦКАЯ НАРОДНАЯ РЕСПУБЛИКА", "ДОНЕЦКАЯ НАРОДНАЯ|ДНР"),
+    ("81", "ЛУГАНСКАЯ НАРОДНАЯ РЕСПУБЛИКА", "ЛУГАНСКАЯ НАРОДНАЯ|ЛНР"),
+    ("83", "НЕНЕЦКИЙ АВТОНОМНЫЙ ОКРУГ", "НЕНЕЦКИЙ"),
+    ("84", "ХЕРСОНСКАЯ ОБЛАСТЬ", "ХЕРСОНСКАЯ"),
+    ("85", "ЗАПОРОЖСКАЯ ОБЛАСТЬ", "ЗАПОРОЖСКАЯ"),
+    ("86", "ХАНТЫ-МАНСИЙСКИЙ АВТОНОМНЫЙ ОКРУГ - ЮГРА", (
+        "ХАНТЫ-МАНСИЙСКИЙ(?: АВТОНОМНЫЙ ОКРУГ-ЮГРА)?|ХМАО(?:-ЮГРА)?|ЮГРА"
+    )),
+    ("87", "ЧУКОТСКИЙ АВТОНОМНЫЙ ОКРУГ", "ЧУКОТСКИЙ"),
+    ("89", "ЯМАЛО-НЕНЕЦКИЙ АВТОНОМНЫЙ ОКРУГ", "ЯМАЛО-НЕНЕЦКИЙ|ЯНАО"),
+    ("91", "РЕСПУБЛИКА КРЫМ", "КРЫМ"),
+    ("92", "Г. СЕВАСТОПОЛЬ", "СЕВАСТОПОЛЬ"),
+)
+
+
+class RegionResolver:
+    """
+    Субъектом считается первая часть адреса, совпавшая с названием, поэтому
+    "МОСКОВСКАЯ ОБЛАСТЬ, Г. ОДИНЦОВО, УЛ. МОСКОВСКАЯ" даёт область, а улицы
+    и районы с похожими названиями не мешают. Результаты кэшируются и на
+    адрес (у многих компаний он общий), и на отдельную часть адреса
+    (регион повторяется в адресах с разными улицами)
+    """
+    parentheses = re.compile(r"\([^)]*\)")
+    separators = re.compile(r"[.\s]+")
+    dashes = re.compile(r"\s*[-–—]\s*")
+    matcher = re.compile(
+        f"(?:(?:{SUBJECT_TYPES}) )?(?:"
+        + "|".join(f"(?P<r{code}>{variants})" for code, _, variants in SUBJECTS)
+        + f")(?: (?:{SUBJECT_TYPES}))?"
+    )
+    names = {f"r{code}": name for code, name, _ in SUBJECTS}
+
+    def __init__(self, unknown: str, cache_size: int = REGION_CACHE_SIZE) -> None:
+        self.unknown = unknown  # Возвращается, если субъект в адресе не найден
+        self.resolve = lru_cache(maxsize=cache_size)(self.match)
+        self.resolve_part = lru_cache(maxsize=cache_size)(self.match_part)
+
+    def match(self, address: str) -> str:
+        for part in str(address).split(","):
+            region = self.resolve_part(part)
+            if region:
+                return region
+        return self.unknown
+
+    def match_part(self, part: str) -> str | None:
+        match = self.matcher.fullmatch(self.prepare(part))
+        if match:
+            return self.names[match.lastgroup]
+        return None
+
+    def prepare(self, part: str) -> str:
+        part = self.parentheses.sub(" ", part.upper().replace("Ё", "Е"))
+        part = self.dashes.sub("-", part)
+        return self.separators.sub(" ", part).strip()
@@ -0,0 +1,144 @@
+"""
+Дисковый кэш ответов list-org с перепроверкой по ETag и Last-Modified
+"""
+import hashlib, shutil, sqlite3, threading, time
+from collections import Counter
+from collections.abc import Mapping
+from dataclasses import dataclass
+from functools import cached_property
+from pathlib import Path
+
+from src.config import RESPONSE_CACHE_DIR, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL
+from src.metrics import metrics
+from src.utils import Base
+
+
+@dataclass(slots=True)
+class CachedResponse:
+    path: Path
+    content_type: str
+    etag: str | None
+    last_modified: str | None
+    fetched_at: float
+
+    @property
+    def body(self) -> bytes:
+        return self.path.read_bytes()
+
+    @property
+    def validators(self) -> dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache(Base):
+    """
+    Ответы list-org на диске с ключом по URL: страницы поиска и xlsx. Ответ
+    моложе ttl отдаётся без запроса, более старый перепроверяется через
+    If-None-Match/If-Modified-Since, если сервер прислал ETag или
+    Last-Modified. Тела лежат файлами, индекс в SQLite; при превышении
+    max_bytes удаляются давно не использованные ответы
+    """
+    def __init__(
+            self,
+            dir: Path = RESPONSE_CACHE_DIR,
+            ttl: float = RESPONSE_CACHE_TTL,
+            max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+    ) -> None:
+        self.dir = dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()  # Соединение общее для потоков загрузки, обращения только под lock
+        self.stats: Counter[str] = Counter()
+
+    @cached_property
+    def connection(self) -> sqlite3.Connection:
+        """База создаётся при первом обращении, а не при запуске любого этапа"""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.dir.joinpath("index.sqlite3"), check_same_thread=False)
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "url TEXT PRIMARY KEY, file TEXT NOT NULL, size INTEGER NOT NULL, "
+                "content_type TEXT NOT NULL, etag TEXT, last_modified TEXT, "
+                "fetched_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)")
+        return connection
+
+    def get(self, url: str) -> CachedResponse | None:
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT file, content_type, etag, last_modified, fetched_at "
+                "FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+            if row:
+                self.connection.execute(
+                    "UPDATE responses SET used_at = ? WHERE url = ?", (time.time(), url)
+                )
+        if not row or not self.dir.joinpath(row[0]).exists():
+            return None
+        return CachedResponse(self.dir.joinpath(row[0]), *row[1:])
+
+    def is_fresh(self, cached: CachedResponse) -> bool:
+        return time.time() - cached.fetched_at < self.ttl
+
+    def put(self, url: str, body: bytes | Path, headers: Mapping[str, str]) -> None:
+        file = self.dir.joinpath(hashlib.sha1(url.encode()).hexdigest())
+        temp_file = file.with_suffix(".tmp")
+        self.dir.mkdir(parents=True, exist_ok=True)
+        if isinstance(body, Path):
+            shutil.copyfile(body, temp_file)
+        else:
+            temp_file.write_bytes(body)
+        temp_file.replace(file)
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    url, file.name, file.stat().st_size,
+                    headers.get("Content-Type", "application/octet-stream"),
+                    headers.get("ETag"), headers.get("Last-Modified"), now, now,
+                )
+            )
+            self.evict()
+
+    def refresh(self, url: str) -> None:
+        """Сервер ответил 304: ответ снова свежий на ttl"""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE responses SET fetched_at = ? WHERE url = ?", (time.time(), url)
+            )
+        self.count("revalidated")
+
+    def evict(self) -> None:
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.connection.execute(
+            "SELECT url, file, size FROM responses ORDER BY used_at"
+        ).fetchall()
+        for url, file, size in rows:
+            if total <= self.max_bytes:
+                break
+            self.connection.execute("DELETE FROM responses WHERE url = ?", (url,))
+            self.dir.joinpath(file).unlink(missing_ok=True)
+            total -= size
+            self.stats["evicted"] += 1
+
+    def count(self, event: str) -> None:
+        with self.lock:
+            self.stats[event] += 1
+        metrics.add("response_cache", **{event: 1})
+
+    def log_stats(self) -> None:
+        if self.stats:
+            self.log(
+                f"Response cache: {self.stats['hits']} hits, {self.stats['revalidated']} revalidated, "
+                f"{self.stats['misses']} misses, {self.stats['evicted']} evicted"
+            )
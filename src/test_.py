@@ -1,19 +1,52 @@
-import os
+import json, logging, logging.config, logging.handlers, os, shutil, subprocess, sys, threading, time
+from array import array
+from dataclasses import replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
 from pathlib import Path
+from types import SimpleNamespace
 
+import pandas
 import pytest
+from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
 
 from src import config
 from src.app import (
+    Scriptorium,
     Scraper,
+    FastScraper,
+    HTTPScraper,
+    SearchPages,
+    SearchPageParser,
     LinkConstructor,
     Cache,
+    SQLiteCache,
+    CookieStore,
+    BatchSizer,
+    JobQueue,
     CompanyDataDownloader,
     ReaderExcel,
+    IncrementalIngest,
+    StreamingIngest,
+    Manifest,
     Normalizer,
+    VectorizedNormalizer,
+    Validator,
+    CompanyBatch,
+    CompanyData,
+    CompanyStore,
+    ExportState,
     Exporter
 )
-from src.utils import ReaderJSON, LoggingConfig
+from src.app import NormalizedData
+from src.bench import Benchmark, SyntheticData
+from src.dump import DumpIngest
+from src.governor import RequestBudgetExceeded, RequestGovernor
+from src.metrics import Metrics
+from src.regions import RegionResolver
+from src.response_cache import ResponseCache
+from src.transport import Recording
+from src.utils import Base, ReaderJSON, LoggingConfig
 
 
 @pytest.fixture
@@ -98,6 +131,112 @@ def downloaded_files(user_cookie: str, real_download_links: list[str]) -> None:
     CompanyDataDownloader(user_cookie, real_download_links).exec()
 
 
+class MockXlsxHandler(BaseHTTPRequestHandler):
+    payload = b"PK\x03\x04" + bytes(range(256)) * 200
+    range_headers: list[str | None] = []
+    cookies: list[str | None] = []
+    failures_left = 0
+    html_pages_left = 0
+    etag = '"v1"'
+
+    def do_GET(self) -> None:
+        type(self).range_headers.append(self.headers.get("Range"))
+        type(self).cookies.append(self.headers.get("Cookie"))
+        if type(self).failures_left:
+            type(self).failures_left -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+        if type(self).html_pages_left:
+            type(self).html_pages_left -= 1
+            body = "<html>captcha</html>".encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        if range_header := self.headers.get("Range"):
+            start = int(range_header.removeprefix("bytes=").rstrip("-"))
+        body = self.payload[start:]
+        self.send_response(206 if start else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", self.etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def xlsx_server() -> str:
+    MockXlsxHandler.range_headers = []
+    MockXlsxHandler.cookies = []
+    MockXlsxHandler.failures_left = 0
+    MockXlsxHandler.html_pages_left = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockXlsxHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/excel_list.php?ids="
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def search_page_html() -> str:
+    return """
+    <html><body>
+    <a class="btn btn-outline-secondary m-1" href="/excel_list.php?ids=101,102">Скачать</a>
+    <div class="org_list">
+    <p><label><input type="checkbox" name="ids" value="101"></label>
+        <a href="/company/101">ООО "АЛЬФА"</a><br>
+        <span><i>инн/кпп</i>: 7801234567/780101001</span>,
+        <span><i>юр.адрес</i>: 190000, Г.САНКТ-ПЕТЕРБУРГ, УЛ ЛЕНИНА, Д. 1</span>,
+        <span><i>сотрудников</i>: 1 200</span></p>
+    <p><a href="/company/102">ПАО "БЕТА"</a><br>
+        <span><i>инн/кпп</i>: 7707083893/773601001</span>,
+        <span><i>юр.адрес</i>: 117997, г Москва, УЛ ВАВИЛОВА, Д. 19</span></p>
+    </div>
+    </body></html>
+    """
+
+
+@pytest.fixture
+def backup_company_data() -> pandas.DataFrame:
+    backup_file = config.BASE_DIR.joinpath("backup", "data_0.xlsx")
+    return pandas.read_excel(backup_file, usecols=ReaderExcel.source_columns)
+
+
+@pytest.fixture
+def irregular_company_data() -> pandas.DataFrame:
+    return pandas.DataFrame({
+        "ИНН": [7801234567, None, 7707083893],
+        "Юридическое наименование": ["ООО \"А\"", None, "ПАО \"В\""],
+        "Сотрудников": [120.0, 300.0, 5000.0],
+        "Сайт": [None, "b.ru", "http://c.ru"],
+        "Юридический адрес": [
+            "190000, Г.САНКТ-ПЕТЕРБУРГ, УЛ ЛЕНИНА, Д. 1",
+            "420000, РЕСП ТАТАРСТАН, Г. КАЗАНЬ, УЛ БАУМАНА, Д. 2",
+            "117997, г Москва, УЛ ВАВИЛОВА, Д. 19",
+        ],
+        "Телефон (один из)": ["+7 (812) 000-00-00", None, "+7 (495) 500-55-50"],
+    })
+
+
+@pytest.fixture
+def backup_download_dir(tmp_path: Path) -> Path:
+    backup_file = config.BASE_DIR.joinpath("backup", "data_0.xlsx")
+    for number in range(3):
+        shutil.copy(backup_file, tmp_path.joinpath(f"data_{number}.xlsx"))
+    return tmp_path
+
+
 @pytest.fixture
 def company_data_files() -> list[Path]:
     downloaded_files = [
@@ -119,6 +258,126 @@ class TestScraper:
         assert scraper_result.user_cookie
 
 
+class StubRoute:
+    def __init__(self, resource_type: str, url: str) -> None:
+        self.request = SimpleNamespace(method="GET", resource_type=resource_type, url=url, headers={})
+        self.action: str | None = None
+
+    def abort(self) -> None:
+        self.action = "abort"
+
+    def continue_(self) -> None:
+        self.action = "continue"
+
+    def fulfill(self, **kwargs) -> None:
+        self.action = "fulfill"
+
+
+class TestFastScraper:
+    @pytest.fixture(autouse=True)
+    def setUp(self, cache: Path, tmp_path: Path) -> None:
+        self.scraper = FastScraper(Cache(cache), job_queue=JobQueue(tmp_path.joinpath("jobs.json")))
+
+    def test_create_picks_scraper_by_mode(self, cache: Path) -> None:
+        assert type(Scraper.create(Cache(cache), mode="fast")) is FastScraper
+        assert type(Scraper.create(Cache(cache), mode="browser")) is Scraper
+        assert type(Scraper.create(Cache(cache), mode="http")) is HTTPScraper
+
+    @pytest.mark.parametrize("resource_type, url, action", [
+        ("document", "https://www.list-org.com/search?page=1", "continue"),
+        ("script", "https://www.list-org.com/js/app.js", "continue"),
+        ("image", "https://www.list-org.com/logo.png", "abort"),
+        ("stylesheet", "https://www.list-org.com/style.css", "abort"),
+        ("font", "https://www.list-org.com/font.woff2", "abort"),
+        ("script", "https://mc.yandex.ru/metrika/tag.js", "abort"),
+    ])
+    def test_block_resources(self, resource_type: str, url: str, action: str) -> None:
+        route = StubRoute(resource_type, url)
+        self.scraper.block_resources(route)
+        assert route.action == action
+
+    def test_pending_query_links_skip_visited_pages(self) -> None:
+        visited = self.scraper.link_constructor.query_link(1)
+        self.scraper.cache.save_url(visited)
+
+        pending = self.scraper.pending_query_links()
+
+        assert visited not in pending
+        assert len(pending) == config.ITERATIONS - 1
+
+    def test_navigation_timeout_fails_only_its_page(self, cache: Path, tmp_path: Path) -> None:
+        job_queue = JobQueue(tmp_path.joinpath("jobs.json"))
+        scraper = Scraper(Cache(cache), job_queue=job_queue)
+        first, *rest = scraper.pending_query_links()
+
+        def goto(url: str, **kwargs) -> None:
+            raise PlaywrightTimeoutError("Timeout exceeded")
+
+        scraper.inspect_page(SimpleNamespace(goto=goto), first)
+
+        assert job_queue.jobs[first]["error"] == "navigation timeout"
+        assert job_queue.pending_query_links() == [first, *rest]
+
+
+class TestSearchPages:
+    @pytest.fixture(autouse=True)
+    def setUp(self, tmp_path: Path, search_page_html: str) -> None:
+        self.dir = tmp_path.joinpath("pages")
+        self.html = search_page_html
+
+    def test_parser_extracts_company_rows(self) -> None:
+        parser = SearchPageParser(self.html)
+        blank = Normalizer.blank
+
+        assert parser.download_href() == "/excel_list.php?ids=101,102"
+        assert list(parser.exec()) == [
+            CompanyData("7801234567", "ООО \"АЛЬФА\"", 1200, "Г. САНКТ-ПЕТЕРБУРГ", blank, blank),
+            CompanyData("7707083893", "ПАО \"БЕТА\"", 0, "Г. МОСКВА", blank, blank),
+        ]
+
+    def test_http_scraper_saves_pages_without_browser(
+            self, cache: Path, tmp_path: Path, xlsx_server: str, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        monkeypatch.setattr(MockXlsxHandler, "payload", self.html.encode())
+        cookie_store = CookieStore(tmp_path.joinpath("cookies.json"))
+        cookie_store.save("cookie", time.time() + 60)
+        job_queue = JobQueue(tmp_path.joinpath("jobs.json"))
+        scraper = HTTPScraper(Cache(cache), cookie_store, job_queue)
+        scraper.link_constructor.base_url = xlsx_server.removesuffix("/excel_list.php?ids=")
+        scraper.search_pages = SearchPages(self.dir)
+
+        scraper.exec()
+
+        assert scraper.user_cookie == "cookie"
+        assert job_queue.pending_query_links() == []
+        assert set(MockXlsxHandler.cookies) == {"user=cookie"}
+        batches = list(SearchPages(self.dir).exec())
+        assert len(batches) == config.ITERATIONS
+        assert batches[0] == SearchPageParser(self.html).exec()
+
+    def test_pages_do_not_repeat_companies_from_xlsx(
+            self, backup_company_data: pandas.DataFrame, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        xlsx_batch = Normalizer(backup_company_data).exec()
+        page_batch = SearchPageParser(self.html).exec()
+        xlsx_batch.inn[0] = int(page_batch.inn[0])
+        monkeypatch.setattr(IncrementalIngest, "exec", lambda self: iter([xlsx_batch]))
+        monkeypatch.setattr(SearchPages, "exec", lambda self: iter([page_batch]))
+
+        batches = list(Scriptorium().ingest())
+
+        assert batches[0] is xlsx_batch
+        assert batches[1].inn == page_batch.inn[1:]
+
+    def test_pages_keep_okved_of_their_query(self) -> None:
+        search_pages = SearchPages(self.dir)
+        search_pages.save("https://www.list-org.com/search?okved=63", self.html, 63)
+
+        batch = next(search_pages.exec())
+        assert set(batch.okved_main) == {63}
+        assert {record.okved_main for record in batch} == {63}
+
+
 class TestLinkConstructor:
     @pytest.fixture(autouse=True)
     def setUp(self, constructor: LinkConstructor, download_links: list[str]) -> None:
@@ -133,8 +392,8 @@ class TestLinkConstructor:
     @pytest.mark.usefixtures("cache_with_multiple_ids")
     def test_get_download_links(self, cache_reader: ReaderJSON) -> None:
         self.constructor.cache = cache_reader
-        download_links = self.constructor.get_download_links()
-        assert len(download_links) == 1
+        download_links = self.constructor.get_download_links(batch_size=100)
+        assert len(download_links) == config.ITERATIONS
 
     @pytest.mark.usefixtures("cache_with_ids")
     def test_construct_download_link(
@@ -150,6 +409,237 @@ class TestLinkConstructor:
         assert link == expected_result
 
 
+class TestStartup:
+    heavy_modules = ("pandas", "playwright", "requests", "openpyxl")
+
+    def test_cli_import_does_not_load_heavy_dependencies(self) -> None:
+        code = (
+            "import sys, main; "
+            f"print(','.join(m for m in {self.heavy_modules} if m in sys.modules))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=config.BASE_DIR.parent, capture_output=True, text=True, check=True
+        )
+        assert result.stdout.strip() == ""
+
+    def test_offline_command_starts_faster_than_pandas_import(self) -> None:
+        help_time = self.cold_start(["main.py", "query", "--help"])
+        pandas_time = self.cold_start(["-c", "import pandas"])
+        assert help_time < pandas_time / 2, f"{help_time:.2f}s vs {pandas_time:.2f}s for pandas"
+
+    def cold_start(self, args: list[str], runs: int = 3) -> float:
+        """Лучшее из нескольких запусков, чтобы шум машины не ронял тест"""
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            subprocess.run(
+                [sys.executable, *args], cwd=config.BASE_DIR.parent, capture_output=True, check=True
+            )
+            timings.append(time.perf_counter() - started)
+        return min(timings)
+
+    def test_every_stage_has_a_method(self) -> None:
+        for method in Scriptorium.stages.values():
+            assert callable(getattr(Scriptorium, method))
+
+
+class TestLoggingConfig:
+    def test_config_is_applied_once(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        LoggingConfig.get_logger()
+        calls = []
+        monkeypatch.setattr(logging.config, "dictConfig", calls.append)
+
+        for _ in range(3):
+            Base().log("Logging is configured once")
+        assert calls == []
+
+    def test_logger_writes_through_running_queue_listener(self) -> None:
+        logger = LoggingConfig.get_logger()
+        queue_handler, = logger.handlers
+        assert isinstance(queue_handler, logging.handlers.QueueHandler)
+        assert queue_handler.listener._thread is not None
+
+
+class TestMetrics:
+    @pytest.fixture(autouse=True)
+    def setUp(self, tmp_path: Path) -> None:
+        self.metrics = Metrics(tmp_path, profile_stage="inner")
+
+    def test_nested_spans_are_timed_exclusively(self) -> None:
+        with self.metrics.span("outer"):
+            time.sleep(0.05)
+            with self.metrics.span("inner"):
+                time.sleep(0.1)
+
+        stages = self.metrics.stages
+        assert stages["inner"]["seconds"] == pytest.approx(0.1, abs=0.04)
+        assert stages["outer"]["seconds"] == pytest.approx(0.05, abs=0.04)
+
+    def test_memory_is_attributed_to_the_allocating_stage(self) -> None:
+        with self.metrics.span("heavy"):
+            data = b"x" * 64 * 2 ** 20
+        with self.metrics.span("light"):
+            pass
+        del data
+
+        stages = self.metrics.stages
+        assert stages["heavy"]["rss_delta_bytes"] >= 32 * 2 ** 20
+        assert stages["light"]["rss_delta_bytes"] < 8 * 2 ** 20
+
+    def test_iterate_counts_rows_and_time_of_producer(self) -> None:
+        def producer():
+            for _ in range(3):
+                time.sleep(0.02)
+                yield [1, 2]
+
+        consumed = list(self.metrics.iterate("read", producer()))
+
+        assert consumed == [[1, 2]] * 3
+        assert self.metrics.stages["read"]["rows"] == 6
+        assert self.metrics.stages["read"]["seconds"] >= 0.06
+
+    def test_dump_writes_request_histograms_and_profile(self, tmp_path: Path) -> None:
+        self.metrics.record_request("download", 0.2, 200)
+        self.metrics.record_request("download", 3, 503)
+        with self.metrics.span("inner"):
+            sum(range(1000))
+
+        report = json.loads(self.metrics.dump().read_text(encoding="utf-8"))
+
+        assert report["requests"]["download"]["count"] == 2
+        assert report["requests"]["download"]["latency"] == {"<=0.25s": 1, "<=5s": 1}
+        assert report["requests"]["download"]["status"] == {"200": 1, "503": 1}
+        assert Path(report["profile"]).exists()
+
+
+class TestAdaptiveBatching:
+    @pytest.fixture(autouse=True)
+    def setUp(self, cache: Path, tmp_path: Path) -> None:
+        self.batch_state = tmp_path.joinpath("batch_state.json")
+        self.sizer = BatchSizer(self.batch_state, start=4, min_size=1, max_size=8, step=2)
+        self.constructor = LinkConstructor(Cache(cache), self.sizer)
+
+    def test_download_links_cover_every_id(self, mock_company_ids: list[str]) -> None:
+        self.constructor.cache.extend_company_ids(mock_company_ids[:10])
+
+        download_links = self.constructor.get_download_links()
+
+        assert len(download_links) == 3
+        ids = [self.constructor.get_company_ids(link) for link in download_links]
+        assert ",".join(ids) == ",".join(mock_company_ids[:10])
+
+    def test_batch_size_is_persisted_within_bounds(self) -> None:
+        assert self.sizer.grow() and self.sizer.grow()
+        assert not self.sizer.grow()
+        assert BatchSizer(self.batch_state).size == 8
+
+        while self.sizer.shrink():
+            pass
+        assert BatchSizer(self.batch_state).size == 1
+
+    def test_rejected_links_are_split_and_downloaded(
+            self, xlsx_server: str, tmp_path: Path, mock_company_ids: list[str]
+    ) -> None:
+        self.constructor.base_url = xlsx_server.removesuffix("/excel_list.php?ids=")
+        self.constructor.cache.extend_company_ids(mock_company_ids[:4])
+        job_queue = JobQueue(tmp_path.joinpath("jobs.json"), queries=[])
+        job_queue.sync(self.constructor, self.constructor.cache)
+        scriptorium = Scriptorium()
+        scriptorium.batch_sizer = self.sizer
+        scriptorium.link_constructor = self.constructor
+        scriptorium.job_queue = job_queue
+        downloader = CompanyDataDownloader(
+            "cookie", job_queue.assign_files(self.constructor), job_queue=job_queue
+        )
+        downloader.dir = tmp_path
+        MockXlsxHandler.html_pages_left = 1
+
+        downloader.exec()
+        scriptorium.retry_with_smaller_batches(downloader)
+
+        assert downloader.rejected == {}
+        assert BatchSizer(self.batch_state).size == 2
+        assert sorted(file.name for file in tmp_path.glob("data_*.xlsx")) == [
+            "data_1.xlsx", "data_2.xlsx"
+        ]
+        assert JobQueue(job_queue.file_path).jobs["cache"]["state"] == "downloaded"
+
+
+class TestJobQueue:
+    @pytest.fixture(autouse=True)
+    def setUp(self, cache: Path, tmp_path: Path) -> None:
+        self.jobs_file = tmp_path.joinpath("jobs.json")
+        self.cache = Cache(cache)
+        self.constructor = LinkConstructor(
+            self.cache, BatchSizer(tmp_path.joinpath("batch_state.json"), start=2)
+        )
+        self.queries = [
+            {"okved": 62, "staff_min": 100, "staff_max": None, "pages": range(1, 3)},
+            {"okved": 63, "staff_min": 50, "staff_max": 99, "pages": [1]},
+        ]
+        self.job_queue = JobQueue(self.jobs_file, self.queries)
+
+    def test_sync_creates_a_job_per_query_page_once(self) -> None:
+        visited = self.constructor.query_link(1)
+        self.cache.save_url(visited)
+
+        self.job_queue.sync(self.constructor, self.cache)
+        self.job_queue.sync(self.constructor, self.cache)
+
+        pending = self.job_queue.pending_query_links()
+        assert len(self.job_queue.jobs) == 3
+        assert visited not in pending
+        assert self.constructor.query_link(1, okved=63, staff_min=50, staff_max=99) in pending
+        assert "staff_max=99&okved=63" in pending[-1]
+
+    def test_resume_skips_finished_work(self, mock_company_ids: list[str]) -> None:
+        self.job_queue.sync(self.constructor, self.cache)
+        first, *_ = self.job_queue.pending_query_links()
+        self.job_queue.mark_scraped(first, mock_company_ids[:4])
+        download_links = self.job_queue.assign_files(self.constructor)
+        self.job_queue.record_downloads([0], [1])
+
+        resumed = JobQueue(self.jobs_file, self.queries)
+        resumed.sync(self.constructor, self.cache)
+
+        assert first not in resumed.pending_query_links()
+        assert resumed.assign_files(self.constructor) == {1: download_links[1]}
+        resumed.record_downloads([1], [])
+        assert resumed.jobs[first]["state"] == "downloaded"
+        assert resumed.assign_files(self.constructor) == {}
+
+    def test_split_files_keep_ids_in_the_same_job(self, mock_company_ids: list[str]) -> None:
+        self.job_queue.sync(self.constructor, self.cache)
+        first, *_ = self.job_queue.pending_query_links()
+        self.job_queue.mark_scraped(first, mock_company_ids[:2])
+        download_links = self.job_queue.assign_files(self.constructor)
+        self.constructor.batch_sizer.size = 1
+
+        split = self.job_queue.split_files(download_links, self.constructor)
+        self.job_queue.record_downloads(split, [])
+
+        assert list(split) == [1, 2]
+        assert self.job_queue.jobs[first]["files"]["0"]["state"] == "split"
+        assert self.job_queue.jobs[first]["state"] == "downloaded"
+
+    def test_assign_files_pools_ids_of_all_new_jobs(self) -> None:
+        queries = [{"okved": 62, "staff_min": 100, "staff_max": None, "pages": range(1, 5)}]
+        job_queue = JobQueue(self.jobs_file, queries)
+        job_queue.sync(self.constructor, self.cache)
+        for page, query_link in enumerate(job_queue.pending_query_links()):
+            job_queue.mark_scraped(query_link, [str(page * 50 + i) for i in range(50)])
+        self.constructor.batch_sizer.size = 100
+
+        download_links = job_queue.assign_files(self.constructor)
+        job_queue.record_downloads([0], [])
+
+        assert len(download_links) == 2
+        assert [job["state"] for job in job_queue.jobs.values()] == [
+            "downloaded", "downloaded", "scraped", "scraped"
+        ]
+
+
 class TestCache:
     @pytest.fixture(autouse=True)
     def setUp(self, cache) -> None:
@@ -172,6 +662,289 @@ class TestCache:
         for elem in content["company_ids"]:
             assert elem in mock_company_ids
 
+    def test_save_company_ids_keeps_order_and_skips_duplicates(
+            self, mock_company_ids: list[str]
+    ) -> None:
+        self.cache.extend_company_ids(mock_company_ids)
+        self.cache.extend_company_ids(reversed(mock_company_ids))
+        assert self.cache.load()["company_ids"] == mock_company_ids
+        assert self.cache.first_company_id == mock_company_ids[0]
+
+    def test_company_ids_are_flushed_in_batches(
+            self, cache_reader: ReaderJSON, mock_company_ids: list[str]
+    ) -> None:
+        cache = Cache(self.cache_file, flush_every=len(mock_company_ids))
+        for id in mock_company_ids[:-1]:
+            cache.save_company_ids(id)
+        assert cache_reader.load()["company_ids"] == []
+
+        cache.save_company_ids(mock_company_ids[-1])
+        assert cache_reader.load()["company_ids"] == mock_company_ids
+
+    def test_link_constructor_leaves_flushing_to_the_cache(
+            self, cache_reader: ReaderJSON, mock_company_ids: list[str]
+    ) -> None:
+        cache = Cache(self.cache_file, flush_every=len(mock_company_ids) + 1)
+        constructor = LinkConstructor(cache)
+        constructor.save_company_ids(constructor.construct_download_link(mock_company_ids))
+        assert cache_reader.load()["company_ids"] == []
+
+        cache.flush()
+        assert cache_reader.load()["company_ids"] == mock_company_ids
+
+    def test_save_url_raises_on_visited_url(self, cache_reader: ReaderJSON) -> None:
+        mock_url = "https://mockurl?mock_param=fake"
+        self.cache.save_url(mock_url)
+        with pytest.raises(ValueError):
+            self.cache.save_url(mock_url)
+        assert cache_reader.load()["referers"] == [mock_url]
+
+
+class TestResponseCache:
+    @pytest.fixture(autouse=True)
+    def setUp(self, tmp_path: Path, xlsx_server: str) -> None:
+        self.dir = tmp_path
+        self.response_cache = ResponseCache(tmp_path.joinpath("responses"), ttl=60, max_bytes=100)
+        self.link = f"{xlsx_server}0"
+
+    def download(self) -> CompanyDataDownloader:
+        downloader = CompanyDataDownloader(
+            "cookie", [self.link], backoff=0, response_cache=self.response_cache
+        )
+        downloader.dir = self.dir
+        downloader.exec()
+        return downloader
+
+    def test_least_recently_used_responses_are_evicted(self) -> None:
+        for url in ("a", "b"):
+            self.response_cache.put(url, b"x" * 40, {})
+        self.response_cache.get("a")
+        self.response_cache.put("c", b"x" * 40, {})
+
+        assert self.response_cache.get("b") is None
+        assert self.response_cache.get("a").body == b"x" * 40
+        assert self.response_cache.stats["evicted"] == 1
+
+    def test_downloader_serves_fresh_and_revalidates_stale_responses(self) -> None:
+        self.response_cache.max_bytes = len(MockXlsxHandler.payload)
+        self.download()
+        self.dir.joinpath("data_0.xlsx").unlink()
+        self.download()
+        self.response_cache.ttl = 0
+        self.download()
+
+        assert len(MockXlsxHandler.range_headers) == 2
+        assert self.dir.joinpath("data_0.xlsx").read_bytes() == MockXlsxHandler.payload
+        assert self.response_cache.stats == {"misses": 1, "hits": 1, "revalidated": 1}
+
+
+class TestRequestGovernor:
+    @pytest.fixture(autouse=True)
+    def setUp(self, tmp_path: Path) -> None:
+        self.state_file = tmp_path.joinpath("governor.json")
+        self.governor = self.create()
+
+    def create(self, **kwargs) -> RequestGovernor:
+        settings = {"budget": 3, "rate": 1000, "burst": 3, "cooldown": 60, "captcha_limit": 2}
+        return RequestGovernor(self.state_file, **settings | kwargs)
+
+    def test_daily_budget_survives_restarts(self) -> None:
+        self.governor.acquire()
+        self.governor.acquire()
+        governor = self.create()
+        governor.acquire()
+
+        with pytest.raises(RequestBudgetExceeded):
+            governor.acquire()
+        governor.state["day"] = "2000-01-01"
+        governor.acquire()
+
+    def test_blocks_and_repeated_captchas_start_a_growing_cooldown(self) -> None:
+        self.governor.observe_page(True)
+        self.governor.acquire()
+        self.governor.observe_page(True)
+
+        with pytest.raises(RequestBudgetExceeded, match="cooling down"):
+            self.create().acquire()
+
+        self.governor.observe_status(429, retry_after="600")
+        assert self.governor.state["blocks"] == 2
+        assert self.governor.state["cooldown_until"] - time.time() > 600 - 1
+
+    def test_token_bucket_paces_requests(self) -> None:
+        governor = self.create(budget=10, rate=50, burst=1)
+        started = time.perf_counter()
+        for _ in range(4):
+            governor.acquire()
+        assert time.perf_counter() - started >= 3 / 50 * 0.9
+
+    def test_downloader_stops_after_captchas(self, xlsx_server: str, tmp_path: Path) -> None:
+        MockXlsxHandler.html_pages_left = 2
+        downloader = CompanyDataDownloader(
+            "cookie", [f"{xlsx_server}{number}" for number in range(3)],
+            workers=1, backoff=0, governor=self.create(budget=10)
+        )
+        downloader.dir = tmp_path
+
+        with pytest.raises(RequestBudgetExceeded):
+            downloader.exec()
+
+        assert set(downloader.rejected) == {0, 1}
+        assert len(MockXlsxHandler.range_headers) == 2
+
+    def test_cached_search_page_takes_budget_before_navigation(
+            self, cache: Path, tmp_path: Path
+    ) -> None:
+        response_cache = ResponseCache(tmp_path.joinpath("responses"), ttl=60)
+        governor = self.create(budget=1)
+        scraper = FastScraper(
+            Cache(cache), job_queue=JobQueue(tmp_path.joinpath("jobs.json")),
+            response_cache=response_cache, governor=governor
+        )
+        url = scraper.link_constructor.query_link(1)
+        response_cache.put(url, b"<html></html>", {"Content-Type": "text/html"})
+        routes = []
+
+        def goto(url: str, **kwargs) -> SimpleNamespace:
+            routes.append(StubRoute("document", url))
+            scraper.serve_search_page(routes[-1])
+            return SimpleNamespace(status=200, headers={})
+        page = SimpleNamespace(goto=goto)
+
+        scraper.navigate(page, url)
+        assert routes[-1].action == "fulfill"
+        assert governor.state["used"] == 0  # Свежая страница из кэша бюджет не тратит
+
+        governor.state["used"] = 1
+        with pytest.raises(RequestBudgetExceeded):
+            scraper.navigate(page, url)
+        assert len(routes) == 1
+
+        scraper.serve_search_page(StubRoute("document", url))  # Сам route callback не бросает
+
+
+class TestRecording:
+    @pytest.fixture(autouse=True)
+    def setUp(self, tmp_path: Path) -> None:
+        self.dir = tmp_path.joinpath("recording")
+        self.tmp_path = tmp_path
+
+    def test_replayed_downloads_match_recorded_ones(self, xlsx_server: str) -> None:
+        links = [f"{xlsx_server}{number}" for number in range(2)]
+        for mode in ("record", "replay"):
+            downloader = CompanyDataDownloader(
+                "cookie", links, backoff=0, recording=Recording(mode, self.dir)
+            )
+            downloader.dir = self.tmp_path.joinpath(mode)
+            downloader.dir.mkdir()
+            downloader.exec()
+
+        assert len(MockXlsxHandler.range_headers) == len(links)
+        for number in range(len(links)):
+            file = self.tmp_path.joinpath("replay", f"data_{number}.xlsx")
+            assert file.read_bytes() == MockXlsxHandler.payload
+
+    def test_http_scraper_replays_pages_and_cookie_offline(
+            self, cache: Path, search_page_html: str
+    ) -> None:
+        recording = Recording("record", self.dir)
+        job_queue = JobQueue(self.tmp_path.joinpath("jobs.json"))
+        scraper = HTTPScraper(Cache(cache), job_queue=job_queue)
+        for query_link in scraper.pending_query_links():  # Настоящие адреса list-org
+            recording.save(query_link, 200, {"Content-Type": "text/html"}, search_page_html.encode())
+        recording.cookie_store.save("cookie", time.time() - 1)
+
+        replay = Recording("replay", self.dir)
+        scraper = HTTPScraper(Cache(cache), replay.cookie_store, job_queue, recording=replay)
+        scraper.search_pages = SearchPages(self.tmp_path.joinpath("pages"))
+        scraper.exec()
+
+        assert scraper.user_cookie == "cookie"
+        assert job_queue.pending_query_links() == []
+
+    def test_scriptorium_replays_recorded_run_offline(
+            self, cache: Path, search_page_html: str, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        recording = Recording("record", self.dir)
+        scraper = HTTPScraper(Cache(cache), job_queue=JobQueue(self.tmp_path.joinpath("jobs.json")))
+        for query_link in scraper.pending_query_links():
+            recording.save(query_link, 200, {"Content-Type": "text/html"}, search_page_html.encode())
+        download_link = scraper.link_constructor.construct_download_link(["101", "102"])
+        xlsx = config.BASE_DIR.joinpath("backup", "data_0.xlsx").read_bytes()
+        recording.save(download_link, 200, {"Content-Type": "application/vnd.ms-excel"}, xlsx)
+        recording.cookie_store.save("cookie", time.time() - 1)
+        cookie = recording.cookie_store.load()
+        live_files = (config.JOBS_FILE, config.CACHE_FILE, config.BATCH_STATE_FILE, config.STORE_FILE)
+        live_state = {file: file.stat().st_mtime_ns for file in live_files if file.exists()}
+        monkeypatch.setattr("src.app.TRANSPORT", "replay")
+        monkeypatch.setattr("src.app.RECORDING_DIR", self.dir)
+        monkeypatch.setattr("src.app.metrics.metrics_dir", self.tmp_path.joinpath("metrics"))
+
+        Scriptorium().exec()
+
+        state_dir = self.dir.joinpath("state", "replay")
+        jobs = JobQueue(state_dir.joinpath(config.JOBS_FILE.name)).jobs
+        assert [job["state"] for job in jobs.values()] == ["downloaded"] * config.ITERATIONS
+        assert state_dir.joinpath(config.DOWNLOAD_DIR.name, "data_0.xlsx").read_bytes() == xlsx
+        assert len(pandas.read_csv(state_dir.joinpath("companies.csv"))) > 0
+        assert recording.cookie_store.load() == cookie
+        assert {file: file.stat().st_mtime_ns for file in live_files if file.exists()} == live_state
+
+
+class TestCookieStore:
+    @pytest.fixture(autouse=True)
+    def setUp(self, tmp_path: Path) -> None:
+        self.store = CookieStore(tmp_path.joinpath("cookies.json"), session_ttl=60)
+
+    def test_returns_cookie_until_it_expires(self) -> None:
+        assert self.store.get() is None
+        self.store.save("valid", time.time() + 60)
+        assert self.store.get() == "valid"
+        self.store.save("expired", time.time() - 1)
+        assert self.store.get() is None
+
+    def test_session_cookie_lives_for_session_ttl(self) -> None:
+        self.store.save("session")
+        assert self.store.get() == "session"
+        assert self.store.load()["expires"] == pytest.approx(time.time() + 60, abs=5)
+
+    def test_clear_removes_cookie(self) -> None:
+        self.store.save("valid", time.time() + 60)
+        self.store.clear()
+        assert self.store.get() is None
+
+
+class TestSQLiteCache:
+    @pytest.fixture(autouse=True)
+    def setUp(self, tmp_path: Path) -> None:
+        self.cache_file = tmp_path.joinpath("cache.sqlite3")
+        self.cache = SQLiteCache(self.cache_file)
+
+    def test_keeps_cache_semantics(self, mock_company_ids: list[str]) -> None:
+        mock_url = "https://mockurl?mock_param=fake"
+        self.cache.save_url(mock_url)
+        with pytest.raises(ValueError):
+            self.cache.save_url(mock_url)
+
+        self.cache.extend_company_ids(mock_company_ids)
+        self.cache.extend_company_ids(mock_company_ids[:10])
+        self.cache.flush()
+
+        content = SQLiteCache(self.cache_file).load()
+        assert content == {"referers": [mock_url], "company_ids": mock_company_ids}
+
+    def test_imports_json_cache_once(self, tmp_path: Path, mock_company_ids: list[str]) -> None:
+        dir = tmp_path.joinpath("switched")
+        dir.mkdir()
+        content = {"referers": ["https://mockurl?page=1"], "company_ids": mock_company_ids}
+        Cache(dir.joinpath("cache.json")).dump(content)
+
+        cache = SQLiteCache(dir.joinpath("cache.sqlite3"))
+        assert cache.load() == content
+
+        cache.dump({"referers": [], "company_ids": []})
+        assert SQLiteCache(dir.joinpath("cache.sqlite3")).load()["company_ids"] == []
+
 
 class TestCompanyDataDownloader:
     @pytest.fixture(autouse=True)
@@ -188,12 +961,638 @@ class TestCompanyDataDownloader:
             assert file.stat().st_size in range(min_size, max_size)
 
 
+class TestCompanyDataDownloaderEngine:
+    @pytest.fixture(autouse=True)
+    def setUp(self, xlsx_server: str, tmp_path: Path) -> None:
+        self.links = [f"{xlsx_server}{number}" for number in range(3)]
+        self.dir = tmp_path
+
+    def downloader(self, links: list[str]) -> CompanyDataDownloader:
+        downloader = CompanyDataDownloader("cookie", links, backoff=0)
+        downloader.dir = self.dir
+        return downloader
+
+    def test_downloads_every_link(self) -> None:
+        self.downloader(self.links).exec()
+        for number in range(len(self.links)):
+            file = self.dir.joinpath(f"data_{number}.xlsx")
+            assert file.read_bytes() == MockXlsxHandler.payload
+        assert not list(self.dir.glob("*.part"))
+
+    def test_resumes_partial_file_with_range(self) -> None:
+        self.dir.joinpath("data_0.xlsx.part").write_bytes(MockXlsxHandler.payload[:1000])
+        self.downloader(self.links[:1]).exec()
+        assert MockXlsxHandler.range_headers == ["bytes=1000-"]
+        assert self.dir.joinpath("data_0.xlsx").read_bytes() == MockXlsxHandler.payload
+
+    def test_retries_server_errors(self) -> None:
+        MockXlsxHandler.failures_left = 2
+        self.downloader(self.links[:1]).exec()
+        assert len(MockXlsxHandler.range_headers) == 3
+        assert self.dir.joinpath("data_0.xlsx").read_bytes() == MockXlsxHandler.payload
+
+    def test_html_response_is_rejected_and_retried_with_new_cookie(self) -> None:
+        MockXlsxHandler.html_pages_left = 1
+        downloader = self.downloader(self.links[:1])
+
+        downloader.exec()
+        assert downloader.rejected == {0: self.links[0]}
+        assert not self.dir.joinpath("data_0.xlsx").exists()
+
+        downloader.retry_rejected("fresh")
+        assert downloader.rejected == {}
+        assert MockXlsxHandler.cookies == ["user=cookie", "user=fresh"]
+        assert self.dir.joinpath("data_0.xlsx").read_bytes() == MockXlsxHandler.payload
+
+
 class TestReaderExcel:
     def test_exec_merge_multiple_files_correctly(self) -> None:
         company_data = ReaderExcel().exec()
         assert len(company_data) == 100
 
 
+class TestReaderExcelStream:
+    @pytest.fixture(autouse=True)
+    def setUp(self, backup_download_dir: Path) -> None:
+        self.download_dir = backup_download_dir
+
+    def reader(self, workers: int) -> ReaderExcel:
+        reader = ReaderExcel(chunk_size=40, workers=workers)
+        reader.dir = self.download_dir
+        return reader
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_stream_yields_bounded_chunks_with_same_data(self, workers: int) -> None:
+        reader = self.reader(workers)
+        chunks = list(reader.stream())
+
+        assert all(len(chunk) <= reader.chunk_size for chunk in chunks)
+        streamed = CompanyBatch.concat(Normalizer.stream(chunks))
+        assert streamed == Normalizer(reader.exec()).exec()
+
+    def test_exporter_consumes_stream(self, tmp_path: Path) -> None:
+        reader = self.reader(1)
+        exporter = Exporter(Normalizer(reader.exec()).exec(), export_dir=tmp_path)
+        exporter.exec()
+        expected = exporter.file_path.read_text(encoding="utf-8")
+
+        Exporter(Normalizer.stream(reader.stream()), export_dir=tmp_path).exec()
+
+        assert exporter.file_path.read_text(encoding="utf-8") == expected
+
+
+class TestIncrementalIngest:
+    @pytest.fixture(autouse=True)
+    def setUp(
+            self, tmp_path: Path, backup_company_data: pandas.DataFrame,
+            monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        self.dir = tmp_path
+        shutil.copy(config.BASE_DIR.joinpath("backup", "data_0.xlsx"), tmp_path)
+        self.backup_company_data = backup_company_data
+        self.parsed_files = []
+        read_file_chunks = ReaderExcel.read_file_chunks
+
+        def counting_read_file_chunks(file, columns, chunk_size):
+            self.parsed_files.append(getattr(file, "name", "<memory>"))
+            return read_file_chunks(file, columns, chunk_size)
+
+        monkeypatch.setattr(
+            ReaderExcel, "read_file_chunks", staticmethod(counting_read_file_chunks)
+        )
+
+    def ingest(self, job_queue: JobQueue | None = None) -> NormalizedData:
+        reader = ReaderExcel()
+        reader.dir = self.dir
+        job_queue = job_queue or JobQueue(self.dir.joinpath("jobs.json"))
+        return CompanyBatch.concat(IncrementalIngest(reader, job_queue=job_queue).exec())
+
+    def test_rows_get_okved_of_their_job(self, cache: Path) -> None:
+        self.backup_company_data.head(5).to_excel(self.dir.joinpath("data_1.xlsx"), index=False)
+        queries = [{"okved": 63, "staff_min": 100, "pages": [1]}]
+        job_queue = JobQueue(self.dir.joinpath("jobs.json"), queries)
+        link_constructor = LinkConstructor(Cache(cache))
+        job_queue.sync(link_constructor, Cache(cache))
+        query_link = link_constructor.query_link(1, okved=63)
+        job_queue.mark_scraped(query_link, ["1"])
+        job_queue.get_content()["next_file"] = 1
+        job_queue.assign_files(link_constructor)
+
+        result = self.ingest(job_queue)
+
+        assert list(result.okved_main) == [62] * len(self.backup_company_data) + [63] * 5
+
+    def test_unchanged_files_are_not_parsed_again(self) -> None:
+        first_run = self.ingest()
+        second_run = self.ingest()
+
+        assert self.parsed_files == ["data_0.xlsx"]
+        assert second_run == first_run == Normalizer(self.backup_company_data).exec()
+
+    def test_only_new_or_changed_files_are_parsed(self) -> None:
+        self.ingest()
+        self.backup_company_data.head(10).to_excel(self.dir.joinpath("data_1.xlsx"), index=False)
+        self.backup_company_data.head(5).to_excel(self.dir.joinpath("data_0.xlsx"), index=False)
+
+        result = self.ingest()
+
+        assert self.parsed_files == ["data_0.xlsx", "data_0.xlsx", "data_1.xlsx"]
+        assert len(result) == 15
+        assert len(list(self.dir.joinpath("normalized").glob("*.pkl"))) == 2
+
+    def test_manifest_reports_changed_content(self) -> None:
+        manifest = Manifest(self.dir)
+        file = self.dir.joinpath("data_0.xlsx")
+        assert manifest.update(file)
+        assert not Manifest(self.dir).update(file)
+
+
+class TestStreamingIngest:
+    @pytest.fixture(autouse=True)
+    def setUp(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+        self.dir = tmp_path
+        self.reader = ReaderExcel()
+        self.reader.dir = tmp_path
+        self.content = config.BASE_DIR.joinpath("backup", "data_0.xlsx").read_bytes()
+        self.parsed_files = []
+        read_file_chunks = ReaderExcel.read_file_chunks
+
+        def counting_read_file_chunks(file, columns, chunk_size):
+            self.parsed_files.append(getattr(file, "name", "<memory>"))
+            return read_file_chunks(file, columns, chunk_size)
+
+        monkeypatch.setattr(
+            ReaderExcel, "read_file_chunks", staticmethod(counting_read_file_chunks)
+        )
+
+    def test_buffer_is_parsed_without_archiving_and_reused_later(
+            self, backup_company_data: pandas.DataFrame
+    ) -> None:
+        with StreamingIngest(self.reader, archive=False) as ingest:
+            ingest.submit("data_0.xlsx", BytesIO(self.content))
+
+        assert not list(self.dir.glob("*.xlsx"))
+        result = CompanyBatch.concat(IncrementalIngest(self.reader).exec())
+        assert self.parsed_files == ["<memory>"]
+        assert result == Normalizer(backup_company_data).exec()
+
+    def test_downloader_hands_responses_over(
+            self, xlsx_server: str, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        monkeypatch.setattr(MockXlsxHandler, "payload", self.content)
+        with StreamingIngest(self.reader) as ingest:
+            downloader = CompanyDataDownloader(
+                "cookie", [f"{xlsx_server}0"], backoff=0, ingest=ingest
+            )
+            downloader.exec()
+
+        assert downloader.downloaded == {0}
+        assert MockXlsxHandler.range_headers == [None]
+        assert self.dir.joinpath("data_0.xlsx").read_bytes() == self.content
+        assert len(list(self.dir.joinpath("normalized").glob("*.pkl"))) == 1
+        assert not Manifest(self.dir).update(self.dir.joinpath("data_0.xlsx"))
+
+
+class TestDumpIngest:
+    rows = [
+        ("7801234567", "ООО \"АЛЬФА\"", "150", "62.01", "190000, Г.САНКТ-ПЕТЕРБУРГ, УЛ ЛЕНИНА, Д. 1"),
+        ("7707083893", "ПАО \"БЕТА\"", "5000", "64.19", "117997, г Москва, УЛ ВАВИЛОВА, Д. 19"),
+        ("7702345678", "АО \"ГАММА\"", "40", "62.02", "125009, Г.МОСКВА, УЛ ТВЕРСКАЯ, Д. 2"),
+        ("1655012345", "ООО \"ДЕЛЬТА\"", "310", "62.09", "420000, РЕСП ТАТАРСТАН, Г. КАЗАНЬ"),
+    ]
+
+    @pytest.fixture(autouse=True)
+    def setUp(self, tmp_path: Path) -> None:
+        self.dir = tmp_path
+        blank = Normalizer.blank
+        self.expected = CompanyBatch.from_records([
+            CompanyData(
+                "7801234567", "ООО \"АЛЬФА\"", 150, "Г. САНКТ-ПЕТЕРБУРГ", blank, blank, "egrul", 62
+            ),
+            CompanyData(
+                "1655012345", "ООО \"ДЕЛЬТА\"", 310, "РЕСПУБЛИКА ТАТАРСТАН", blank, blank, "egrul", 62
+            ),
+        ])
+
+    def ingest(self, name: str, content: str) -> CompanyBatch:
+        dump = self.dir.joinpath(name)
+        dump.write_text(content, encoding="utf-8")
+        ingest = DumpIngest.create(dump, chunk_size=2, workers=1, source="egrul")
+        return CompanyBatch.concat(ingest.exec())
+
+    def test_rows_keep_okved_and_source_of_the_dump(self) -> None:
+        columns = ["inn", "full_name", "employees", "okved", "address"]
+        rows = [(*row[:3], "63.11", row[4]) for row in self.rows]
+        dump = self.dir.joinpath("egrul.csv")
+        pandas.DataFrame(rows, columns=columns).to_csv(dump, index=False)
+
+        batch = CompanyBatch.concat(DumpIngest.create(dump, okved="63", workers=1).exec())
+
+        assert set(batch.okved_main) == {63}
+        assert set(batch.source) == {"egrul.csv"}
+
+    def test_csv_dump_is_filtered_by_okved_and_staff(self) -> None:
+        columns = ["inn", "full_name", "employees", "okved", "address"]
+        content = pandas.DataFrame(self.rows, columns=columns).to_csv(sep=";", index=False)
+
+        assert self.ingest("egrul.csv", content) == self.expected
+
+    def test_sql_insert_and_copy_dumps_give_the_same_rows(self) -> None:
+        quoted = [
+            "(" + ",".join("'" + value.replace("'", "''") + "'" for value in row) + ")"
+            for row in self.rows
+        ]
+        insert = "\n".join([
+            "CREATE TABLE `companies` (",
+            "  `inn` varchar(12) NOT NULL,", "  `full_name` text,", "  `employees` int,",
+            "  `okved` varchar(8),", "  `address` text,", "  PRIMARY KEY (`inn`)", ");",
+            f"INSERT INTO `companies` VALUES {quoted[0]},{quoted[1]};",
+            f"INSERT INTO `companies` VALUES {quoted[2]},",
+            f"{quoted[3]};",
+        ])
+        copy = "\n".join([
+            "COPY public.companies (inn, full_name, employees, okved, address) FROM stdin;",
+            *("\t".join(row) for row in self.rows),
+            "\\.",
+        ])
+
+        assert self.ingest("dump.sql", insert) == self.expected
+        assert self.ingest("dump_copy.sql", copy) == self.expected
+
+    def test_process_pool_matches_single_process(self, backup_company_data: pandas.DataFrame) -> None:
+        dump = self.dir.joinpath("backup.csv")
+        backup_company_data.assign(okved="62.01").rename(
+            columns={source: column for source, column in config.DUMP_COLUMNS.items()}
+        ).to_csv(dump, index=False)
+
+        def ingest(workers: int) -> CompanyBatch:
+            return CompanyBatch.concat(DumpIngest.create(dump, chunk_size=50, workers=workers).exec())
+
+        expected = Normalizer(backup_company_data.astype({"ИНН": str})).exec()
+        expected.source = [dump.name] * len(expected)
+        assert ingest(2) == ingest(1) == expected
+
+
+class TestVectorizedNormalizer:
+    def test_matches_row_wise_normalizer_on_real_data(
+            self, backup_company_data: pandas.DataFrame
+    ) -> None:
+        expected = Normalizer(backup_company_data).exec()
+        assert VectorizedNormalizer(backup_company_data).exec() == expected
+
+    def test_matches_row_wise_normalizer_on_blanks(
+            self, irregular_company_data: pandas.DataFrame
+    ) -> None:
+        expected = Normalizer(irregular_company_data).exec()
+        result = VectorizedNormalizer(irregular_company_data).exec()
+        assert result == expected
+        assert result.region == [
+            "Г. САНКТ-ПЕТЕРБУРГ", "РЕСПУБЛИКА ТАТАРСТАН", "Г. МОСКВА"
+        ]
+
+
+class TestRegionResolver:
+    @pytest.fixture(autouse=True)
+    def setUp(self) -> None:
+        self.resolver = RegionResolver(unknown=Normalizer.blank)
+
+    @pytest.mark.parametrize("address, region", [
+        ("125167, Г.Москва, ВНУТРИГОРОДСКАЯ ТЕРРИТОРИЯ", "Г. МОСКВА"),
+        ("119017, МОСКВА ГОРОД, УЛ. БОЛЬШАЯ ОРДЫНКА, Д.24", "Г. МОСКВА"),
+        ("ГОРОД МОСКВА, УЛ. ТВЕРСКАЯ", "Г. МОСКВА"),
+        ("190013, САНКТ-ПЕТЕРБУРГ ГОРОД, ПРОСПЕКТ МОСКОВСКИЙ, Д. 60", "Г. САНКТ-ПЕТЕРБУРГ"),
+        ("143007, МОСКОВСКАЯ ОБЛАСТЬ, ОДИНЦОВСКИЙ, Г. Одинцово", "МОСКОВСКАЯ ОБЛАСТЬ"),
+        ("302000, ОБЛ ОРЛОВСКАЯ, Г ОРЁЛ", "ОРЛОВСКАЯ ОБЛАСТЬ"),
+        ("420500, РЕСПУБЛИКА ТАТАРСТАН (ТАТАРСТАН), Г. ИННОПОЛИС", "РЕСПУБЛИКА ТАТАРСТАН"),
+        ("450005, БАШКОРТОСТАН РЕСПУБЛИКА, Г. УФА", "РЕСПУБЛИКА БАШКОРТОСТАН"),
+        ("628400, ХАНТЫ-МАНСИЙСКИЙ АВТОНОМНЫЙ ОКРУГ - ЮГРА, Г. СУРГУТ",
+         "ХАНТЫ-МАНСИЙСКИЙ АВТОНОМНЫЙ ОКРУГ - ЮГРА"),
+        ("650000, КЕМЕРОВСКАЯ ОБЛАСТЬ - КУЗБАСС, Г КЕМЕРОВО", "КЕМЕРОВСКАЯ ОБЛАСТЬ - КУЗБАСС"),
+        ("ЯМАЛО-НЕНЕЦКИЙ АО, Г НОВЫЙ УРЕНГОЙ", "ЯМАЛО-НЕНЕЦКИЙ АВТОНОМНЫЙ ОКРУГ"),
+        ("Г. ЯРОСЛАВЛЬ, УЛ. МОСКОВСКАЯ", "—"),
+        ("—", "—"),
+    ])
+    def test_resolves_spelling_variants(self, address: str, region: str) -> None:
+        assert self.resolver.resolve(address) == region
+
+    def test_results_are_memoized_per_address(self) -> None:
+        for _ in range(3):
+            self.resolver.resolve("123112, Г.МОСКВА, НАБ. ПРЕСНЕНСКАЯ, Д. 10")
+
+        cache_info = self.resolver.resolve.cache_info()
+        assert (cache_info.misses, cache_info.hits) == (1, 2)
+
+
+class TestCompanyBatch:
+    def test_records_and_batches_round_trip(
+            self, backup_company_data: pandas.DataFrame
+    ) -> None:
+        batch = Normalizer(backup_company_data).exec()
+        records = list(batch)
+
+        assert CompanyBatch.from_records(records) == batch
+        assert CompanyBatch.concat([batch[:10], batch[10:]]) == batch
+        assert batch[0] == records[0]
+        assert not hasattr(records[0], "__dict__")
+        assert (records[0].source, records[0].okved_main) == ("www.list-org.com", 62)
+
+    def test_to_frame_fills_constant_columns(
+            self, backup_company_data: pandas.DataFrame
+    ) -> None:
+        batch = Normalizer(backup_company_data).exec()
+
+        data_frame = batch.to_frame()
+
+        assert sorted(data_frame.columns) == sorted(Exporter.columns_order)
+        assert data_frame["employees"].tolist() == list(batch.employees)
+        assert set(data_frame["okved_main"]) == {62}
+
+
+class TestCompanyStore:
+    @pytest.fixture(autouse=True)
+    def setUp(self, tmp_path: Path, backup_company_data: pandas.DataFrame) -> None:
+        self.batch = Normalizer(backup_company_data).exec()
+        self.store = CompanyStore(tmp_path.joinpath("companies.sqlite3"))
+        yield
+        self.store.connection.close()
+
+    def test_upsert_merges_repeated_runs(self) -> None:
+        assert self.store.upsert(self.batch) == len(self.batch) == len(self.store)
+        assert self.store.upsert(self.batch) == 0
+
+        record = self.batch[0]
+        record.employees += 1
+        assert self.store.upsert(CompanyBatch.from_records([record])) == 1
+        assert self.store.get(record.inn) == CompanyData(
+            str(record.inn), record.name, record.employees,
+            record.region, record.contacts, record.site
+        )
+        assert len(self.store) == len(self.batch)
+
+    def test_blank_fields_do_not_overwrite_known_ones(self) -> None:
+        record = self.batch[0]
+        self.store.upsert(CompanyBatch.from_records([record]))
+        blank = Normalizer.blank
+        from_search_page = CompanyData(record.inn, record.name, 0, record.region, blank, blank)
+
+        assert self.store.upsert(CompanyBatch.from_records([from_search_page])) == 0
+        assert self.store.get(record.inn).contacts == record.contacts
+
+    def test_get_and_find_return_every_stored_column(self) -> None:
+        record = replace(self.batch[0], source="egrul.csv", okved_main=63)
+        self.store.upsert(CompanyBatch.from_records([record]))
+
+        assert self.store.get(record.inn) == replace(record, inn=str(record.inn))
+        assert list(self.store.find(limit=1))[0].okved_main == 63
+
+    def test_companies_without_inn_are_skipped(self) -> None:
+        blank = Normalizer.blank
+        record = CompanyData(blank, blank, 100, blank, blank, blank)
+
+        assert self.store.upsert(CompanyBatch.from_records([record])) == 0
+        assert self.store.get(blank) is None
+
+    def test_find_filters_by_region_and_employees(self) -> None:
+        self.store.upsert(self.batch)
+
+        found = self.store.find(region="Г. МОСКВА", employees_min=200, employees_max=5000, limit=5)
+
+        assert 0 < len(found) <= 5
+        assert set(found.region) == {"Г. МОСКВА"}
+        assert all(200 <= employees <= 5000 for employees in found.employees)
+        assert list(found.employees) == sorted(found.employees, reverse=True)
+
+
+class TestValidator:
+    @pytest.fixture(autouse=True)
+    def setUp(self, tmp_path: Path) -> None:
+        self.reject_file = tmp_path.joinpath("rejected.csv")
+        self.validator = Validator(self.reject_file)
+
+    def validate(self, **column: list) -> CompanyBatch:
+        rows = len(next(iter(column.values())))
+        blank = Normalizer.blank
+        batch = CompanyBatch(
+            inn=column.get("inn", ["7707083893"] * rows),
+            name=["ООО \"А\""] * rows,
+            employees=array("q", [100] * rows),
+            region=["Г. МОСКВА"] * rows,
+            contacts=column.get("contacts", [blank] * rows),
+            site=column.get("site", [blank] * rows),
+        )
+        with self.validator:
+            return self.validator.exec(batch)
+
+    def test_inn_checksums(self) -> None:
+        inns = ["7707083893", 7707083893.0, "7707083894", "500100732259", "500100732258", "77070838"]
+        assert self.validate(inn=inns).inn == ["7707083893", "7707083893", "500100732259"]
+
+    def test_leading_zero_lost_in_xlsx_is_restored(self) -> None:
+        assert self.validate(inn=[278005403]).inn == ["0278005403"]
+
+    def test_companies_without_inn_are_kept(self) -> None:
+        assert self.validate(inn=[Normalizer.blank]).inn == [Normalizer.blank]
+
+    def test_phones_are_canonicalized_to_e164(self) -> None:
+        phones = [
+            "+7-495-927-48-98",
+            "8 (800) 700-78-68 доб. 123",
+            "919 778 07 94",
+            "+44 20 7946 0958",
+            "123-45",
+            Normalizer.blank,
+        ]
+        assert self.validate(contacts=phones).contacts == [
+            "+74959274898", "+78007007868", "+79197780794", "+442079460958",
+            Normalizer.blank, Normalizer.blank,
+        ]
+
+    def test_sites_are_canonicalized(self) -> None:
+        sites = ["www.Lukoil-Inform.ru/", "HTTPS://greenatom.ru/About/", "сайт.рф", "нет сайта"]
+        assert self.validate(site=sites).site == [
+            "http://www.lukoil-inform.ru", "https://greenatom.ru/About", "http://сайт.рф", Normalizer.blank,
+        ]
+
+    def test_rejects_are_written_with_reason(self) -> None:
+        self.validate(inn=["7707083894", "7707083893"], contacts=["12", Normalizer.blank])
+
+        rejected = pandas.read_csv(self.reject_file, dtype=str)
+        assert rejected["inn"].tolist() == ["7707083894"]
+        assert rejected["contacts"].tolist() == ["12"]
+        assert rejected["reason"].tolist() == ["inn,phone"]
+        assert self.validator.rejected == {"inn": 1, "phone": 1}
+
+    def test_backup_companies_are_valid(self, backup_company_data: pandas.DataFrame) -> None:
+        normalized_data = Normalizer(backup_company_data).exec()
+        with self.validator:
+            validated = self.validator.exec(normalized_data)
+        assert len(validated) == len(normalized_data)
+        assert not self.reject_file.exists()
+
+
+class TestExporterFormats:
+    @pytest.fixture(autouse=True)
+    def setUp(
+            self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch,
+            backup_company_data: pandas.DataFrame
+    ) -> None:
+        monkeypatch.setattr("src.app.EXPORT_DIR", tmp_path)
+        normalized_data = Normalizer(backup_company_data).exec()
+        self.batches = [normalized_data[:60], normalized_data[40:]]  # 20 общих ИНН
+        self.expected = normalized_data.to_frame()
+
+    @pytest.mark.parametrize("format", ["csv", "csv.gz", "csv.zst"])
+    def test_csv_formats_deduplicate_inn_across_batches(self, format: str) -> None:
+        if format == "csv.zst":
+            pytest.importorskip("zstandard")
+        exporter = Exporter(iter(self.batches), format=format)
+        exporter.exec()
+
+        result = pandas.read_csv(exporter.file_path)
+        assert exporter.rows == len(result) == len(self.expected)
+        assert result["inn"].tolist() == self.expected["inn"].tolist()
+
+    def test_jsonl_keeps_integer_columns(self) -> None:
+        exporter = Exporter(iter(self.batches), format="jsonl")
+        exporter.exec()
+
+        result = pandas.read_json(exporter.file_path, lines=True)
+        assert len(result) == len(self.expected)
+        assert result["employees"].tolist() == self.expected["employees"].tolist()
+
+    def test_parquet_has_typed_columns(self) -> None:
+        pytest.importorskip("pyarrow")
+        exporter = Exporter(iter(self.batches), format="parquet")
+        exporter.exec()
+
+        result = pandas.read_parquet(exporter.file_path)
+        assert len(result) == len(self.expected)
+        assert result["employees"].dtype == "int64"
+        assert result["okved_main"].dtype == "int64"
+        assert result["region"].dtype == "category"
+
+    def test_rows_without_inn_are_kept(self) -> None:
+        blank = Normalizer.blank
+        row = CompanyData(blank, blank, 100, blank, blank, blank)
+        exporter = Exporter(CompanyBatch.from_records([row, row]))
+        exporter.exec()
+        assert len(pandas.read_csv(exporter.file_path)) == 2
+
+
+class TestExporterDelta:
+    @pytest.fixture(autouse=True)
+    def setUp(self, tmp_path: Path, backup_company_data: pandas.DataFrame) -> None:
+        self.export_dir = tmp_path
+        self.normalized_data = Normalizer(backup_company_data).exec()
+        self.inns = self.normalized_data.to_frame()["inn"].astype(str).tolist()
+
+    def export(self, batch: CompanyBatch, format: str = "csv", **kwargs) -> Exporter:
+        exporter = Exporter(batch, format, self.export_dir, **kwargs)
+        exporter.exec()
+        return exporter
+
+    def delta(self, format: str = "csv") -> pandas.DataFrame:
+        path = self.export_dir.joinpath(f"companies.delta.{format}")
+        if format == "parquet":
+            return pandas.read_parquet(path)
+        return pandas.read_csv(path, dtype={"inn": str})
+
+    def test_first_export_adds_every_company(self) -> None:
+        exporter = self.export(self.normalized_data)
+
+        delta = self.delta()
+        assert delta["inn"].tolist() == self.inns
+        assert set(delta["change"]) == {"added"}
+        assert exporter.changes["added"] == len(self.inns)
+
+    def test_second_export_emits_only_changes(self) -> None:
+        self.export(self.normalized_data[:60])
+        records = list(self.normalized_data[10:])
+        records[0] = replace(records[0], name="ООО Новое имя")
+
+        exporter = self.export(CompanyBatch.from_records(records))
+
+        delta = self.delta().set_index("inn")["change"]
+        assert delta[self.inns[10]] == "changed"
+        assert (delta[self.inns[60:]] == "added").all()
+        assert (delta[self.inns[:10]] == "removed").all()
+        assert len(delta) == 1 + len(self.inns[60:]) + 10
+        assert exporter.changes["unchanged"] == 49
+        assert self.export_dir.joinpath("companies.csv").exists()
+
+    def test_removed_rows_carry_only_inn(self) -> None:
+        self.export(self.normalized_data[:2])
+        self.export(self.normalized_data[1:2])
+
+        removed = self.delta().iloc[0]
+        assert removed["inn"] == self.inns[0]
+        assert (removed["employees"], removed["okved_main"]) == (0, 0)
+        assert {removed[column] for column in ("name", "region", "contacts", "site", "source")} == {
+            Normalizer.blank
+        }
+
+    def test_separate_state_files_do_not_see_each_others_rows(self) -> None:
+        self.export(self.normalized_data[:60])
+        self.export(self.normalized_data[60:], state_file=self.export_dir.joinpath("dump.sqlite3"))
+
+        self.export(self.normalized_data[:60])
+        assert self.delta().empty
+
+    def test_unchanged_export_writes_empty_delta(self) -> None:
+        self.export(self.normalized_data)
+        self.export(self.normalized_data, snapshot=False)
+        assert self.delta().empty
+
+    def test_failed_export_keeps_previous_state(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        self.export(self.normalized_data[:60])
+
+        def fail(*args) -> None:
+            raise OSError("disk full")
+        monkeypatch.setattr(ExportState, "removed", fail)
+        with pytest.raises(OSError):
+            self.export(self.normalized_data)
+        monkeypatch.undo()
+
+        self.export(self.normalized_data)
+        assert self.delta()["inn"].tolist() == self.inns[60:]
+
+    def test_parquet_delta_has_change_column(self) -> None:
+        pytest.importorskip("pyarrow")
+        self.export(self.normalized_data[:60], "parquet")
+        self.export(self.normalized_data[10:], "parquet")
+
+        delta = self.delta("parquet")
+        assert delta["employees"].dtype == "int64"
+        assert sorted(set(delta["change"])) == ["added", "removed"]
+
+    def test_snapshot_and_delta_cannot_both_be_off(self) -> None:
+        with pytest.raises(ValueError):
+            Exporter(self.normalized_data, snapshot=False, delta=False)
+
+
+class TestBenchmark:
+    def test_synthetic_files_match_source_schema(self, tmp_path: Path) -> None:
+        SyntheticData().write_files(tmp_path, files=2, rows=30)
+        reader = ReaderExcel()
+        reader.dir = tmp_path
+
+        company_data = reader.exec()
+
+        assert len(company_data) == 60
+        assert company_data["ИНН"].is_unique
+        assert len(Normalizer(company_data).exec()) == 60
+
+    def test_report_covers_every_stage(self) -> None:
+        report = Benchmark(rows=20, files=2, memory=False).exec()
+
+        assert set(report["stages"]) == {
+            "read", "read_stream", "normalize_rows", "normalize_vectorized", "validate",
+            "export_csv", "export_jsonl", "end_to_end", "download",
+        }
+        assert all(stage["rows"] == 40 for stage in report["stages"].values())
+        assert report["params"] == {"rows": 20, "files": 2, "seed": 0}
+
+
 class TestExporter:
     def test_exec_creates_companies_csv(self) -> None:
         company_data = ReaderExcel().exec()
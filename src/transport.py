@@ -0,0 +1,177 @@
+"""
+Запись и воспроизведение ответов list-org для запусков без сети.
+
+В режиме TRANSPORT = "record" пайплайн работает как обычно, но каждая
+страница list-org, открытая в Playwright или запрошенная через requests, и
+user cookie сохраняются в RECORDING_DIR. В режиме "replay" те же ответы
+отдаются из папки: Playwright через route, requests через адаптер
+сессии. Запроса, которого нет в записи, в сеть не уходит: requests
+получает ConnectionError, а браузер прерванную навигацию.
+
+Очередь заданий, кэш ID, xlsx и выгрузка таких запусков лежат в
+RECORDING_DIR/state/{режим}, а не рядом с рабочими: запись не отмечает
+рабочие задания скачанными, а воспроизведение идёт по своей очереди и
+проходит весь записанный прогон
+"""
+import hashlib, re, threading
+from io import BytesIO
+from pathlib import Path
+from typing import TYPE_CHECKING, override
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from src.app import CookieStore, LinkConstructor
+from src.config import RECORDING_DIR
+from src.utils import Base, ReaderJSON
+
+if TYPE_CHECKING:
+    from playwright.sync_api import BrowserContext, Route
+
+
+class Recording(Base, ReaderJSON):
+    """
+    index.json: URL -> статус, заголовки и имя файла с телом ответа в
+    bodies/. Запись идёт из нескольких потоков загрузки, поэтому через lock
+    """
+    modes = ("record", "replay")
+    kept_headers = ("Content-Type", "ETag", "Last-Modified")
+
+    @override
+    def __init__(self, mode: str, dir: Path = RECORDING_DIR) -> None:
+        if mode not in self.modes:
+            raise ValueError(f"Unknown transport mode: {mode}")
+        super().__init__(dir.joinpath("index.json"))
+        self.mode = mode
+        self.dir = dir
+        self.bodies_dir = dir.joinpath("bodies")
+        self.state_dir = dir.joinpath("state", mode)  # Очередь, кэш и выгрузка запуска, отдельно от рабочих
+        self.bodies_dir.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.entries: dict[str, dict] = self.load() if self.file_path.exists() else {}
+        self.base_url = LinkConstructor.base_url
+
+    @property
+    def cookie_store(self) -> CookieStore:
+        cookie_file = self.dir.joinpath("cookies.json")
+        if self.mode == "replay":
+            return RecordedCookieStore(cookie_file)
+        return CookieStore(cookie_file)
+
+    def save(self, url: str, status: int, headers: dict[str, str], body: bytes) -> None:
+        file_name = hashlib.sha1(url.encode()).hexdigest()
+        self.bodies_dir.joinpath(file_name).write_bytes(body)
+        headers = CaseInsensitiveDict(headers)
+        entry = {
+            "status": status,
+            "headers": {name: headers[name] for name in self.kept_headers if name in headers},
+            "file": file_name,
+        }
+        with self.lock:
+            self.entries[url] = entry
+            self.dump(self.entries)
+
+    def get(self, url: str) -> tuple[int, dict[str, str], bytes] | None:
+        entry = self.entries.get(url)
+        if not entry:
+            return None
+        body = self.bodies_dir.joinpath(entry["file"]).read_bytes()
+        return entry["status"], entry["headers"], body
+
+    def mount(self, session: requests.Session) -> None:
+        adapter = ReplayAdapter(self) if self.mode == "replay" else RecordAdapter(self)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+    def attach(self, context: "BrowserContext", user_cookie: str | None = None) -> None:
+        """
+        Добавляется после остальных route контекста и поэтому вызывается
+        первым. При воспроизведении записанный cookie кладётся в контекст,
+        как будто его выдал сайт
+        """
+        if self.mode == "replay":
+            if user_cookie:
+                context.add_cookies([{"name": "user", "value": user_cookie, "url": self.base_url}])
+            context.route("**/*", self.replay_route)
+        else:
+            context.route(re.compile(re.escape(self.base_url)), self.record_route)
+
+    def record_route(self, route: "Route") -> None:
+        request = route.request
+        if request.method != "GET" or request.resource_type not in {"document", "xhr", "fetch"}:
+            route.fallback()
+            return
+        response = route.fetch()
+        body = response.body()
+        self.save(request.url, response.status, response.headers, body)
+        route.fulfill(response=response, body=body)
+
+    def replay_route(self, route: "Route") -> None:
+        recorded = self.get(route.request.url)
+        if not recorded:
+            route.abort()  # Картинки, скрипты и всё, что не записано, в сеть не уходит
+            return
+        status, headers, body = recorded
+        route.fulfill(status=status, headers=headers, body=body)
+
+
+class RecordedCookieStore(CookieStore):
+    """
+    Записанный cookie отдаётся и после истечения срока: сайт его уже не
+    проверяет. Воспроизведение запись не меняет
+    """
+    @override
+    def get(self) -> str | None:
+        if not self.file_path.exists():
+            return None
+        return self.load()["value"]
+
+    @override
+    def save(self, value: str, expires: float = -1) -> None:
+        pass
+
+    @override
+    def clear(self) -> None:
+        pass
+
+
+class RecordAdapter(HTTPAdapter):
+    @override
+    def __init__(self, recording: Recording) -> None:
+        super().__init__()
+        self.recording = recording
+
+    @override
+    def send(self, request: requests.PreparedRequest, *args, **kwargs) -> requests.Response:
+        response = super().send(request, *args, **kwargs)
+        if request.method == "GET" and response.status_code == 200:  # 206 и 304 — не полный ответ
+            self.recording.save(request.url, response.status_code, response.headers, response.content)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    @override
+    def __init__(self, recording: Recording) -> None:
+        super().__init__()
+        self.recording = recording
+
+    @override
+    def send(self, request: requests.PreparedRequest, *args, **kwargs) -> requests.Response:
+        recorded = self.recording.get(request.url)
+        if not recorded:
+            raise requests.ConnectionError(f"{request.url} is not in the recording", request=request)
+        status, headers, body = recorded
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = BytesIO(body)
+        response.url = request.url
+        response.request = request
+        return response
+
+    @override
+    def close(self) -> None:
+        pass
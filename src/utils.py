@@ -1,4 +1,4 @@
-import json, logging, logging.config
+import atexit, importlib, json, logging, logging.config, logging.handlers, os, tempfile, threading
 from pathlib import Path
 
 from src.config import LOGGING_CONFIG
@@ -12,15 +12,38 @@ class Base:
 
 
 class LoggingConfig:
+    """
+    Конфиг из logger_config.json применяется один раз на процесс. Если логгер
+    пишет в QueueHandler (handler "queue" в конфиге), то запись в файлы и
+    stdout идёт в отдельном потоке QueueListener. Чтобы писать синхронно,
+    достаточно указать у логгера реальные handlers вместо "queue"
+    """
+    configured = False
+    lock = threading.Lock()
+
     @classmethod
     def get_logger(cls) -> logging.Logger:
-        cls.load_config()
+        if not cls.configured:
+            with cls.lock:
+                if not cls.configured:
+                    cls.load_config()
+                    cls.configured = True
         return logging.getLogger("scriptorium")
 
     @staticmethod
     def load_config() -> None:
         config = ReaderJSON(LOGGING_CONFIG).load()
         logging.config.dictConfig(config)
+        LoggingConfig.start_queue_listeners()
+
+    @staticmethod
+    def start_queue_listeners() -> None:
+        for name in logging.getHandlerNames():
+            handler = logging.getHandlerByName(name)
+            listener = getattr(handler, "listener", None)
+            if isinstance(handler, logging.handlers.QueueHandler) and listener:
+                listener.start()
+                atexit.register(listener.stop)  # Дописывает очередь до выхода
 
 
 class ReaderJSON:
@@ -33,8 +56,33 @@ class ReaderJSON:
         return content
 
     def dump(self, data: dict) -> None:
-        with open(self.file_path, "w", encoding="utf-8") as file:
-            json.dump(data, file, indent=4, ensure_ascii=False)
+        """
+        Пишет во временный файл рядом с целевым и подменяет его через
+        os.replace, чтобы прерванный запуск не оставил битый JSON
+        """
+        file_descriptor, temp_path = tempfile.mkstemp(
+            dir=Path(self.file_path).parent, suffix=".tmp"
+        )
+        try:
+            with os.fdopen(file_descriptor, "w", encoding="utf-8") as file:
+                json.dump(data, file, indent=4, ensure_ascii=False)
+            os.replace(temp_path, self.file_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+
+class LazyModule:
+    """
+    Модуль импортируется при первом обращении к его атрибуту. Тяжёлые
+    зависимости (pandas, playwright, requests) нужны не каждому этапу,
+    а их импорт занимает большую часть холодного старта
+    """
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __getattr__(self, attr: str):
+        return getattr(importlib.import_module(self.name), attr)
 
 
 class OnlyInfoFilter(logging.Filter):